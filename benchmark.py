@@ -0,0 +1,265 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+import warnings
+import numpy as np
+import sklearn
+import yaml
+from feature_engineering import feature_engineering_single_file, feature_engineering_all_files, feature_names
+from feature_store import create_feature_store, append_rows, open_feature_store
+from inference import load_models, score_in_chunks
+from metrics import max_rss_bytes
+from synthetic_midi import write_corpus
+from training import MODEL_NAMES, fit_model
+
+# Scaling curves of each preset:
+#   single_file : notes per file, timed on a few files of that size
+#   all_files   : number of files of a corpus, each of 'notes_per_file' notes
+#   rows        : number of feature rows the models are fitted on and score
+PRESETS = {
+    'quick': {'single_file': [1000, 10000, 100000], 'all_files': [100, 1000], 'rows': [1000, 10000]},
+    'full': {'single_file': [1000, 10000, 100000, 1000000], 'all_files': [1000, 10000, 100000],
+             'rows': [1000, 10000, 100000]},
+}
+# Cold start of each command of main.py: the module it imports first, timed in a fresh interpreter,
+# together with the heavy dependencies that import pulled in
+COLD_START = {'cli': 'main', 'ingest': 'data_preparation', 'dedup': 'dedup', 'extract': 'feature_engineering',
+              'train': 'training', 'score': 'inference', 'stream': 'streaming', 'serve': 'scoring_server'}
+HEAVY_MODULES = ('sklearn', 'scipy', 'pandas', 'pretty_midi', 'matplotlib')
+_IMPORT_SCRIPT = ("import sys, time; start = time.perf_counter(); import {module}; "
+                  "print(time.perf_counter() - start, *[name for name in {heavy} if name in sys.modules])")
+
+
+def measure_import(module: str, repeats: int = 5) -> dict:
+    """
+    Time to import a module of this project in a fresh interpreter (the median of 'repeats' runs, so
+    that it is measured with the files in the page cache), and the heavy dependencies it imports.
+
+    Output      : 'seconds' and 'heavy_modules'
+    Output_type : Dictionary
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, cwd=folder, check=True).stdout.split()
+        times.append(float(output[0]))
+    return {'seconds': float(np.median(times)), 'heavy_modules': output[1:]}
+
+
+def _measured_child(connection, function, args):
+    baseline = max_rss_bytes()
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except BaseException:
+        # reported by the parent, which would otherwise wait for a result forever
+        connection.send({'error': traceback.format_exc()})
+        connection.close()
+        raise
+    elapsed = time.perf_counter() - start
+    connection.send({'result': result, 'seconds': elapsed, 'peak_rss_bytes': max_rss_bytes(),
+                     'baseline_rss_bytes': baseline, 'peak_rss_children_bytes': max_rss_bytes(children=True)})
+    connection.close()
+
+
+def measure(function, *args) -> dict:
+    """
+    Runs function(*args) in a forked process and reports its wall time and the peak resident memory of
+    that process (and of the worker processes it started), so that cases do not inherit each other's
+    memory high-water mark. Where fork is unavailable the function runs in this process.
+    A RuntimeError is raised if the function raises or its process dies before returning.
+
+    Output      : Result of the call, 'seconds', 'peak_rss_bytes', 'baseline_rss_bytes' (peak at the start
+                  of the process, inherited from the parent) and 'peak_rss_children_bytes'
+    Output_type : Dictionary
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        start = time.perf_counter()
+        result = function(*args)
+        return {'result': result, 'seconds': time.perf_counter() - start, 'peak_rss_bytes': max_rss_bytes(),
+                'baseline_rss_bytes': None, 'peak_rss_children_bytes': None}
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measured_child, args=(sender, function, args))
+    process.start()
+    # the pipe reaches its end when the child exits without sending, only once the parent's end is closed too
+    sender.close()
+    try:
+        measured = receiver.recv()
+    except EOFError:
+        measured = None
+    process.join()
+    if measured is None or process.exitcode != 0:
+        error = measured['error'] if measured else f'exit code {process.exitcode}'
+        raise RuntimeError(f"Measuring {getattr(function, '__name__', function)} failed: {error}")
+    return measured
+
+
+def _extract_files(paths: list, options: dict) -> int:
+    rows = [feature_engineering_single_file(path, **options) for path in paths]
+    return sum(row is not None for row in rows)
+
+
+def _extract_folder(folder: str, options: dict) -> int:
+    return int(feature_engineering_all_files(folder, **options).shape[0])
+
+
+def _score(parameters: dict, chunk_size: int) -> dict:
+    store = open_feature_store(parameters['artifacts']['training'])
+    models = load_models(parameters['artifacts']['models'])
+    return score_in_chunks(store.features, store.file_ids, models, os.devnull, chunk_size)
+
+
+def _case(benchmark: str, size_name: str, size: int, measured: dict, items: int, **extra) -> dict:
+    case = {'benchmark': benchmark, size_name: size, 'seconds': measured['seconds'],
+            'per_s': items / measured['seconds'] if measured['seconds'] else None,
+            'peak_rss_bytes': measured['peak_rss_bytes'], 'baseline_rss_bytes': measured['baseline_rss_bytes'],
+            'peak_rss_children_bytes': measured['peak_rss_children_bytes']}
+    case.update(extra)
+    print(f"{benchmark:12s} {size_name}={size:<8d} {extra.get('model', ''):24s} {case['per_s']:12.1f} /s  "
+          f"peak RSS {(case['peak_rss_bytes'] or 0) / 2 ** 20:8.1f} MB")
+    return case
+
+
+def run_benchmarks(parameters: dict, preset: str = None) -> dict:
+    """
+    Runs the benchmark suite on synthetic corpora (see synthetic_midi.py) with the extraction, training
+    and inference settings of parameters.yaml, and returns the results with the environment they ran in.
+
+    Measured first, the import time of each command of main.py (COLD_START, see measure_import), then
+    along the scaling curves of the preset (PRESETS):
+        single_file : feature_engineering_single_file, files/s and notes/s against notes per file
+        all_files   : feature_engineering_all_files (no cache, no store), files/s against corpus size
+        fit         : training.fit_model for each model, rows/s against training rows
+        score       : inference.score_in_chunks with all models, rows/s against test rows
+    Training and test rows are drawn from the features of the smallest all_files corpus, with 1 %
+    multiplicative noise, so the models see realistic feature distributions at any size.
+
+    Input 1     : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Input 2     : Name of the preset, the one of the benchmark section of parameters.yaml if None
+    Input_type  : String
+
+    Output      : Environment and one result per case
+    Output_type : Dictionary
+    """
+    settings = parameters['benchmark']
+    curves = PRESETS[preset or settings['preset']]
+    corpora = os.path.join(settings['folder'], 'corpora')
+    corpus = {key: settings[key] for key in ('n_instruments', 'duration', 'n_tempo_changes', 'seed')}
+    extraction = dict(parameters['feature_engineering'], **parameters['features'])
+    single_options = {key: extraction[key] for key in ('backend', 'groups', 'tempo_estimator')}
+    cases = []
+
+    for command, module in COLD_START.items():
+        measured = measure_import(module)
+        cases.append({'benchmark': 'cold_start', 'command': command, 'module': module,
+                      'seconds': measured['seconds'], 'per_s': 1. / measured['seconds'],
+                      'heavy_modules': measured['heavy_modules'], 'peak_rss_bytes': None})
+        print(f"{'cold_start':12s} {command:17s} import {module:24s} {measured['seconds'] * 1000:8.1f} ms  "
+              f"{' '.join(measured['heavy_modules'])}")
+
+    for n_notes in curves['single_file']:
+        # fewer files of the largest sizes, at least a couple of seconds of work overall
+        n_files = max(2, min(20, 200000 // n_notes))
+        paths = write_corpus(os.path.join(corpora, f'notes_{n_notes}'), n_files, n_notes, **corpus)
+        measured = measure(_extract_files, paths, single_options)
+        cases.append(_case('single_file', 'notes_per_file', n_notes, measured, n_files,
+                           notes_per_s=n_files * n_notes / measured['seconds'], failed=n_files - measured['result']))
+
+    for n_files in curves['all_files']:
+        folder = os.path.join(corpora, f"files_{n_files}_notes_{settings['notes_per_file']}")
+        write_corpus(folder, n_files, settings['notes_per_file'], **corpus)
+        measured = measure(_extract_folder, folder, extraction)
+        cases.append(_case('all_files', 'files', n_files, measured, n_files,
+                           n_workers=extraction['n_workers'], extracted=measured['result']))
+
+    smallest = os.path.join(corpora, f"files_{curves['all_files'][0]}_notes_{settings['notes_per_file']}")
+    base_rows = feature_engineering_all_files(smallest, **extraction)
+    rng = np.random.default_rng(settings['seed'])
+    for n_rows in curves['rows']:
+        rows = base_rows[rng.integers(0, base_rows.shape[0], size=n_rows)]
+        rows = rows * (1 + 0.01 * rng.standard_normal(rows.shape))
+        run_parameters = dict(parameters, artifacts=dict(parameters['artifacts'],
+                                                         training=os.path.join(settings['folder'], 'rows_store'),
+                                                         models=os.path.join(settings['folder'], 'models')))
+        create_feature_store(run_parameters['artifacts']['training'], feature_names(extraction['groups']), 'benchmark')
+        append_rows(run_parameters['artifacts']['training'], [str(i) for i in range(n_rows)], rows)
+        os.makedirs(run_parameters['artifacts']['models'], exist_ok=True)
+        for name in MODEL_NAMES:
+            cases.append(_case('fit', 'rows', n_rows, measure(fit_model, name, run_parameters), n_rows, model=name))
+        measured = measure(_score, run_parameters, parameters['inference']['chunk_size'])
+        cases.append(_case('score', 'rows', n_rows, measured, n_rows, models=list(MODEL_NAMES)))
+
+    return {'environment': _environment(), 'preset': preset or settings['preset'],
+            'settings': {'corpus': dict(corpus, notes_per_file=settings['notes_per_file']),
+                         'extraction': extraction, 'training': parameters['training']},
+            'cases': cases}
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'sklearn': sklearn.__version__, 'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare_results(old: dict, new: dict) -> list:
+    """
+    Matches the cases of two benchmark results and gives the throughput and peak memory ratios new / old.
+
+    Output      : One row per case present in both results
+    Output_type : List
+    """
+    def key(case):
+        return tuple((name, case.get(name)) for name in ('benchmark', 'command', 'notes_per_file', 'files', 'rows',
+                                                         'model'))
+
+    old_cases = {key(case): case for case in old['cases']}
+    rows = []
+    for case in new['cases']:
+        previous = old_cases.get(key(case))
+        if previous is None:
+            continue
+        rows.append({'case': ' '.join(f'{name}={value}' for name, value in key(case) if value is not None),
+                     'throughput_ratio': case['per_s'] / previous['per_s'] if previous['per_s'] else None,
+                     'peak_rss_ratio': case['peak_rss_bytes'] / previous['peak_rss_bytes']
+                     if case['peak_rss_bytes'] and previous['peak_rss_bytes'] else None})
+    return rows
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    parser = argparse.ArgumentParser(description='Throughput and memory benchmarks on synthetic MIDI corpora')
+    parser.add_argument('--preset', choices=sorted(PRESETS), help='scaling curves, see benchmark.PRESETS')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two saved results instead')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            comparison = compare_results(json.load(f_old), json.load(f_new))
+        for row in comparison:
+            print(f"{row['case']:55s} throughput x{row['throughput_ratio']:.2f}  peak RSS x{row['peak_rss_ratio'] or 0:.2f}")
+    else:
+        with open('parameters.yaml', 'r') as f:
+            parameters = yaml.safe_load(f)
+        results = run_benchmarks(parameters, args.preset)
+        results_folder = os.path.join(parameters['benchmark']['folder'], 'results')
+        os.makedirs(results_folder, exist_ok=True)
+        results_path = os.path.join(results_folder, f"{time.strftime('%Y%m%d-%H%M%S')}_"
+                                                    f"{results['environment']['commit'] or 'nogit'}.json")
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Benchmark results saved as {results_path}')
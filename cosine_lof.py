@@ -0,0 +1,223 @@
+import time
+import numpy as np
+
+
+def _normalize(X: np.ndarray, dtype) -> np.ndarray:
+    X = np.asarray(X, dtype=dtype)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    # like sklearn, all-zero rows stay zero and end up at cosine distance 1 from everything
+    norms[norms == 0] = 1
+    return X / norms
+
+
+_PARAMETER_NAMES = ('n_neighbors', 'block_size', 'dtype', 'index', 'n_lists', 'n_probe', 'random_state')
+
+
+class CosineLOF:
+    """
+    Local Outlier Factor with the cosine metric, for novelty detection on large training sets.
+
+    Drop-in replacement for LocalOutlierFactor(n_neighbors, novelty=True, metric='cosine'): same
+    predict / decision_function / score_samples and same scores. Training vectors are normalized
+    once, so cosine distances become 1 - dot products, and the k nearest neighbours of a block of
+    queries are found with one matrix product against the training set followed by a partial sort.
+    Memory stays bounded by 'block_size' x n_train distances instead of the full distance matrix.
+    The k-distances and local reachability densities of the training points are computed at fit time.
+
+    With index='ivf' the neighbours are approximate: training vectors are partitioned into 'n_lists'
+    cells around spherical k-means centroids and a query only scans the 'n_probe' cells whose
+    centroids are most similar to it, which trades some neighbour recall for sub-linear queries.
+    """
+
+    def __init__(self, n_neighbors: int = 20, block_size: int = 1024, dtype: str = 'float64',
+                 index: str = 'exact', n_lists: int = None, n_probe: int = 8, random_state: int = 0):
+        if index not in ('exact', 'ivf'):
+            raise ValueError(f"Unknown index '{index}', expected 'exact' or 'ivf'")
+        self.n_neighbors = n_neighbors
+        self.block_size = block_size
+        self.dtype = np.dtype(dtype)
+        self.index = index
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def get_params(self, deep: bool = True) -> dict:
+        # the part of the sklearn estimator interface a Pipeline uses, implemented here so that
+        # unpickling a fitted model for scoring does not import sklearn
+        return {name: getattr(self, name) for name in _PARAMETER_NAMES}
+
+    def set_params(self, **params) -> 'CosineLOF':
+        for name, value in params.items():
+            if name not in _PARAMETER_NAMES:
+                raise ValueError(f"Invalid parameter '{name}' for CosineLOF, expected one of {_PARAMETER_NAMES}")
+            setattr(self, name, np.dtype(value) if name == 'dtype' else value)
+        return self
+
+    def __sklearn_tags__(self):
+        from sklearn.utils import Tags, TargetTags
+        return Tags(estimator_type='outlier_detector', target_tags=TargetTags(required=False))
+
+    def _build_ivf(self, n_iterations: int = 10) -> None:
+        rng = np.random.default_rng(self.random_state)
+        n_lists = self.n_lists or max(1, int(np.sqrt(self.n_samples_fit_)))
+        centroids = self._fit_X[rng.choice(self.n_samples_fit_, size=min(n_lists, self.n_samples_fit_),
+                                           replace=False)]
+        for _ in range(n_iterations):
+            assignment = np.argmax(self._fit_X @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self._fit_X)
+            filled = np.bincount(assignment, minlength=len(centroids)) > 0
+            centroids[filled] = _normalize(sums[filled], self.dtype)
+        assignment = np.argmax(self._fit_X @ centroids.T, axis=1)
+        # training rows sorted by cell, so every cell is a contiguous slice
+        self._ivf_order = np.argsort(assignment, kind='stable')
+        self._ivf_X = self._fit_X[self._ivf_order]
+        self._ivf_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+        self._centroids = centroids
+
+    def _kneighbors_ivf(self, Q: np.ndarray, k: int, exclude_self: bool = False) -> tuple:
+        n_query = k + 1 if exclude_self else k
+        n_probe = min(self.n_probe, len(self._centroids))
+        probes = np.argsort(-(Q @ self._centroids.T), axis=1)[:, :n_probe]
+        distances = np.empty((Q.shape[0], k))
+        indices = np.empty((Q.shape[0], k), dtype=np.int64)
+        for i, q in enumerate(Q):
+            slices = [np.arange(self._ivf_offsets[c], self._ivf_offsets[c + 1]) for c in probes[i]]
+            candidates = np.concatenate(slices)
+            if candidates.shape[0] < n_query:
+                # the probed cells are too small, fall back to an exact scan for this query
+                candidates = np.arange(self.n_samples_fit_)
+            candidate_distances = np.clip(1. - self._ivf_X[candidates] @ q, 0., 2.)
+            best = np.argpartition(candidate_distances, n_query - 1)[:n_query] \
+                if n_query < candidates.shape[0] else np.arange(candidates.shape[0])
+            best = best[np.argsort(candidate_distances[best], kind='stable')]
+            neighbors = self._ivf_order[candidates[best]]
+            if exclude_self:
+                keep = neighbors != i
+                if keep.all():
+                    keep[-1] = False
+                best, neighbors = best[keep], neighbors[keep]
+            indices[i] = neighbors
+            distances[i] = candidate_distances[best]
+        return distances, indices
+
+    def _kneighbors(self, Q: np.ndarray, k: int, exclude_self: bool = False) -> tuple:
+        # Q is normalized; returns the distances and indices of the k nearest training vectors, sorted
+        if self.index == 'ivf':
+            return self._kneighbors_ivf(Q, k, exclude_self)
+        distances = np.empty((Q.shape[0], k))
+        indices = np.empty((Q.shape[0], k), dtype=np.int64)
+        n_query = k + 1 if exclude_self else k
+        for start in range(0, Q.shape[0], self.block_size):
+            # in place, a block of distances is the largest array of the search
+            block = Q[start:start + self.block_size] @ self._fit_X.T
+            np.clip(np.subtract(1., block, out=block), 0., 2., out=block)
+            rows = np.arange(block.shape[0])[:, None]
+            if n_query < block.shape[1]:
+                candidates = np.argpartition(block, n_query - 1, axis=1)[:, :n_query]
+            else:
+                candidates = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+            order = np.argsort(block[rows, candidates], axis=1, kind='stable')
+            candidates = candidates[rows, order]
+            if exclude_self:
+                # drop the query point itself, or the farthest candidate if ties pushed it out
+                own = np.arange(start, start + block.shape[0])[:, None]
+                keep = candidates != own
+                keep[keep.all(axis=1), -1] = False
+                candidates = candidates[keep].reshape(block.shape[0], k)
+            indices[start:start + block.shape[0]] = candidates
+            distances[start:start + block.shape[0]] = block[rows, candidates]
+        return distances, indices
+
+    def _local_reachability_density(self, distances: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        reach_distances = np.maximum(distances, self._k_distance[indices])
+        return 1. / (np.mean(reach_distances, axis=1) + 1e-10)
+
+    def fit(self, X: np.ndarray, y=None) -> 'CosineLOF':
+        """
+        Fits the model on the training set X (rows x features). y is ignored, as in sklearn, so the
+        model can end a sklearn Pipeline.
+        """
+        self._fit_X = _normalize(X, self.dtype)
+        self.n_samples_fit_ = self._fit_X.shape[0]
+        self.n_neighbors_ = max(1, min(self.n_neighbors, self.n_samples_fit_ - 1))
+        if self.index == 'ivf':
+            self._build_ivf()
+        distances, indices = self._kneighbors(self._fit_X, self.n_neighbors_, exclude_self=True)
+        self._k_distance = distances[:, -1]
+        self._lrd = self._local_reachability_density(distances, indices)
+        self.negative_outlier_factor_ = -np.mean(self._lrd[indices] / self._lrd[:, None], axis=1)
+        # contamination='auto' as in LocalOutlierFactor
+        self.offset_ = -1.5
+        if self.index == 'ivf':
+            # queries only read the cell-sorted copy, keep a single copy of the training vectors
+            self._fit_X = None
+        return self
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """
+        Opposite of the local outlier factor of each row of X, the lower the more abnormal.
+        """
+        distances, indices = self._kneighbors(_normalize(X, self.dtype), self.n_neighbors_)
+        lrd = self._local_reachability_density(distances, indices)
+        return -np.mean(self._lrd[indices] / lrd[:, None], axis=1)
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """
+        Shifted opposite of the local outlier factor: negative for outliers, positive for inliers.
+        """
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        1 for inliers and -1 for outliers.
+        """
+        labels = np.ones(np.shape(X)[0], dtype=int)
+        labels[self.decision_function(X) < 0] = -1
+        return labels
+
+
+def compare_with_sklearn(X_train: np.ndarray, X_test: np.ndarray, n_neighbors: int = 5, **kwargs) -> dict:
+    """
+    Fits CosineLOF and sklearn's LocalOutlierFactor on the same data and reports fit and query times,
+    the recall of the k nearest neighbours of the test rows and the agreement of the predictions.
+    Keyword arguments are passed on to CosineLOF.
+    """
+    from sklearn.neighbors import LocalOutlierFactor
+
+    report = {}
+    start = time.perf_counter()
+    reference = LocalOutlierFactor(n_neighbors=n_neighbors, novelty=True, metric='cosine').fit(X_train)
+    report['sklearn_fit_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    reference_scores = reference.decision_function(X_test)
+    report['sklearn_query_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = CosineLOF(n_neighbors=n_neighbors, **kwargs).fit(X_train)
+    report['cosine_lof_fit_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = model.decision_function(X_test)
+    report['cosine_lof_query_s'] = time.perf_counter() - start
+
+    _, reference_indices = reference.kneighbors(X_test, n_neighbors)
+    _, indices = model._kneighbors(_normalize(X_test, model.dtype), model.n_neighbors_)
+    report['neighbor_recall'] = float(np.mean([len(set(a) & set(b)) / n_neighbors
+                                               for a, b in zip(reference_indices, indices)]))
+    report['prediction_agreement'] = float(np.mean((reference_scores < 0) == (scores < 0)))
+    report['max_abs_score_difference'] = float(np.max(np.abs(reference_scores - scores)))
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    import yaml
+    from feature_store import open_feature_store
+
+    with open('parameters.yaml', 'r') as f:
+        parameters = yaml.safe_load(f)
+    X_train = open_feature_store(parameters['artifacts']['training']).features
+    X_test = open_feature_store(parameters['artifacts']['testing']).features
+    report = {index: compare_with_sklearn(X_train, X_test, parameters['training']['lof_n_neighbors'], index=index)
+              for index in ('exact', 'ivf')}
+    print(json.dumps(report, indent=2))
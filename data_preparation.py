@@ -1,47 +1,56 @@
-import os                 #  to pass bash shell commands
-import argparse
+import os
 import yaml
+from manifest import build_manifest, load_manifest, save_manifest, manifest_changes
 
-def file_name_formatter(folder: str) -> None:
+
+def prepare_manifest(source: str, manifest_path: str) -> dict:
+    """
+    Records the MIDI files of a data source in its manifest, without copying them into the project.
+    Only files whose size or modification time changed since the previous manifest are read and
+    hashed, and the manifest is rewritten only when something changed.
+
+    Input 1     : Folder or archive (.zip, .tar, .tar.gz, .tgz) holding the MIDI files
+    Input_type  : String
+
+    Input 2     : Path of the JSON manifest
+    Input_type  : String
+
+    Output      : Number of files added, changed, removed and unchanged since the previous manifest
+    Output_type : Dictionary
     """
-    Formats the name of all files in input folder by replacing spaces with underscore.
-    This is useful to prevent errors when issuing command line arguments.
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Data source '{source}' does not exist, check the data section of parameters.yaml")
+    previous = load_manifest(manifest_path)
+    manifest = build_manifest(source, previous)
+    if manifest != previous:
+        save_manifest(manifest_path, manifest)
+    return manifest_changes(previous, manifest)
+
+
+def prepare_data(parameters: dict) -> dict:
     """
-    for file_name in os.listdir(folder):
-        source = folder + "/" + file_name
-        destination = folder + "/" + file_name.replace(' ', '_')
-        os.rename(source, destination)
-    print(f"{len(os.listdir(folder))} Midi files are now imported in project folder '{folder}'")
+    Updates the training and testing manifests from the data sources of parameters.yaml.
+
+    Input       : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Output      : Changes of each manifest, see prepare_manifest
+    Output_type : Dictionary
+    """
+    return {data_set: prepare_manifest(parameters['data'][data_set], parameters['manifests'][data_set])
+            for data_set in ('training', 'testing')}
+
 
 if __name__ == '__main__':
-    # This script loads data stored anywhere into the python folder.
-    # Takes 2 user inputs of paths where training and unseen test set are loaded
+    # This script indexes data stored anywhere: files are read in place by feature extraction.
+    # The training source may hold one sub-folder per composer, sub-folders are walked recursively.
 
     print('Data Loading begins . . .')
     with open('parameters.yaml', 'r') as f:
         parameters = yaml.safe_load(f)
 
-    # parser = argparse.ArgumentParser()
-    # parser.add_argument('user_input_training', help='enter full path of folder containing training set midi files')
-    # parser.add_argument('user_input_testing', help='enter full path of folder containing unseen test set midi files')
-    # args = parser.parse_args()
-
-    # remove old training data
-    os.system("rm -rf Training_data")
-    os.system("rm -rf Unseen_test_data")
-    os.system("mkdir {Training_data,Unseen_test_data}")
-
-    # assumes training data is in form of folders corresp to each composer
-    # assumes testing data is in single folder with no sub-folders
-    source_training = parameters['data']['training'] + '/*/**'
-    source_testing = parameters['data']['testing'] + '/*'
-    os.system("cp %s training_data" % source_training)
-    os.system("cp %s Unseen_test_data" % source_testing)
-
-    file_name_formatter('training_data')
-    file_name_formatter('Unseen_test_data')
+    for data_set, changes in prepare_data(parameters).items():
+        print(f"{changes['added'] + changes['changed'] + changes['unchanged']} Midi files are now indexed in "
+              f"'{parameters['manifests'][data_set]}' ({changes['added']} added, {changes['changed']} changed, "
+              f"{changes['removed']} removed)")
     print('. . . Data loading ends')
-
-
-
-
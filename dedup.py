@@ -0,0 +1,328 @@
+import os
+import json
+import warnings
+from functools import lru_cache
+from multiprocessing import Pool
+import numpy as np
+import yaml
+from manifest import load_manifest, save_manifest, iter_midi_sources, imap_in_windows
+from midi_parser import MidiParseError, read_midi
+from model_registry import composer_of
+
+# Near-duplicate training files (the same piece transposed, at another tempo, re-voiced or with a
+# few notes added or dropped) are grouped before feature extraction, and only one file per group is
+# extracted and trained on. Each file is fingerprinted from its melody:
+#   melody      : highest pitched note of each onset (onsets rounded to the millisecond)
+#   shingles    : every 'ngram' consecutive pitch intervals of the melody, hashed to 32 bits; intervals
+#                 do not change under transposition and timing is not used, so neither does tempo
+#   signature   : MinHash of the shingle set under 'num_perm' hash functions; the share of equal
+#                 values of two signatures estimates the Jaccard similarity of their shingle sets
+# Signatures are cut into 'bands' bands of num_perm / bands values, and files sharing one band in
+# full are candidate duplicates (LSH): a pair of similarity s is a candidate with probability
+# 1 - (1 - s^rows)^bands, about 0.5 at (1 / bands)^(1 / rows) (0.42 for 32 bands of 4 values), so
+# pairs above the 'threshold' are almost always found while each file is only compared with the few
+# files it shares a band with, instead of with every other file. Candidates whose estimated similarity
+# reaches the threshold are merged into clusters (transitively). The representative of a cluster is
+# its file with the most notes, the first one in manifest order on a tie. With 'within_composer',
+# files of different composers (the first folder of their file id) are never merged, so that a piece
+# quoted or transposed by another composer does not shrink the training set of its composer models.
+# Files that cannot be read or decoded by midi_parser.py, or whose melody is shorter than one shingle,
+# are not fingerprinted: each is kept as a cluster of its own and reported.
+# Signatures are cached by file content hash, so only new or changed files are parsed again.
+_PRIME = np.uint64(4294967291)      # largest prime below 2^32, the hash functions are (a x + b) mod _PRIME
+_SEED = 0
+_BLOCK = 4096                       # shingles hashed at once, bounds the (block x num_perm) temporaries
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int) -> tuple:
+    rng = np.random.default_rng(_SEED)
+    return (rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64),
+            rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64))
+
+
+def melody_intervals(start: np.ndarray, pitch: np.ndarray, is_pitched: np.ndarray) -> np.ndarray:
+    """
+    Pitch intervals, in semitones, between the consecutive notes of the melody of a file: the highest
+    pitched (non-drum) note of each onset.
+
+    Input       : Arrays (start, pitch) of all notes, and a mask of the pitched notes (see MidiArrays.note_table)
+    Input_type  : np.ndarray
+
+    Output      : Intervals between consecutive melody notes
+    Output_type : np.ndarray
+    """
+    onsets = np.round(start[is_pitched], 3)
+    pitches = pitch[is_pitched].astype(np.int64)
+    # by onset, highest pitch first: the first note of each onset is its melody note
+    order = np.lexsort((-pitches, onsets))
+    onsets, pitches = onsets[order], pitches[order]
+    first = np.ones(onsets.shape[0], dtype=bool)
+    first[1:] = onsets[1:] != onsets[:-1]
+    return np.diff(pitches[first])
+
+
+def shingle_hashes(intervals: np.ndarray, ngram: int) -> np.ndarray:
+    """
+    Distinct 32 bit hashes of the sequences of 'ngram' consecutive intervals, empty if there are fewer.
+    """
+    if intervals.shape[0] < ngram:
+        return np.empty(0, dtype=np.uint64)
+    # intervals fit a byte once clipped to +/- 127 semitones, a shingle is a polynomial of them
+    values = (np.clip(intervals, -127, 127) + 128).astype(np.uint64)
+    hashes = np.zeros(intervals.shape[0] - ngram + 1, dtype=np.uint64)
+    for i in range(ngram):
+        hashes = hashes * np.uint64(257) + values[i:values.shape[0] - ngram + 1 + i]
+    # mixed down to 32 bits, so that (a x + b) stays below 2^64
+    hashes ^= hashes >> np.uint64(32)
+    return np.unique(hashes & np.uint64(0xFFFFFFFF))
+
+
+def minhash_signature(shingles: np.ndarray, num_perm: int) -> np.ndarray:
+    """
+    MinHash signature of a non-empty set of 32 bit shingle hashes.
+
+    Input 1     : Distinct shingle hashes, see shingle_hashes
+    Input_type  : np.ndarray
+
+    Input 2     : Number of hash functions, the length of the signature
+    Input_type  : Integer
+
+    Output      : Minimum of each hash function over the shingles
+    Output_type : np.ndarray of uint32
+    """
+    a, b = _permutations(num_perm)
+    signature = np.full(num_perm, _PRIME, dtype=np.uint64)
+    for offset in range(0, shingles.shape[0], _BLOCK):
+        block = shingles[offset:offset + _BLOCK, None] % _PRIME
+        np.minimum(signature, (((block * a) % _PRIME + b) % _PRIME).min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+
+def _fingerprint(args: tuple) -> tuple:
+    # (signature or None, number of notes, error or None) of one file, given by path or as bytes
+    source, ngram, num_perm = args
+    try:
+        track = read_midi(source)
+    except MidiParseError as e:
+        return None, 0, str(e)
+    except OSError as e:
+        # unreadable, or removed since the manifest was written
+        print(f"ATTENTION: {source} skipped: {e}")
+        return None, 0, f'unreadable: {e}'
+    start, _, _, pitch, is_pitched = track.note_table()
+    shingles = shingle_hashes(melody_intervals(start, pitch, is_pitched), ngram)
+    if shingles.shape[0] == 0:
+        return None, int(start.shape[0]), None
+    return minhash_signature(shingles, num_perm), int(start.shape[0]), None
+
+
+def cluster_signatures(signatures: np.ndarray, bands: int, threshold: float,
+                       groups: np.ndarray = None) -> np.ndarray:
+    """
+    Clusters files of near-identical MinHash signatures through LSH banding (see the top of this module).
+
+    Input 1     : Signatures of the files, one row per file
+    Input_type  : np.ndarray
+
+    Input 2     : Number of bands the signatures are cut into, a divisor of their length
+    Input_type  : Integer
+
+    Input 3     : Estimated Jaccard similarity from which two candidate files are merged
+    Input_type  : Float
+
+    Input 4     : If given, group of each file (e.g. its composer), files of different groups are not merged
+    Input_type  : np.ndarray
+
+    Output      : Cluster of each file, as the index of one of its files
+    Output_type : np.ndarray
+    """
+    n_files, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f'{bands} bands do not divide signatures of {num_perm} values')
+    rows = num_perm // bands
+    parent = np.arange(n_files)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    multipliers = np.random.default_rng(_SEED).integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    for band in range(bands):
+        # one 64 bit key per band; files sharing a key by collision only cost a comparison
+        keys = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * multipliers).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, n_files])
+        # only the buckets of several files are visited, most files are alone in theirs
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            bucket = order[start:start + size]
+            # within a bucket, each file not yet matched leads a comparison with the others
+            while bucket.shape[0] > 1:
+                leader, others = bucket[0], bucket[1:]
+                matched = (signatures[others] == signatures[leader]).mean(axis=1) >= threshold
+                if groups is not None:
+                    matched &= groups[others] == groups[leader]
+                for other in others[matched]:
+                    root_leader, root_other = find(leader), find(other)
+                    if root_leader != root_other:
+                        parent[root_other] = root_leader
+                bucket = others[~matched]
+    return np.array([find(i) for i in range(n_files)])
+
+
+def _load_signatures(cache_path: str, version: str) -> dict:
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    with np.load(cache_path) as cache:
+        if str(cache['version']) != version:
+            return {}
+        return {str(file_hash): (signature if fingerprinted else None, int(notes))
+                for file_hash, signature, notes, fingerprinted
+                in zip(cache['hashes'], cache['signatures'], cache['notes'], cache['fingerprinted'])}
+
+
+def _save_signatures(cache_path: str, version: str, fingerprints: dict, num_perm: int) -> None:
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    hashes = sorted(fingerprints)
+    signatures = np.zeros((len(hashes), num_perm), dtype=np.uint32)
+    for i, file_hash in enumerate(hashes):
+        if fingerprints[file_hash][0] is not None:
+            signatures[i] = fingerprints[file_hash][0]
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, version=np.array(version), hashes=np.array(hashes, dtype='U64'), signatures=signatures,
+             notes=np.array([fingerprints[file_hash][1] for file_hash in hashes], dtype=np.int64),
+             fingerprinted=np.array([fingerprints[file_hash][0] is not None for file_hash in hashes], dtype=bool))
+    os.replace(tmp_path, cache_path)
+
+
+def deduplicate(manifest_path: str, output_manifest_path: str, report_path: str, cache_path: str = None,
+                ngram: int = 4, num_perm: int = 128, bands: int = 32, threshold: float = .5,
+                n_workers: int = 1, chunksize: int = 8, window: int = 256, within_composer: bool = True) -> dict:
+    """
+    Groups the near-duplicate files of a manifest (see the top of this module) and writes a manifest of
+    one representative per group, in the order of the original manifest, together with a report of
+    the groups.
+
+    Input 1     : Path of the manifest to deduplicate (see manifest.py)
+    Input_type  : String
+
+    Input 2     : Path of the manifest of the representatives
+    Input_type  : String
+
+    Input 3     : Path of the JSON report: counts, every cluster of more than one file with the
+                  estimated similarity of each member to its representative, and the files not fingerprinted
+    Input_type  : String
+
+    Input 4     : Path of the signature cache, None to parse every file
+    Input_type  : String
+
+    Input 5-8   : Shingle length, signature length, number of bands and similarity threshold
+    Input_type  : Integer, Integer, Integer, Float
+
+    Input 9-11  : Worker processes, files handed to a worker at a time and files read ahead of the workers
+    Input_type  : Integer
+
+    Input 12    : Whether only files of the same composer (first folder of the file id) are merged
+    Input_type  : Boolean
+
+    Output      : Report
+    Output_type : Dictionary
+    """
+    manifest = load_manifest(manifest_path)
+    entries = manifest['entries']
+    version = f'minhash:{ngram}:{num_perm}:{_SEED}'
+    cached = _load_signatures(cache_path, version)
+
+    missing = [i for i, entry in enumerate(entries) if entry['sha256'] not in cached]
+    tasks = ((source, ngram, num_perm) for source in iter_midi_sources([entries[i] for i in missing]))
+    pool = Pool(processes=n_workers) if n_workers > 1 and len(missing) > 1 else None
+    fingerprints, unparsed = {}, {}
+    try:
+        results = imap_in_windows(pool, _fingerprint, tasks, chunksize, window) if pool is not None \
+            else map(_fingerprint, tasks)
+        for i, (signature, notes, error) in zip(missing, results):
+            if error is None:
+                fingerprints[entries[i]['sha256']] = (signature, notes)
+            else:
+                unparsed[entries[i]['id']] = error
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    fingerprints.update((file_hash, cached[file_hash]) for file_hash in {entry['sha256'] for entry in entries}
+                        if file_hash in cached)
+    if cache_path:
+        # files that failed to parse are not cached so that they are retried on the next run
+        _save_signatures(cache_path, version, fingerprints, num_perm)
+
+    fingerprinted = [i for i, entry in enumerate(entries)
+                     if entry['id'] not in unparsed and fingerprints[entry['sha256']][0] is not None]
+    signatures = np.array([fingerprints[entries[i]['sha256']][0] for i in fingerprinted],
+                          dtype=np.uint32).reshape(-1, num_perm)
+    groups = None
+    if within_composer:
+        groups = np.unique([composer_of(entries[i]['id']) or '' for i in fingerprinted], return_inverse=True)[1]
+    labels = cluster_signatures(signatures, bands, threshold, groups)
+
+    members = {}
+    for position, label in enumerate(labels):
+        members.setdefault(int(label), []).append(fingerprinted[position])
+    position_of = {i: position for position, i in enumerate(fingerprinted)}
+    representatives, clusters = set(range(len(entries))) - set(fingerprinted), []
+    for group in members.values():
+        # most notes first, then manifest order
+        representative = min(group, key=lambda i: (-fingerprints[entries[i]['sha256']][1], i))
+        representatives.add(representative)
+        if len(group) == 1:
+            continue
+        similarities = (signatures[[position_of[i] for i in group]]
+                        == signatures[position_of[representative]]).mean(axis=1)
+        clusters.append({'representative': entries[representative]['id'],
+                         'members': [{'id': entries[i]['id'], 'notes': fingerprints[entries[i]['sha256']][1],
+                                      'similarity': float(similarity)} for i, similarity in zip(group, similarities)]})
+
+    kept = [entry for i, entry in enumerate(entries) if i in representatives]
+    save_manifest(output_manifest_path, dict(manifest, entries=kept))
+    not_fingerprinted = [entry['id'] for i, entry in enumerate(entries)
+                         if entry['id'] not in unparsed and i not in position_of]
+    report = {'manifest': manifest_path, 'settings': {'ngram': ngram, 'num_perm': num_perm, 'bands': bands,
+                                                      'threshold': threshold, 'within_composer': within_composer},
+              'files': len(entries), 'kept': len(kept), 'removed': len(entries) - len(kept),
+              'clusters': sorted(clusters, key=lambda cluster: -len(cluster['members'])),
+              'unparsed': unparsed, 'too_short': not_fingerprinted}
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def deduplicate_training_set(parameters: dict) -> dict:
+    """
+    Deduplicates the training manifest with the settings of the dedup section of parameters.yaml.
+
+    Input       : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Output      : Report, see deduplicate
+    Output_type : Dictionary
+    """
+    settings = parameters['dedup']
+    return deduplicate(parameters['manifests']['training'], settings['manifest'], settings['report'],
+                       settings['cache'], settings['ngram'], settings['num_perm'], settings['bands'],
+                       settings['threshold'], settings['n_workers'], parameters['feature_engineering']['chunksize'],
+                       within_composer=settings['within_composer'])
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    with open('parameters.yaml', 'r') as f:
+        parameters = yaml.safe_load(f)
+
+    report = deduplicate_training_set(parameters)
+    print(f"{report['kept']} of {report['files']} training files kept in '{parameters['dedup']['manifest']}', "
+          f"{report['removed']} near-duplicates removed from {len(report['clusters'])} clusters, see "
+          f"'{parameters['dedup']['report']}'")
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+from feature_store import FEATURES_FILE, FILE_IDS_FILE, create_feature_store, append_rows, read_schema, \
+    store_shape, iter_feature_chunks, iter_file_ids
+
+# The feature cache is a feature store (see feature_store.py) whose file ids are the content hashes of
+# the files: rows are appended as files are extracted and read back through a memory map, so neither
+# the cache nor the rows of a run are ever held in memory. Only an index of the hashes is: their first
+# 8 bytes as sorted uint64 with the row of each, 16 bytes per cached file (two different files sharing
+# the first 64 bits of their SHA-256 is not a practical concern).
+
+
+def file_content_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Hashes the raw bytes of a file so that renamed or re-copied files still hit the cache.
+
+    Input       : Path of the file to hash
+    Input_type  : String
+
+    Output      : Hex digest of the SHA-256 of the file contents
+    Output_type : String
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Append-only cache of feature rows keyed by file content hash, see the top of this module.
+
+    A cache written by another extractor version (or for other features) is started afresh. Rows added
+    are written in batches of 'batch_size', so at most one batch is held in memory. Entries of files
+    that were neither looked up nor added since the cache was opened are dropped by compact(), which
+    rewrites the cache only once they outnumber the others, so that it is not rewritten on every run.
+    """
+
+    def __init__(self, path: str, extractor_version: str, feature_names: list, batch_size: int = 1024):
+        self.path = path
+        self.batch_size = batch_size
+        if os.path.isfile(path):
+            # pickled cache of earlier versions of this module
+            os.remove(path)
+        if not self._matches(extractor_version, feature_names):
+            create_feature_store(path, feature_names, extractor_version)
+        self._repair()
+        self.n_rows, n_columns = store_shape(path)
+        self.features = np.memmap(os.path.join(path, FEATURES_FILE), dtype=np.float64, mode='r',
+                                  shape=(self.n_rows, n_columns)) if self.n_rows else np.empty((0, n_columns))
+        keys = np.fromiter((int(file_hash[:16], 16) for file_hash in iter_file_ids(path)), dtype=np.uint64,
+                           count=self.n_rows)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+        self._used = np.zeros(self.n_rows, dtype=bool)
+        self._pending_hashes, self._pending_rows = [], []
+        self.n_added = 0
+
+    def _matches(self, extractor_version: str, feature_names: list) -> bool:
+        if not os.path.isdir(self.path):
+            return False
+        try:
+            schema = read_schema(self.path)
+        except (OSError, ValueError, KeyError):
+            return False
+        return schema['extractor_version'] == extractor_version and schema['feature_names'] == list(feature_names) \
+            and schema['dtype'] == 'float64'
+
+    def _repair(self) -> None:
+        # an interrupted append can leave a partial last hash, or rows without their hash: both are cut
+        # off so that the next append starts aligned (a line is 65 bytes, a partial one is shorter)
+        with open(os.path.join(self.path, FILE_IDS_FILE), 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - 128))
+            tail = f.read()
+            if tail and not tail.endswith(b'\n'):
+                f.truncate(size - len(tail) + tail.rfind(b'\n') + 1)
+        n_rows, n_columns = store_shape(self.path)
+        with open(os.path.join(self.path, FEATURES_FILE), 'rb+') as f:
+            if f.seek(0, os.SEEK_END) != n_rows * n_columns * 8:
+                f.truncate(n_rows * n_columns * 8)
+
+    def _find(self, file_hash: str) -> int:
+        key = np.uint64(int(file_hash[:16], 16))
+        position = int(np.searchsorted(self._keys, key))
+        if position < self._keys.shape[0] and self._keys[position] == key:
+            return int(self._order[position])
+        return -1
+
+    def __contains__(self, file_hash: str) -> bool:
+        return self._find(file_hash) >= 0
+
+    def get(self, file_hash: str) -> np.ndarray:
+        """
+        Cached row of a file, copied out of the memory map, or None if the file is not cached.
+        """
+        row = self._find(file_hash)
+        if row < 0:
+            return None
+        self._used[row] = True
+        return np.array(self.features[row])
+
+    def add(self, file_hash: str, row) -> None:
+        """
+        Adds the row of a file, written with the next batch; rows added are not looked up by get.
+        """
+        self._pending_hashes.append(file_hash)
+        self._pending_rows.append(row)
+        if len(self._pending_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending_rows:
+            append_rows(self.path, self._pending_hashes, self._pending_rows)
+            self.n_added += len(self._pending_rows)
+            self._pending_hashes, self._pending_rows = [], []
+
+    def compact(self, chunk_rows: int = 65536) -> bool:
+        """
+        Writes the pending rows, then rewrites the cache without its unused entries (see the class
+        docstring) when they outnumber the used and added ones, streaming it chunk by chunk. The cache
+        is closed afterwards.
+
+        Output      : Whether the cache was rewritten
+        Output_type : Boolean
+        """
+        self.flush()
+        n_used = int(self._used.sum())
+        if self.n_rows - n_used <= n_used + self.n_added:
+            return False
+        schema = read_schema(self.path)
+        tmp_path = self.path.rstrip('/') + '.tmp'
+        create_feature_store(tmp_path, schema['feature_names'], schema['extractor_version'])
+        file_hashes = iter_file_ids(self.path)
+        kept = np.concatenate([self._used, np.ones(self.n_added, dtype=bool)])
+        start = 0
+        for chunk in iter_feature_chunks(self.path, chunk_rows):
+            chunk_hashes = [next(file_hashes) for _ in range(chunk.shape[0])]
+            mask = kept[start:start + chunk.shape[0]]
+            append_rows(tmp_path, [file_hash for file_hash, keep in zip(chunk_hashes, mask) if keep], chunk[mask])
+            start += chunk.shape[0]
+        self.features = None
+        old_path = self.path.rstrip('/') + '.old'
+        os.replace(self.path.rstrip('/'), old_path)
+        os.replace(tmp_path, self.path.rstrip('/'))
+        shutil.rmtree(old_path)
+        return True
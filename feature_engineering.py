@@ -1,163 +1,469 @@
-import pretty_midi
-import pandas as pd
 import numpy as np
 import argparse
-import pickle
 import warnings
 import sys
 import os
+import io
+import json
+import signal
+import time
+import tracemalloc
 import yaml
+from collections import OrderedDict, namedtuple
+from functools import cached_property, partial
+from multiprocessing import Pool
+from feature_cache import FeatureCache, file_content_hash
+from manifest import load_manifest, iter_midi_sources, imap_in_windows
+from metrics import run_with_capture, max_rss_bytes, read_metrics, summarize_file_metrics, write_summary, \
+    merge_profiles
+from feature_store import create_feature_store, append_rows, open_feature_store
+from midi_parser import MidiArrays, MidiParseError, read_midi, downbeats_from_beats, estimate_tempo_histogram
 
-def feature_engineering_single_file(file_path: str) -> list:
-    """
-    This function extracts handcrafted features related to beats, pitch/keys and instruments used.
+# bump whenever feature_engineering_single_file changes what it returns, so cached rows are recomputed
+EXTRACTOR_VERSION = '1'
 
-    Input       : Takes as input the path of the MIDI file
-    Input_type  : String
 
-    Output      : Outputs a bank of handcrafted features extracted from the MIDI file
-    Output_type : List
-    """
+class FeatureExtractionTimeout(Exception):
+    """Raised inside a worker when a single MIDI file exceeds its time budget."""
 
-    try:
-        track = pretty_midi.PrettyMIDI(file_path)
 
-        # global tempo - the overall perceived speed of the song
-        tempo = track.estimate_tempo()
+def _timeout_handler(signum, frame):
+    raise FeatureExtractionTimeout('feature extraction timed out')
 
-        number_beats = len(track.get_beats())
+def _note_table(track: 'pretty_midi.PrettyMIDI') -> tuple:
+    """
+    Gathers the notes of all instruments into contiguous arrays in a single pass.
 
-        number_downbeats = len(track.get_downbeats())
+    Input       : Parsed MIDI file
+    Input_type  : pretty_midi.PrettyMIDI
 
-        percentage_downbeats = number_downbeats / number_beats
+    Output      : Arrays (start, end, velocity, pitch) of all notes, and a mask of the notes played
+                  by non-drum instruments
+    Output_type : Tuple of np.ndarray
+    """
+    number_notes = sum(len(instrument.notes) for instrument in track.instruments)
+    table = np.fromiter((value for instrument in track.instruments for note in instrument.notes
+                         for value in (note.start, note.end, note.velocity, note.pitch)),
+                        dtype=np.float64, count=4 * number_notes).reshape(number_notes, 4)
+    is_pitched = np.repeat([not instrument.is_drum for instrument in track.instruments],
+                           [len(instrument.notes) for instrument in track.instruments]).astype(bool)
+    return table[:, 0], table[:, 1], table[:, 2], table[:, 3], is_pitched
 
-        length = track.get_end_time()  # seconds -needed to adjust other features longer song vs shorter song
 
-        number_notes = track.get_onsets().shape[0]  ## needed for note density i.e. number_notes/length
+def _load_track(file_path, backend: str):
+    """
+    Parses a MIDI file, given by path or as raw bytes, with the requested backend.
 
-        number_notes_solo = len(set(track.get_onsets()))  # how many notes were not hit simultaneously?
+    'native' decodes the file with midi_parser.read_midi and falls back to pretty_midi when the
+    file cannot be decoded; 'pretty_midi' always builds the full pretty_midi.PrettyMIDI object.
+    """
+    if backend == 'native':
+        try:
+            return read_midi(file_path)
+        except MidiParseError:
+            pass
+    elif backend != 'pretty_midi':
+        raise ValueError(f"Unknown MIDI backend '{backend}', expected 'native' or 'pretty_midi'")
+    # imported on first use, the native backend rarely needs it
+    import pretty_midi
+    return pretty_midi.PrettyMIDI(io.BytesIO(file_path) if isinstance(file_path, bytes) else file_path)
+
+
+def _descriptor(values: np.ndarray) -> list:
+    """
+    Same statistics as pandas describe() minus the count: mean, std_dev, min, p25, p50, p75, max
+    """
+    p25, p50, p75 = np.percentile(values, [25, 50, 75])
+    return [values.mean(), values.std(ddof=1), values.min(), p25, p50, p75, values.max()]
 
-        notes_density = number_notes / length
 
-        percentage_notes_solo = (number_notes - number_notes_solo) / number_notes
+class _Track:
+    """
+    Parsed MIDI file plus the intermediate values shared between feature groups.
+    Each intermediate value is computed on first use, so only what the enabled groups need is computed.
+    """
 
-        """
-        how many times per second does tempo change in this song? 
+    def __init__(self, track, tempo_estimator: str):
+        self.track = track
+        self.tempo_estimator = tempo_estimator
+
+    @cached_property
+    def notes(self) -> tuple:
+        # (start, end, velocity, pitch, is_pitched, programs)
+        if isinstance(self.track, MidiArrays):
+            return self.track.note_table() + (self.track.program,)
+        programs = [instrument.program for instrument in self.track.instruments]
+        return _note_table(self.track) + (programs,)
+
+    @cached_property
+    def length(self) -> float:
+        # seconds -needed to adjust other features longer song vs shorter song
+        return self.track.get_end_time()
+
+    @cached_property
+    def beats(self) -> np.ndarray:
+        return self.track.get_beats()
+
+
+def _tempo_features(t: _Track) -> list:
+    # global tempo - the overall perceived speed of the song
+    if t.tempo_estimator == 'histogram':
+        return [estimate_tempo_histogram(np.sort(t.notes[0]))]
+    return [t.track.estimate_tempo()]
+
+
+def _beat_features(t: _Track) -> list:
+    number_beats = len(t.beats)
+    if isinstance(t.track, MidiArrays):
+        number_downbeats = len(downbeats_from_beats(t.beats, t.track.time_signatures))
+    else:
+        number_downbeats = len(t.track.get_downbeats())
+    percentage_downbeats = number_downbeats / number_beats
+    return [number_beats, number_downbeats, percentage_downbeats]
+
+
+def _note_count_features(t: _Track) -> list:
+    start = t.notes[0]
+    number_notes = start.shape[0]  ## needed for note density i.e. number_notes/length
+    number_notes_solo = np.unique(start).shape[0]  # how many notes were not hit simultaneously?
+    notes_density = number_notes / t.length
+    percentage_notes_solo = (number_notes - number_notes_solo) / number_notes
+    return [number_notes, t.length, number_notes_solo, notes_density, percentage_notes_solo]
+
+
+def _tempo_change_features(t: _Track) -> list:
+    # how many times per second does tempo change in this song?
+    return [len(t.track.get_tempo_changes()[0]) / t.length]
+
+
+def _instrument_features(t: _Track) -> list:
+    # how many instruments were used totaly 0-127 options - midi calls instrument as program
+    return [len(np.unique(t.notes[5]))]
+
+
+def _resolution_features(t: _Track) -> list:
+    # Resolution is the number of MIDI clocks per quarter note.
+    return [t.track.resolution]
+
+
+def _pitch_class_features(t: _Track) -> list:
+    # Binning of the frequencies in the whole song into standard 12 MIDI buckets, drums excluded
+    pitch, is_pitched = t.notes[3], t.notes[4]
+    pitch_class_counts = np.bincount(pitch[is_pitched].astype(np.int64) % 12, minlength=12)
+    total_pitched = pitch_class_counts.sum()
+    return list(pitch_class_counts / (total_pitched + (total_pitched == 0)))
+
+
+def _descriptor_names(prefix: str) -> list:
+    return [prefix + suffix for suffix in ['_mean', '_std_dev', '_min', '_25p', '_50p', '_75p', '_max']]
+
+
+FeatureGroup = namedtuple('FeatureGroup', ['feature_names', 'compute'])
+
+# Registry of the handcrafted features, by group. A group computes all of its features at once and
+# only pays for the intermediate values it reads from _Track:
+#   tempo                              : note onsets (estimator of the parser, or estimate_tempo_histogram)
+#   beats                              : tempo map, time signatures and end time
+#   notes                              : note onsets and end time
+#   tempo_changes                      : tempo map and end time
+#   instruments, note_*, pitch_classes : note table
+#   resolution                         : MIDI header only
+# The note_* groups describe how long each note was played, how hard it was hit and its pitch as
+# mean, std_dev, minimum, p25, p50, p75 and maximum.
+FEATURE_GROUPS = OrderedDict([
+    ('tempo', FeatureGroup(['tempo'], _tempo_features)),
+    ('beats', FeatureGroup(['number_beats', 'number_downbeats', 'percentage_downbeats'], _beat_features)),
+    ('notes', FeatureGroup(['number_notes', 'length', 'number_notes_solo', 'notes_density',
+                            'percentage_notes_solo'], _note_count_features)),
+    ('tempo_changes', FeatureGroup(['tempo_change_frequency'], _tempo_change_features)),
+    ('instruments', FeatureGroup(['number_instruments'], _instrument_features)),
+    ('resolution', FeatureGroup(['resolution'], _resolution_features)),
+    ('note_duration', FeatureGroup(_descriptor_names('note_duration'),
+                                   lambda t: _descriptor(t.notes[1] - t.notes[0]))),
+    ('note_velocity', FeatureGroup(_descriptor_names('note_velocity'), lambda t: _descriptor(t.notes[2]))),
+    ('note_pitch', FeatureGroup(_descriptor_names('note_pitch'), lambda t: _descriptor(t.notes[3]))),
+    ('pitch_classes', FeatureGroup(['percentage_pitch_class%d' % i for i in range(1, 13)], _pitch_class_features)),
+])
+
+# column order of the feature bank, kept identical to the original 45 feature layout
+FEATURE_NAMES = ['tempo', 'number_beats', 'number_notes', 'number_downbeats', 'percentage_downbeats', 'length',
+                 'number_notes_solo', 'number_instruments', 'notes_density', 'percentage_notes_solo',
+                 'tempo_change_frequency', 'resolution'] + _descriptor_names('note_duration') + \
+                _descriptor_names('note_velocity') + _descriptor_names('note_pitch') + \
+                ['percentage_pitch_class%d' % i for i in range(1, 13)]
+
+
+def feature_names(groups: list = None) -> list:
+    """
+    Names of the features computed for the given groups (all groups if None), in feature bank order.
+    """
+    groups = list(FEATURE_GROUPS) if groups is None else groups
+    unknown = set(groups) - set(FEATURE_GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown feature groups {sorted(unknown)}, expected some of {list(FEATURE_GROUPS)}")
+    enabled = {name for group in groups for name in FEATURE_GROUPS[group].feature_names}
+    return [name for name in FEATURE_NAMES if name in enabled]
 
-        """
-        tempo_change_frequency = len(track.get_tempo_changes()[0]) / length
 
-        """
-        Binning of the frequencies in the whole song into standard 12 MIDI buckets
-        """
-        percentage_pitch_classes = list(track.get_pitch_class_histogram())
+def extractor_version(groups: list = None, tempo_estimator: str = 'clustering') -> str:
+    """
+    Version of the rows extracted with these options, recorded in feature stores and in the metadata of
+    the models fitted on them: rows of another feature selection or tempo estimator do not mix.
+    """
+    return '%s:%s:%s' % (EXTRACTOR_VERSION, ','.join(feature_names(groups)), tempo_estimator)
 
-        """
-        Resolution is the number of MIDI clocks per quarter note. 
-        """
 
-        resolution = track.resolution
+def feature_engineering_single_file(file_path, backend: str = 'pretty_midi', groups: list = None,
+                                    tempo_estimator: str = 'clustering', metrics: dict = None) -> list:
+    """
+    This function extracts handcrafted features related to beats, pitch/keys and instruments used.
 
-        """
-        how many instruments were used totaly 0-127 options - midi calls instrument as program
-        """
-        number_instruments = len(np.unique([instrument.program for instrument in track.instruments]))
+    Input 1     : Takes as input the path of the MIDI file, or its raw bytes
+    Input_type  : String or bytes
 
-        L = []
+    Input 2     : MIDI parser, 'pretty_midi' or 'native' (see midi_parser.py)
+    Input_type  : String
 
-        for instrument in track.instruments:
-            for note in instrument.notes:
-                L.append([instrument.program, note.start, note.end, note.end - note.start,
-                          note.velocity, note.pitch])
-        df = pd.DataFrame(np.array(L))
-        df.columns = ['instrument', 'start', 'end', 'duration', 'velocity', 'pitch']
+    Input 3     : Feature groups to compute (keys of FEATURE_GROUPS), all of them if None
+    Input_type  : List
 
-        """
-        Which keys are used the most out of 128 keys?  Categorical
-        """
-        top_keys = df['pitch'].value_counts().index
-        first_highest_used_key = pretty_midi.note_number_to_name(top_keys[0])
-        second_highest_used_key = pretty_midi.note_number_to_name(top_keys[1])
+    Input 4     : Tempo estimator, 'clustering' (pretty_midi's) or 'histogram' (estimate_tempo_histogram)
+    Input_type  : String
 
-        """
-        Low level Features related to the notes characteristics
-        How long was the note played?
-        How hard what that note hit?
-        What was the frequency of that note (key name or numerical frequency)
-        Extract the mean, std_dev, minimum, p25, p50, p75, maximum of above features
-        """
-        duration, velocity, note_pitch = [], [], []
+    Input 5     : If given, filled with the parse time, the time of each feature group (intermediate
+                  values are timed with the first group that needs them), the total time, the number
+                  of notes and, on failure, the error and its category 'step:ExceptionType'
+    Input_type  : Dictionary
 
-        note_duration, note_velocity, note_pitch = [], [], []
+    Output      : Outputs a bank of handcrafted features extracted from the MIDI file, ordered as feature_names(groups)
+    Output_type : List
+    """
 
-        descriptor_duration = df['duration'].describe()
-        descriptor_velocity = df['velocity'].describe()
-        descriptor_pitch = df['pitch'].describe()
+    step, start = 'parse', time.perf_counter() if metrics is not None else None
+    try:
+        if metrics is None:
+            t = _Track(_load_track(file_path, backend), tempo_estimator)
+            values = {}
+            for group in (FEATURE_GROUPS if groups is None else groups):
+                values.update(zip(FEATURE_GROUPS[group].feature_names, FEATURE_GROUPS[group].compute(t)))
+            return [values[name] for name in FEATURE_NAMES if name in values]
+
+        t = _Track(_load_track(file_path, backend), tempo_estimator)
+        metrics['parse_s'] = time.perf_counter() - start
+        metrics['groups'] = {}
+        values = {}
+        for step in (FEATURE_GROUPS if groups is None else groups):
+            group_start = time.perf_counter()
+            values.update(zip(FEATURE_GROUPS[step].feature_names, FEATURE_GROUPS[step].compute(t)))
+            metrics['groups'][step] = time.perf_counter() - group_start
+        metrics['total_s'] = time.perf_counter() - start
+        # only counted when a feature group already built the note table
+        if 'notes' in t.__dict__:
+            metrics['notes'] = int(t.notes[0].shape[0])
+        return [values[name] for name in FEATURE_NAMES if name in values]
+    except Exception as e:
+        print(f"ATTENTION: {e} error has occurred")
+        if metrics is not None:
+            metrics['total_s'] = time.perf_counter() - start
+            metrics['error_category'] = 'timeout' if isinstance(e, FeatureExtractionTimeout) \
+                else f'{step}:{type(e).__name__}'
+            metrics['error'] = str(e)
 
-        for i in range(1, 8):
-            note_duration.append(descriptor_duration[i])
-            note_velocity.append(descriptor_velocity[i])
-            note_pitch.append(descriptor_pitch[i])
 
-        row_features = [tempo, number_beats, number_notes, number_downbeats, percentage_downbeats, length,
-                        number_notes_solo, number_instruments, notes_density, percentage_notes_solo,
-                        tempo_change_frequency, resolution, note_duration, note_velocity, note_pitch,
-                        percentage_pitch_classes]
+def _feature_engineering_with_timeout(args: tuple) -> tuple:
+    """
+    Runs feature_engineering_single_file on one file with a per-file time budget.
 
-        feature_bank = []
-        for feature in row_features:
-            if type(feature) is list:
-                for f in feature:
-                    feature_bank.append(f)
-            else:
-                feature_bank.append(feature)
-        return feature_bank
-    except Exception as e:
-        print(f"ATTENTION: {e} error has occurred")
+    Input       : Tuple (file_path, timeout, options, capture) where file_path may also be raw MIDI bytes,
+                  timeout is in seconds (0/None disables it), options are keyword arguments of
+                  feature_engineering_single_file and capture is None when metrics are disabled, else
+                  (profile mode, profile folder) as taken by metrics.run_with_capture
+    Input_type  : Tuple
 
-def feature_engineering_all_files(folder_name: str) -> np.ndarray:
+    Output      : Feature bank of the file, or None if extraction failed or timed out, and the metrics
+                  of the file, or None when metrics are disabled
+    Output_type : Tuple
+    """
+    file_path, timeout, options, capture = args
+    # SIGALRM is only available on Unix, elsewhere files run without a time budget; setitimer rather
+    # than alarm so that budgets below a second (or fractional ones) are kept, not truncated to 0
+    use_alarm = bool(timeout) and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _timeout_handler)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if capture is None:
+            return feature_engineering_single_file(file_path, **options), None
+        metrics = {}
+        row, captured = run_with_capture(*capture, partial(feature_engineering_single_file, **options,
+                                                           metrics=metrics), file_path)
+        metrics.update(captured, max_rss_bytes=max_rss_bytes())
+        return row, metrics
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def feature_engineering_all_files(folder_name: str = None, n_workers: int = 1, chunksize: int = 1,
+                                  timeout: float = None, cache_path: str = None,
+                                  backend: str = 'pretty_midi', groups: list = None,
+                                  tempo_estimator: str = 'clustering', store_path: str = None,
+                                  dtype: str = 'float64', store_batch_size: int = 1024,
+                                  manifest_path: str = None, window: int = 256, metrics_path: str = None,
+                                  profile: str = 'none', top_n: int = 10) -> np.ndarray:
     """
     Each MIDI file is converted into its features.
     A numpy array is returned which contains a subarray corresp to each training MIDI file
+
+    Files are those of 'folder_name' in sorted order or, if manifest_path is given, the entries of
+    that manifest (see manifest.py) in manifest order: plain files are read where they are and
+    archive members are streamed out of their archive, at most 'window' files ahead of extraction.
+    With n_workers > 1 files are distributed in chunks of 'chunksize' files over a process pool;
+    rows come back in the same order either way.
+    A file taking longer than 'timeout' seconds is abandoned and dropped like any failed file.
+
+    If cache_path is given, rows are cached by file content hash and extractor version (see
+    feature_cache.FeatureCache): only new or changed files are parsed, and entries of files no longer
+    in the folder are eventually evicted. The hashes recorded in a manifest are used as they are,
+    without reading the files again. With a store, rows are written to the store and the cache in
+    batches of 'store_batch_size', so that memory does not grow with the number of files.
+    'backend', 'groups' and 'tempo_estimator' are passed on to feature_engineering_single_file.
+
+    If store_path is given, rows are streamed into a feature store (see feature_store.py) in batches
+    of 'store_batch_size' together with the id of their source file, and the returned array is a
+    memory map of that store instead of an in-memory copy.
+
+    If metrics_path is given, one metric record per file (see metrics.py) is written there as JSON
+    lines, with a summary report listing the 'top_n' slowest files next to it. 'profile' adds a
+    tracemalloc peak per file ('tracemalloc') or a cProfile capture merged into <metrics>.prof
+    ('cprofile'). Without metrics_path the extraction runs uninstrumented.
     :rtype: np.ndarray
     """
-    feature_names = ['tempo', 'number_beats', 'number_notes', 'number_downbeats', 'percentage_downbeats', 'length',
-                     'number_notes_solo', 'number_instruments', 'notes_density', 'percentage_notes_solo',
-                     'tempo_change_frequency', 'resolution',
-                     'note_duration_mean', 'note_duration_std_dev', 'note_duration_min', 'note_duration_25p',
-                     'note_duration_50p', 'note_duration_75p', 'note_duration_max',
-                     'note_velocity_mean', 'note_velocity_std_dev', 'note_velocity_min', 'note_velocity_25p',
-                     'note_velocity_50p', 'note_velocity_75p', 'note_velocity_max',
-                     'note_pitch_mean', 'note_pitch_std_dev', 'note_pitch_min', 'note_pitch_25p', 'note_pitch_50p',
-                     'note_pitch_75p', 'note_pitch_max', 'percentage_pitch_class1', 'percentage_pitch_class2',
-                     'percentage_pitch_class3', 'percentage_pitch_class4', 'percentage_pitch_class5',
-                     'percentage_pitch_class6', 'percentage_pitch_class7', 'percentage_pitch_class8',
-                     'percentage_pitch_class9', 'percentage_pitch_class10', 'percentage_pitch_class11',
-                     'percentage_pitch_class12']
-
-    df = pd.DataFrame(columns=feature_names)
-    for file_name in os.listdir(folder_name):
-        file_path = folder_name + '/' + file_name
-        df.loc[len(df)] = feature_engineering_single_file(file_path)
-    df = df.dropna()
-    array = df.to_numpy()
-    return array
+    options = {'backend': backend, 'groups': groups, 'tempo_estimator': tempo_estimator}
+    columns = feature_names(groups)
+    # rows cached by another feature selection or tempo estimator are not reused
+    cache_version = extractor_version(groups, tempo_estimator)
+
+    if manifest_path:
+        entries = load_manifest(manifest_path)['entries']
+        file_names = [entry['id'] for entry in entries]
+        hashes = [entry['sha256'] for entry in entries] if cache_path else [None] * len(entries)
+    else:
+        file_names = sorted(os.listdir(folder_name))
+        file_paths = [folder_name + '/' + file_name for file_name in file_names]
+        hashes = [file_content_hash(file_path) for file_path in file_paths] if cache_path else [None] * len(file_paths)
+    cache = FeatureCache(cache_path, cache_version, columns, store_batch_size) if cache_path else None
+
+    # only files whose content has not been seen by this extractor version are parsed
+    is_missing = np.array([cache is None or file_hash not in cache for file_hash in hashes], dtype=bool)
+    missing = np.flatnonzero(is_missing).tolist()
+    sources = iter_midi_sources([entries[i] for i in missing]) if manifest_path else (file_paths[i] for i in missing)
+    capture = None
+    if metrics_path:
+        os.makedirs(os.path.dirname(metrics_path) or '.', exist_ok=True)
+        profile_dir = os.path.splitext(metrics_path)[0] + '_profiles'
+        capture = (profile, profile_dir)
+        if profile == 'cprofile':
+            # statistics of a previous run must not be merged with this one
+            os.makedirs(profile_dir, exist_ok=True)
+            for stale in os.listdir(profile_dir):
+                os.remove(os.path.join(profile_dir, stale))
+        metrics_file = open(metrics_path, 'w')
+    tasks = ((source, timeout, options, capture) for source in sources)
+    was_tracing = tracemalloc.is_tracing()
+
+    if store_path:
+        create_feature_store(store_path, columns, cache_version, dtype)
+
+    pool = Pool(processes=n_workers) if n_workers > 1 and len(missing) > 1 else None
+    try:
+        if pool is not None:
+            new_rows = imap_in_windows(pool, _feature_engineering_with_timeout, tasks, chunksize, window)
+        else:
+            new_rows = map(_feature_engineering_with_timeout, tasks)
+
+        # rows go to the store, and new ones to the cache, a batch at a time
+        file_ids, kept_rows = [], []
+        for file_name, file_hash, parse in zip(file_names, hashes, is_missing):
+            if not parse:
+                row, record = cache.get(file_hash), {'status': 'cached'}
+            else:
+                row, record = next(new_rows)
+                # failed files are not cached so that they are retried on the next run
+                if row is not None and cache is not None:
+                    cache.add(file_hash, row)
+            # failed files, and rows with missing values, are dropped
+            dropped = row is None or np.isnan(np.asarray(row, dtype=np.float64)).any()
+            if metrics_path:
+                if row is None:
+                    record['status'] = 'failed'
+                elif dropped:
+                    record.update(status='dropped', error_category='missing_values')
+                record.setdefault('status', 'ok')
+                metrics_file.write(json.dumps(dict(file_id=file_name, **record)) + '\n')
+            if dropped:
+                continue
+            file_ids.append(file_name)
+            kept_rows.append(row)
+            if store_path and len(kept_rows) == store_batch_size:
+                append_rows(store_path, file_ids, kept_rows)
+                file_ids, kept_rows = [], []
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if metrics_path:
+            metrics_file.close()
+        if profile == 'tracemalloc' and not was_tracing:
+            # started by run_with_capture when files are extracted in this process, where it would keep
+            # slowing down every allocation after the extraction
+            tracemalloc.stop()
+
+    if metrics_path:
+        # read back from the metrics file rather than kept in memory during the extraction
+        summary = summarize_file_metrics(read_metrics(metrics_path), top_n)
+        if profile == 'cprofile':
+            summary['profile'] = merge_profiles(profile_dir, os.path.splitext(metrics_path)[0] + '.prof')
+        write_summary(metrics_path, summary)
+
+    if cache is not None:
+        cache.compact()
+
+    if store_path:
+        append_rows(store_path, file_ids, kept_rows)
+        return open_feature_store(store_path).features
+    return np.array(kept_rows, dtype=dtype).reshape(-1, len(columns))
+
+
+def extract_features(parameters: dict) -> None:
+    """
+    Extracts the features of the files of the training and testing manifests into their feature stores,
+    the training files being those of the deduplicated manifest when the dedup section is enabled.
+
+    Input       : Content of parameters.yaml
+    Input_type  : Dictionary
+    """
+    extraction = dict(parameters['feature_engineering'], **parameters['features'])
+    settings = parameters['metrics']
+    for data_set in ('training', 'testing'):
+        metrics_path = os.path.join(settings['folder'], f'extraction_{data_set}.jsonl') if settings['enabled'] else None
+        manifest_path = parameters['manifests'][data_set]
+        if data_set == 'training' and parameters['dedup']['enabled']:
+            # one file per cluster of near-duplicates, see dedup.py
+            manifest_path = parameters['dedup']['manifest']
+        feature_engineering_all_files(manifest_path=manifest_path, **extraction,
+                                      cache_path=parameters['cache'][data_set],
+                                      store_path=parameters['artifacts'][data_set], metrics_path=metrics_path,
+                                      profile=settings['profile'], top_n=settings['top_n'])
+
 
 if __name__ == '__main__':
     warnings.filterwarnings('ignore')
     with open('parameters.yaml', 'r') as f:
         parameters = yaml.safe_load(f)
 
-    # dump the training dataset numpy array into pickle file
-    pickle.dump(feature_engineering_all_files(parameters['folders']['training']),
-                file=open(parameters['artifacts']['training'], 'wb'))
-
-    # dump the testing dataset numpy array into pickle file
-    pickle.dump(feature_engineering_all_files(parameters['folders']['testing']),
-                file=open(parameters['artifacts']['testing'], 'wb'))
+    # write the training and testing features into their feature stores
+    extract_features(parameters)
 
     print(f"Training set features saved in {parameters['artifacts']['training']}, testing set features saved in \
     {parameters['artifacts']['testing']}")
-
-
-
@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+from collections import namedtuple
+import numpy as np
+
+# A feature store is a folder holding
+#   schema.json  : feature names, dtype, extractor version
+#   features.bin : the feature matrix as raw C-ordered rows, appended to in place
+#   files.txt    : the id of the source MIDI file of each row, one per line
+# so that rows can be appended without rewriting anything and the matrix opened with mmap.
+FORMAT_VERSION = 1
+SCHEMA_FILE, FEATURES_FILE, FILE_IDS_FILE = 'schema.json', 'features.bin', 'files.txt'
+
+FeatureStore = namedtuple('FeatureStore', ['features', 'feature_names', 'file_ids', 'extractor_version'])
+
+
+def create_feature_store(path: str, feature_names: list, extractor_version: str, dtype: str = 'float64') -> None:
+    """
+    Creates an empty feature store, replacing any store already at 'path'.
+
+    Input 1     : Folder of the store
+    Input_type  : String
+
+    Input 2     : Names of the feature columns
+    Input_type  : List
+
+    Input 3     : Version of the extractor that computes the rows
+    Input_type  : String
+
+    Input 4     : Storage dtype of the feature matrix, 'float64' or 'float32'
+    Input_type  : String
+    """
+    if np.dtype(dtype) not in (np.float32, np.float64):
+        raise ValueError(f"Unsupported feature store dtype '{dtype}', expected 'float32' or 'float64'")
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    schema = {'format_version': FORMAT_VERSION, 'feature_names': list(feature_names),
+              'dtype': np.dtype(dtype).name, 'extractor_version': extractor_version}
+    with open(os.path.join(path, SCHEMA_FILE), 'w') as f:
+        json.dump(schema, f, indent=2)
+    open(os.path.join(path, FEATURES_FILE), 'wb').close()
+    open(os.path.join(path, FILE_IDS_FILE), 'w').close()
+
+
+def read_schema(path: str) -> dict:
+    """
+    Schema of a feature store: feature names, dtype and extractor version, without opening its rows.
+    """
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    if schema['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Feature store {path} has format version {schema['format_version']}, "
+                         f"expected {FORMAT_VERSION}")
+    return schema
+
+
+def append_rows(path: str, file_ids: list, rows) -> None:
+    """
+    Appends rows at the end of an existing feature store.
+
+    Input 1     : Folder of the store
+    Input_type  : String
+
+    Input 2     : Id of the source file of each row
+    Input_type  : List
+
+    Input 3     : Feature rows, one per file id
+    Input_type  : np.ndarray or list of lists
+    """
+    schema = read_schema(path)
+    rows = np.ascontiguousarray(rows, dtype=schema['dtype']).reshape(-1, len(schema['feature_names']))
+    if rows.shape[0] != len(file_ids):
+        raise ValueError(f'{rows.shape[0]} rows given for {len(file_ids)} file ids')
+    # the matrix is written first: a reader trusts only rows that also have their file id
+    with open(os.path.join(path, FEATURES_FILE), 'ab') as f:
+        f.write(rows.tobytes())
+    with open(os.path.join(path, FILE_IDS_FILE), 'a') as f:
+        f.writelines(file_id + '\n' for file_id in file_ids)
+
+
+def open_feature_store(path: str) -> FeatureStore:
+    """
+    Opens a feature store without reading the feature matrix into memory.
+
+    Input       : Folder of the store
+    Input_type  : String
+
+    Output      : Read-only memory mapped feature matrix (rows x features), feature names, source file
+                  id of each row and extractor version
+    Output_type : FeatureStore
+    """
+    schema = read_schema(path)
+    with open(os.path.join(path, FILE_IDS_FILE)) as f:
+        file_ids = f.read().splitlines()
+    n_columns = len(schema['feature_names'])
+    dtype = np.dtype(schema['dtype'])
+    n_rows = min(len(file_ids), os.path.getsize(os.path.join(path, FEATURES_FILE)) // (n_columns * dtype.itemsize))
+    if n_rows == 0:
+        features = np.empty((0, n_columns), dtype=dtype)
+    else:
+        features = np.memmap(os.path.join(path, FEATURES_FILE), dtype=dtype, mode='r', shape=(n_rows, n_columns))
+    return FeatureStore(features, schema['feature_names'], file_ids[:n_rows], schema['extractor_version'])
+
+
+def store_shape(path: str) -> tuple:
+    """
+    Number of rows and of features of a feature store, without reading its file ids or matrix into
+    memory (the file ids are counted block by block).
+    """
+    schema = read_schema(path)
+    n_ids = 0
+    with open(os.path.join(path, FILE_IDS_FILE), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n_ids += block.count(b'\n')
+    n_columns = len(schema['feature_names'])
+    row_bytes = n_columns * np.dtype(schema['dtype']).itemsize
+    return min(n_ids, os.path.getsize(os.path.join(path, FEATURES_FILE)) // row_bytes), n_columns
+
+
+def open_feature_matrix(path: str) -> np.ndarray:
+    """
+    Memory maps the feature matrix of a store (rows x features, read-only) without reading its file ids,
+    see open_feature_store for both.
+    """
+    schema = read_schema(path)
+    n_rows, n_columns = store_shape(path)
+    if n_rows == 0:
+        return np.empty((0, n_columns), dtype=schema['dtype'])
+    return np.memmap(os.path.join(path, FEATURES_FILE), dtype=schema['dtype'], mode='r', shape=(n_rows, n_columns))
+
+
+def iter_file_ids(path: str):
+    """
+    Yields the file ids of the rows of a feature store in store order, reading them line by line rather
+    than all at once (see store_shape for the number of rows).
+    """
+    n_rows, _ = store_shape(path)
+    with open(os.path.join(path, FILE_IDS_FILE)) as f:
+        for _, line in zip(range(n_rows), f):
+            yield line.rstrip('\n')
+
+
+def iter_feature_chunks(path: str, chunk_rows: int = 65536):
+    """
+    Reads the feature matrix of a store chunk by chunk with plain file reads, so that only one chunk
+    is in memory at a time (the pages of a memory map stay resident once read).
+
+    Input 1     : Folder of the store
+    Input_type  : String
+
+    Input 2     : Number of rows per chunk
+    Input_type  : Integer
+
+    Output      : Chunks of rows (rows x features), in store order
+    Output_type : Generator of np.ndarray
+    """
+    schema = read_schema(path)
+    dtype = np.dtype(schema['dtype'])
+    n_rows, n_columns = store_shape(path)
+    with open(os.path.join(path, FEATURES_FILE), 'rb') as f:
+        for start in range(0, n_rows, chunk_rows):
+            count = min(chunk_rows, n_rows - start) * n_columns
+            yield np.fromfile(f, dtype=dtype, count=count).reshape(-1, n_columns)
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# suffix of the folders holding exported forests, next to the pickled models
+FOREST_SUFFIX = '.forest'
+# deepest tree exported: the arrays take 20 x 2^depth bytes per tree, 4 MB for 100 trees of depth 11,
+# doubling with every level, 130 MB at this bound (max_samples of 65536)
+MAX_DEPTH = 16
+_ARRAYS = ('feature', 'threshold', 'leaf_value')
+
+
+def _average_path_length(n_samples_leaf: np.ndarray) -> np.ndarray:
+    # average path length of an unsuccessful search in a binary search tree of n samples, as in sklearn
+    n_samples_leaf = np.asarray(n_samples_leaf, dtype=np.float64)
+    average_path_length = np.zeros(n_samples_leaf.shape)
+    mask_1 = n_samples_leaf <= 1
+    mask_2 = n_samples_leaf == 2
+    not_mask = ~np.logical_or(mask_1, mask_2)
+    average_path_length[mask_2] = 1.0
+    average_path_length[not_mask] = (2.0 * (np.log(n_samples_leaf[not_mask] - 1.0) + np.euler_gamma)
+                                     - 2.0 * (n_samples_leaf[not_mask] - 1.0) / n_samples_leaf[not_mask])
+    return average_path_length
+
+
+class FlatIsolationForest:
+    """
+    Isolation Forest flattened into three contiguous arrays, scored for a batch at once.
+
+    Every tree is laid out as a complete binary tree of the forest's maximum depth D in heap order,
+    so that the children of node i are 2i+1 and 2i+2 and no child pointers are stored:
+        feature    (trees x 2^D - 1) split feature of each internal node
+        threshold  (trees x 2^D - 1) split threshold, rows go left when feature value <= threshold
+        leaf_value (trees x 2^D)     depth of the leaf + average path length of its samples
+    Leaves of the original tree above depth D are padded with splits that always go left
+    (threshold +inf), and every leaf below them repeats their value. Scoring walks all rows down all
+    trees together, one level per vectorized step, and gives the same score_samples /
+    decision_function / predict as the sklearn IsolationForest it was exported from.
+    Isolation trees are at most ceil(log2(max_samples)) deep, 8 with the default max_samples; as the
+    arrays double in size with every level of depth, deeper forests than MAX_DEPTH are not exported.
+    """
+
+    def __init__(self, feature, threshold, leaf_value, denominator, offset, n_features_in=None):
+        self.feature = feature
+        # None for the exports written before it was recorded
+        self.n_features_in_ = n_features_in
+        self.threshold = threshold
+        self.leaf_value = leaf_value
+        self.denominator = denominator
+        self.offset_ = offset
+        self.depth = int(np.log2(leaf_value.shape[1]))
+
+    @classmethod
+    def from_sklearn(cls, model, max_depth: int = MAX_DEPTH) -> 'FlatIsolationForest':
+        """
+        Flattens a fitted sklearn IsolationForest, raising a ValueError if its trees are deeper than max_depth.
+        """
+        subsample_features = model._max_features != model.n_features_in_
+        trees = [tree.tree_ for tree in model.estimators_]
+        depth = max(tree.max_depth for tree in trees)
+        if depth > max_depth:
+            raise ValueError(f"Trees of depth {depth} would take {20 * 2 ** depth * len(trees) / 2 ** 20:.0f} MB "
+                             f"flattened, more than the {max_depth} levels exported")
+        feature = np.zeros((len(trees), 2 ** depth - 1), dtype=np.int32)
+        threshold = np.full((len(trees), 2 ** depth - 1), np.inf)
+        leaf_value = np.zeros((len(trees), 2 ** depth))
+
+        for t, (tree, tree_features) in enumerate(zip(trees, model.estimators_features_)):
+            average_path_length = _average_path_length(tree.n_node_samples)
+            # (node of the sklearn tree, heap index, number of nodes on the path from the root)
+            stack = [(0, 0, 1)]
+            while stack:
+                node, heap, path_length = stack.pop()
+                if tree.children_left[node] == -1:
+                    # same expression as sklearn, for bit identical sums
+                    value = path_length + average_path_length[node] - 1.0
+                    level = int(np.log2(heap + 1))
+                    # heap leaves below this node, reached by always going left from here
+                    first = (heap + 1) * 2 ** (depth - level) - 1 - (2 ** depth - 1)
+                    leaf_value[t, first:first + 2 ** (depth - level)] = value
+                    continue
+                split_feature = tree.feature[node]
+                feature[t, heap] = tree_features[split_feature] if subsample_features else split_feature
+                threshold[t, heap] = tree.threshold[node]
+                stack.append((tree.children_left[node], 2 * heap + 1, path_length + 1))
+                stack.append((tree.children_right[node], 2 * heap + 2, path_length + 1))
+
+        denominator = len(trees) * _average_path_length([model._max_samples])[0]
+        return cls(feature, threshold, leaf_value, float(denominator), float(model.offset_), int(model.n_features_in_))
+
+    def save(self, path: str) -> None:
+        """
+        Writes the forest as one .npy file per array plus a small JSON header, in folder 'path'.
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'forest.json'), 'w') as f:
+            json.dump({'denominator': self.denominator, 'offset': self.offset_,
+                       'n_features_in': self.n_features_in_}, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'FlatIsolationForest':
+        """
+        Opens a forest written by save; the arrays are memory mapped rather than read.
+        """
+        with open(os.path.join(path, 'forest.json')) as f:
+            header = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in _ARRAYS}
+        return cls(**arrays, denominator=header['denominator'], offset=header['offset'],
+                   n_features_in=header.get('n_features_in'))
+
+    def _depths(self, X: np.ndarray) -> np.ndarray:
+        n_rows = X.shape[0]
+        n_trees, n_internal = self.feature.shape
+        # one row per tree and one column per sample, with X transposed so that a feature is contiguous
+        values = np.ascontiguousarray(X.T).ravel()
+        feature_start = self.feature.ravel().astype(np.intp) * n_rows
+        threshold = self.threshold.ravel()
+        columns = np.arange(n_rows)
+        tree_start = (np.arange(n_trees) * n_internal)[:, None]
+        node = np.repeat(tree_start, n_rows, axis=1)
+        for _ in range(self.depth):
+            # NaN compares False and goes right, as in sklearn trees without missing value support
+            go_right = ~(values[feature_start[node] + columns] <= threshold[node])
+            # heap index h of a tree starting at node s goes to 2h + 1 (left) or 2h + 2 (right)
+            node = 2 * node + 1 - tree_start + go_right
+        leaves = self.leaf_value.ravel()[node + (np.arange(n_trees) - n_internal)[:, None]]
+        # accumulate tree by tree, in the same order as sklearn, so the sums are bit identical
+        depths = np.zeros(n_rows)
+        for tree_leaves in leaves:
+            depths += tree_leaves
+        return depths
+
+    def score_samples(self, X: np.ndarray, chunk_size: int = 512) -> np.ndarray:
+        """
+        Opposite of the anomaly score of each row of X, the lower the more abnormal.
+        """
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        depths = np.concatenate([self._depths(X[start:start + chunk_size])
+                                 for start in range(0, X.shape[0], chunk_size)]) if X.shape[0] else np.zeros(0)
+        if self.denominator == 0:
+            return -np.ones_like(depths)
+        return -(2 ** (-depths / self.denominator))
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """
+        Shifted anomaly score: negative for outliers, positive for inliers.
+        """
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        1 for inliers and -1 for outliers.
+        """
+        labels = np.ones(np.shape(X)[0], dtype=int)
+        labels[self.decision_function(X) < 0] = -1
+        return labels
@@ -1,22 +1,220 @@
 import pickle
 import os
+import json
+import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+import numpy as np
+from feature_store import open_feature_store
+from flat_forest import FlatIsolationForest, FOREST_SUFFIX
+from metrics import summarize_chunk_metrics, write_summary
+from model_registry import CORPUS, list_models, load_metadata, load_model, model_key, song_scopes
+
+
+def _check_legacy_features(models_folder: str, model_file: str, model, feature_names: list) -> None:
+    # models fitted on numpy arrays, as every model saved before the registry, keep no column names
+    fitted_on = getattr(model, 'feature_names_in_', None)
+    n_features = getattr(model, 'n_features_in_', None)
+    pickle_path = os.path.join(models_folder, os.path.splitext(model_file)[0] + '.pkl')
+    if n_features is None and isinstance(model, FlatIsolationForest) and os.path.exists(pickle_path):
+        # flat forests exported before they recorded it: read from the pickle they were exported from
+        with open(pickle_path, 'rb') as f:
+            n_features = getattr(pickle.load(f), 'n_features_in_', None)
+    if fitted_on is not None:
+        if list(fitted_on) == feature_names:
+            return
+        fitted = f'the features {list(fitted_on)}'
+    elif n_features == len(feature_names):
+        print(f"ATTENTION: model '{model_file}', saved before the model registry, was fitted on {n_features} "
+              f"unnamed features, assumed to be {feature_names}")
+        return
+    else:
+        fitted = f'{n_features} features' if n_features is not None else 'unknown features'
+    raise ValueError(f"Model '{model_file}', saved before the model registry, was fitted on {fitted}, "
+                     f"not on {feature_names}: train the models again")
+
+
+def load_models(models_folder: str, scopes: list = None, feature_names: list = None) -> dict:
+    """
+    Loads the latest version of every model of the given scopes of the model registry (see
+    model_registry.py), keyed by model_registry.model_key: the corpus models keep their plain names.
+    Models saved directly in the folder by earlier versions of training.py (<name>.pkl, and <name>.forest
+    exported by flat_forest.py, which is memory mapped and replaces the pickle) are loaded when the
+    registry holds no corpus model; they have no metadata, so when feature names are given they are checked
+    against the column names sklearn kept, or else only their number of features is, with a warning.
+
+    Input 1     : Models folder (artifacts.models)
+    Input_type  : String
+
+    Input 2     : Scopes to load, every scope of whole files (corpus and composers) if 'all', the corpus
+                  only if None
+    Input_type  : List or String
+
+    Input 3     : If given, feature names the models must have been fitted on, a ValueError is raised otherwise
+    Input_type  : List
+
+    Output      : Fitted models keyed by name
+    Output_type : Dictionary
+    """
+    registered = list_models(models_folder)
+    scopes = song_scopes(scope for scope, _, _ in registered) if scopes == 'all' else scopes or [CORPUS]
+    models = {}
+    for scope, name, version in registered:
+        if scope not in scopes:
+            continue
+        if feature_names is not None:
+            fitted_on = load_metadata(models_folder, scope, name, version)['feature_names']
+            if fitted_on != feature_names:
+                raise ValueError(f"Model '{model_key(scope, name)}' version {version} was fitted on the features "
+                                 f"{fitted_on}, not on {feature_names}: train the models again")
+        models[model_key(scope, name)] = load_model(models_folder, scope, name, version)
+    if any(scope == CORPUS for scope, _, _ in registered) or CORPUS not in scopes:
+        return models
+    for model_file in sorted(os.listdir(models_folder)):
+        name, extension = os.path.splitext(model_file)
+        if extension == FOREST_SUFFIX:
+            model = FlatIsolationForest.load(os.path.join(models_folder, model_file))
+        elif extension == '.pkl' and not os.path.isdir(os.path.join(models_folder, name + FOREST_SUFFIX)):
+            with open(os.path.join(models_folder, model_file), 'rb') as f:
+                model = pickle.load(f)
+        else:
+            continue
+        if feature_names is not None:
+            _check_legacy_features(models_folder, model_file, model, feature_names)
+        models[name] = model
+    return models
+
+
+def predict_with_scores(model, rows: np.ndarray) -> tuple:
+    """
+    Labels (1 inlier, -1 outlier) and decision scores of the rows, scoring them only once.
+    Every model here labels as outliers the rows with a negative decision score.
+    """
+    scores = model.decision_function(rows)
+    return np.where(scores < 0, -1, 1), scores
+
+
+def _timed_predict_with_scores(model, rows: np.ndarray) -> tuple:
+    start = time.perf_counter()
+    labels, scores = predict_with_scores(model, rows)
+    return labels, scores, time.perf_counter() - start
+
+
+def score_in_chunks(features, file_ids: list, models: dict, output_path: str, chunk_size: int = 10000,
+                    n_workers: int = 1, metrics_path: str = None) -> dict:
+    """
+    Scores the test set chunk by chunk and streams one JSON record per file into output_path.
+
+    Each record holds the file id, the label and decision score of every model and whether all models
+    agree on the label. Only one chunk of rows and scores is in memory at a time. With n_workers > 1
+    the models score each chunk concurrently in threads (their numerical kernels release the GIL).
+    If metrics_path is given, the scoring time of each model on each chunk is written there as JSON
+    lines, with a summary report of rows per second and chunk time percentiles next to it.
+
+    Input 1     : Feature matrix, typically the memory map of a feature store
+    Input_type  : np.ndarray
+
+    Input 2     : Source file id of each row
+    Input_type  : List
+
+    Input 3     : Fitted models keyed by name
+    Input_type  : Dictionary
+
+    Input 4     : Path of the JSON lines output
+    Input_type  : String
+
+    Input 5     : Number of rows scored at once
+    Input_type  : Integer
+
+    Input 6     : Number of models scoring a chunk at the same time
+    Input_type  : Integer
+
+    Input 7     : Path of the JSON lines scoring metrics, None to disable them
+    Input_type  : String
+
+    Output      : Summary with the number of files, outliers per model and the Jaccard similarity of
+                  the predictions of each pair of models
+    Output_type : Dictionary
+    """
+    names = list(models)
+    outliers = {name: 0 for name in names}
+    # Jaccard of the inlier (label 1) sets, accumulated over chunks as |both inlier| / |either inlier|
+    pair_counts = {pair: [0, 0] for pair in combinations(names, 2)}
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    executor = ThreadPoolExecutor(max_workers=n_workers) if n_workers > 1 and len(models) > 1 else None
+    metrics_file, records = (open(metrics_path, 'w'), []) if metrics_path else (None, None)
+    with open(output_path, 'w') as f:
+        for start in range(0, features.shape[0], chunk_size):
+            rows = features[start:start + chunk_size]
+            if executor is not None:
+                results = list(executor.map(lambda model: _timed_predict_with_scores(model, rows), models.values()))
+            else:
+                results = [_timed_predict_with_scores(model, rows) for model in models.values()]
+            labels = {name: result[0] for name, result in zip(names, results)}
+            scores = {name: result[1] for name, result in zip(names, results)}
+            if metrics_file is not None:
+                records.append({'chunk': start // chunk_size, 'rows': int(rows.shape[0]),
+                                'models_s': {name: result[2] for name, result in zip(names, results)}})
+                metrics_file.write(json.dumps(records[-1]) + '\n')
+
+            for name in names:
+                outliers[name] += int((labels[name] == -1).sum())
+            for (a, b), counts in pair_counts.items():
+                counts[0] += int(((labels[a] == 1) & (labels[b] == 1)).sum())
+                counts[1] += int(((labels[a] == 1) | (labels[b] == 1)).sum())
+
+            for i, file_id in enumerate(file_ids[start:start + chunk_size]):
+                record = {'file_id': file_id}
+                for name in names:
+                    record[name] = {'label': int(labels[name][i]), 'score': float(scores[name][i])}
+                record['models_agree'] = len({int(labels[name][i]) for name in names}) == 1
+                f.write(json.dumps(record) + '\n')
+    if executor is not None:
+        executor.shutdown()
+    if metrics_file is not None:
+        metrics_file.close()
+        write_summary(metrics_path, summarize_chunk_metrics(records))
+
+    return {'files': int(features.shape[0]),
+            'outliers': outliers,
+            'jaccard_similarity': {f'{a}/{b}': both / either if either else 1.
+                                   for (a, b), (both, either) in pair_counts.items()}}
+
+
+def score_test_set(parameters: dict) -> dict:
+    """
+    Scores the testing feature store with the latest corpus models of the model registry, or with the
+    models of every scope (corpus and composers) if 'inference.models' is 'all', writing the predictions
+    (JSON lines) and their summary where the artifacts section of parameters.yaml says.
+
+    Input       : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Output      : Summary of the predictions, see score_in_chunks
+    Output_type : Dictionary
+    """
+    test_set = open_feature_store(parameters['artifacts']['testing'])
+    scopes = 'all' if parameters['inference']['models'] == 'all' else None
+    models = load_models(parameters['artifacts']['models'], scopes, test_set.feature_names)
+    metrics_path = None
+    if parameters['metrics']['enabled']:
+        os.makedirs(parameters['metrics']['folder'], exist_ok=True)
+        metrics_path = os.path.join(parameters['metrics']['folder'], 'scoring.jsonl')
+    summary = score_in_chunks(test_set.features, test_set.file_ids, models, parameters['artifacts']['Results'],
+                              parameters['inference']['chunk_size'], parameters['inference']['n_workers'],
+                              metrics_path)
+    with open(parameters['artifacts']['Results_summary'], 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
 
 if __name__ == '__main__':
     with open('parameters.yaml', 'r') as f:
         parameters = yaml.safe_load(f)
 
-    # load test set
-    X_test_array = pickle.load(file=open(parameters['artifacts']['testing'], "rb"))
-    os.system("rm -rf Artifacts/Results")
-    os.system("mkdir Artifacts/Results")
-    with open(parameters['artifacts']['Results'], 'w+') as f:
-        for pickle_file in os.listdir(parameters['artifacts']['models']):
-            path = parameters['artifacts']['models'] + '/' + pickle_file
-            model = pickle.load(file=open(path, 'rb'))
-            f.write(pickle_file + "\n")
-            f.write(str(model.predict(X_test_array)) + "\n\n")
+    summary = score_test_set(parameters)
+    for pair, similarity in summary['jaccard_similarity'].items():
+        print(f'{pair}: the models agree on {round(similarity * 100)} % of observations of X_test')
     print(f" Success: Results are saved as {parameters['artifacts']['Results']}")
-
-
-
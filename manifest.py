@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import tarfile
+import time
+import zipfile
+from itertools import islice
+
+# A manifest lists every MIDI file of a data source without copying it:
+#   entries  : one dict per file, in read order, with
+#              id     : path relative to the source, spaces replaced by underscores (used as file id)
+#              path   : absolute path of the file, or of the archive holding it
+#              member : name of the member inside the archive, None for a plain file
+#              size, mtime_ns, sha256 : of the file or member, the hash being the content hash of feature_cache.py
+#   archives : size and mtime_ns of every archive, so unchanged archives are not reopened
+FORMAT_VERSION = 1
+MIDI_EXTENSIONS = ('.mid', '.midi')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.tgz', '.tar')
+
+
+def _is_midi(name: str) -> bool:
+    return name.lower().endswith(MIDI_EXTENSIONS)
+
+
+def _is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _file_id(*parts: str) -> str:
+    return '/'.join(part for part in parts if part).replace(' ', '_')
+
+
+def _hash_stream(f, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(block_size), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _archive_members(archive_path: str, prefix: str):
+    """
+    Yields (entry, content) for every MIDI member of an archive, streaming it once in archive order.
+    """
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_midi(info.filename):
+                    continue
+                content = archive.read(info)
+                # zip members carry a local date and time rather than a timestamp
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                yield {'id': _file_id(prefix, info.filename), 'path': archive_path, 'member': info.filename,
+                       'size': info.file_size, 'mtime_ns': int(mtime * 1e9)}, content
+    else:
+        # 'r|*' reads the (possibly compressed) tar as a stream, without seeking back
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for info in archive:
+                if not info.isfile() or not _is_midi(info.name):
+                    continue
+                content = archive.extractfile(info).read()
+                yield {'id': _file_id(prefix, info.name), 'path': archive_path, 'member': info.name,
+                       'size': info.size, 'mtime_ns': int(info.mtime * 1e9)}, content
+
+
+def build_manifest(source: str, previous: dict = None) -> dict:
+    """
+    Lists the MIDI files of a data source together with their size, modification time and content hash.
+
+    The source is a folder, walked recursively, or an archive (.zip, .tar, .tar.gz, .tgz); archives
+    found inside a folder are listed member by member too. Nothing is copied or extracted to disk.
+    Files whose size and modification time match their entry in the previous manifest keep its hash
+    without being read, and archives whose size and modification time did not change are not reopened.
+
+    Input 1     : Folder or archive holding the MIDI files
+    Input_type  : String
+
+    Input 2     : Manifest of a previous run on the same source, if any
+    Input_type  : Dictionary
+
+    Output      : Manifest, see the top of this module
+    Output_type : Dictionary
+    """
+    source = os.path.abspath(source)
+    previous = previous or {'entries': [], 'archives': {}}
+    known = {(entry['path'], entry['member']): entry for entry in previous['entries']}
+    previous_members = {}
+    for entry in previous['entries']:
+        if entry['member'] is not None:
+            previous_members.setdefault(entry['path'], []).append(entry)
+
+    if os.path.isdir(source):
+        found = []
+        for folder, sub_folders, file_names in os.walk(source):
+            sub_folders.sort()
+            found.extend(os.path.join(folder, file_name) for file_name in sorted(file_names)
+                         if _is_midi(file_name) or _is_archive(file_name))
+    else:
+        found = [source]
+
+    entries, archives = [], {}
+    for path in found:
+        stat = os.stat(path)
+        relative = os.path.relpath(path, source) if path != source else ''
+        if _is_archive(path):
+            archives[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            if previous['archives'].get(path) == archives[path] and path in previous_members:
+                entries.extend(previous_members[path])
+                continue
+            for entry, content in _archive_members(path, relative):
+                entry['sha256'] = hashlib.sha256(content).hexdigest()
+                entries.append(entry)
+            continue
+        entry = {'id': _file_id(relative or os.path.basename(path)), 'path': path, 'member': None,
+                 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        old = known.get((path, None))
+        if old is not None and (old['size'], old['mtime_ns']) == (entry['size'], entry['mtime_ns']):
+            entry['sha256'] = old['sha256']
+        else:
+            with open(path, 'rb') as f:
+                entry['sha256'] = _hash_stream(f)
+        entries.append(entry)
+
+    return {'format_version': FORMAT_VERSION, 'source': source, 'entries': entries, 'archives': archives}
+
+
+def manifest_changes(previous: dict, current: dict) -> dict:
+    """
+    Counts the files added, changed, removed and unchanged between two manifests, matched by id.
+    """
+    old = {entry['id']: entry['sha256'] for entry in previous['entries']}
+    new = {entry['id']: entry['sha256'] for entry in current['entries']}
+    return {'added': sum(file_id not in old for file_id in new),
+            'changed': sum(file_id in old and old[file_id] != file_hash for file_id, file_hash in new.items()),
+            'removed': sum(file_id not in new for file_id in old),
+            'unchanged': sum(old.get(file_id) == file_hash for file_id, file_hash in new.items())}
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Loads a manifest written by save_manifest; a missing one, or one of another format, is empty.
+    """
+    if not os.path.exists(manifest_path):
+        return {'format_version': FORMAT_VERSION, 'source': None, 'entries': [], 'archives': {}}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        return {'format_version': FORMAT_VERSION, 'source': None, 'entries': [], 'archives': {}}
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: dict) -> None:
+    """
+    Writes the manifest atomically so that an interrupted run never leaves a truncated file behind.
+    """
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def iter_midi_sources(entries: list):
+    """
+    Yields, for each manifest entry in order, what the MIDI parsers read: the path of a plain file, which
+    is read in place, or the bytes of an archive member. Each archive is opened once and read in
+    member order, so compressed tars are streamed rather than decompressed once per member.
+    The entries must keep the relative order of the manifest (any subset of it may be given).
+
+    Input       : Manifest entries
+    Input_type  : List
+
+    Output      : Generator of file paths (String) and member contents (bytes), one per entry
+    Output_type : Generator
+    """
+    archive, members = None, None
+    for entry in entries:
+        if entry['member'] is None:
+            yield entry['path']
+            continue
+        if entry['path'] != archive:
+            archive = entry['path']
+            members = _read_members(archive, [other['member'] for other in entries if other['path'] == archive])
+        yield next(members)
+
+
+def imap_in_windows(pool, function, tasks, chunksize: int, window: int):
+    """
+    Like pool.imap(function, tasks), but takes at most 'window' tasks from the iterator at a time, so
+    that tasks carrying file contents (see iter_midi_sources) are not all read ahead of the workers.
+    """
+    tasks = iter(tasks)
+    while batch := list(islice(tasks, window)):
+        yield from pool.imap(function, batch, chunksize=chunksize)
+
+
+def _read_members(archive_path: str, wanted: list):
+    # contents of the wanted members, in archive order
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for name in wanted:
+                yield archive.read(name)
+        return
+    wanted = set(wanted)
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for info in archive:
+            if info.name in wanted:
+                yield archive.extractfile(info).read()
@@ -0,0 +1,200 @@
+import cProfile
+import glob
+import heapq
+import json
+import os
+import pstats
+import sys
+import tracemalloc
+from array import array
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then not reported
+    resource = None
+
+# Metrics are JSON lines, one record per file (extraction) or per chunk (scoring), plus a summary
+# JSON next to them ('x.jsonl' -> 'x_summary.json'). Extraction records hold
+#   file_id, status ('ok', 'cached', 'failed', 'dropped'), error_category and error of failed files,
+#   parse_s, groups (seconds per feature group), total_s, notes, max_rss_bytes,
+#   and peak_traced_bytes in 'tracemalloc' capture mode.
+PROFILE_MODES = ('none', 'cprofile', 'tracemalloc')
+_profilers = {}
+
+
+def summary_path(metrics_path: str) -> str:
+    """
+    Path of the summary report written next to a JSON lines metrics file.
+    """
+    return os.path.splitext(metrics_path)[0] + '_summary.json'
+
+
+def max_rss_bytes(children: bool = False) -> int:
+    """
+    Peak resident set size of the current process so far, or of the largest of its terminated child
+    processes, None where it cannot be read.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def percentiles(values) -> dict:
+    """
+    Mean, 50th, 90th and 99th percentiles and maximum of a list of numbers, empty if there are none.
+    """
+    values = np.asarray(values if isinstance(values, array) else [value for value in values if value is not None],
+                        dtype=np.float64)
+    if values.shape[0] == 0:
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'mean': float(values.mean()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+            'max': float(values.max())}
+
+
+def run_with_capture(profile: str, profile_dir: str, function, *args):
+    """
+    Calls function(*args) under the capture mode of parameters.yaml and returns its result together
+    with the captured values: the peak of traced memory during the call ('tracemalloc'), or nothing
+    ('cprofile', whose statistics are accumulated per process into profile_dir/<pid>.prof).
+
+    Input 1     : Capture mode, one of PROFILE_MODES
+    Input_type  : String
+
+    Input 2     : Folder of the cProfile statistics
+    Input_type  : String
+
+    Input 3     : Function to call, followed by its arguments
+    Input_type  : Callable
+
+    Output      : Result of the call and dictionary of captured values
+    Output_type : Tuple
+    """
+    if profile == 'tracemalloc':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        result = function(*args)
+        return result, {'peak_traced_bytes': tracemalloc.get_traced_memory()[1]}
+    if profile == 'cprofile':
+        profiler = _profilers.setdefault(os.getpid(), cProfile.Profile())
+        profiler.enable()
+        try:
+            result = function(*args)
+        finally:
+            profiler.disable()
+        # rewritten after every call, since worker processes are not told when they are about to exit
+        profiler.dump_stats(os.path.join(profile_dir, f'{os.getpid()}.prof'))
+        return result, {}
+    if profile != 'none':
+        raise ValueError(f"Unknown profile mode '{profile}', expected one of {PROFILE_MODES}")
+    return function(*args), {}
+
+
+def merge_profiles(profile_dir: str, output_path: str, top_n: int = 20) -> list:
+    """
+    Merges the per-process cProfile statistics of profile_dir into one file readable by pstats or
+    snakeviz, and lists the functions with the largest cumulative time.
+
+    Output      : Top functions as dictionaries (function, calls, total_s, cumulative_s)
+    Output_type : List
+    """
+    profile_files = sorted(glob.glob(os.path.join(profile_dir, '*.prof')))
+    if not profile_files:
+        return []
+    stats = pstats.Stats(*profile_files)
+    stats.dump_stats(output_path)
+    top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    return [{'function': f'{os.path.basename(file_name)}:{line}({function})', 'calls': calls,
+             'total_s': total_time, 'cumulative_s': cumulative_time}
+            for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in top]
+
+
+def read_metrics(metrics_path: str):
+    """
+    Yields the records of a JSON lines metrics file one at a time.
+    """
+    with open(metrics_path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def summarize_file_metrics(records, top_n: int = 10) -> dict:
+    """
+    Summary report of extraction metrics: file counts by status and error category, percentiles of the
+    parse, per group and total times and of the note counts and memory, and the top-N slowest files.
+    The records are read once, keeping only their numbers and the top-N slowest ones, so they can be
+    streamed from the metrics file (see read_metrics).
+
+    Input 1     : Extraction metric records, see the top of this module
+    Input_type  : Iterable of dictionaries
+
+    Input 2     : Number of slowest files to list
+    Input_type  : Integer
+
+    Output      : Summary report
+    Output_type : Dictionary
+    """
+    n_files, statuses, error_categories, max_rss = 0, {}, {}, 0
+    values = {key: array('d') for key in ('total_s', 'parse_s', 'notes', 'peak_traced_bytes')}
+    groups, slowest, traced = {}, [], False
+    for n_files, record in enumerate(records, 1):
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        if record.get('error_category'):
+            error_categories[record['error_category']] = error_categories.get(record['error_category'], 0) + 1
+        max_rss = max(max_rss, record.get('max_rss_bytes') or 0)
+        if record['status'] == 'cached':
+            continue
+        for key, column in values.items():
+            if record.get(key) is not None:
+                column.append(record[key])
+        traced = traced or 'peak_traced_bytes' in record
+        for group, seconds in record.get('groups', {}).items():
+            column = groups.setdefault(group, array('d'))
+            if seconds is not None:
+                column.append(seconds)
+        # the slowest first, and the first one read among equally slow files
+        entry = (record['total_s'], -n_files,
+                 {key: record.get(key) for key in ('file_id', 'total_s', 'notes', 'status')})
+        if len(slowest) < top_n:
+            heapq.heappush(slowest, entry)
+        elif top_n and entry[:2] > slowest[0][:2]:
+            heapq.heapreplace(slowest, entry)
+    summary = {'files': n_files, 'status': statuses, 'error_categories': error_categories,
+               'total_s': percentiles(values['total_s']),
+               'parse_s': percentiles(values['parse_s']),
+               'groups_s': {group: percentiles(groups[group]) for group in sorted(groups)},
+               'notes': percentiles(values['notes']),
+               'max_rss_bytes': max_rss,
+               'slowest_files': [entry[2] for entry in sorted(slowest, key=lambda entry: entry[:2], reverse=True)]}
+    if traced:
+        summary['peak_traced_bytes'] = percentiles(values['peak_traced_bytes'])
+    return summary
+
+
+def summarize_chunk_metrics(records: list) -> dict:
+    """
+    Summary report of scoring metrics: rows, and per model total time, rows per second and
+    percentiles of the per chunk times.
+    """
+    models = sorted({name for record in records for name in record['models_s']})
+    rows = sum(record['rows'] for record in records)
+    summary = {'chunks': len(records), 'rows': rows, 'models': {}}
+    for name in models:
+        times = [record['models_s'][name] for record in records]
+        summary['models'][name] = {'total_s': float(sum(times)),
+                                   'rows_per_s': rows / sum(times) if sum(times) else None,
+                                   'chunk_s': percentiles(times)}
+    summary['max_rss_bytes'] = max_rss_bytes()
+    return summary
+
+
+def write_summary(metrics_path: str, summary: dict) -> None:
+    """
+    Writes a summary report next to its JSON lines metrics file.
+    """
+    with open(summary_path(metrics_path), 'w') as f:
+        json.dump(summary, f, indent=2)
@@ -0,0 +1,444 @@
+import struct
+import numpy as np
+
+# same sanity limit as pretty_midi: files with a larger tick count are almost surely corrupt
+MAX_TICK = 1e7
+
+# number of data bytes following each channel voice status, indexed by status >> 4
+_CHANNEL_DATA_LENGTH = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+
+# number of data bytes following each system common / real time status (as defined by mido)
+_SYSTEM_DATA_LENGTH = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+
+class MidiParseError(Exception):
+    """Raised when a file is not a Standard MIDI File this parser can decode."""
+
+
+class MidiArrays:
+    """
+    Compact, array based view of a Standard MIDI File.
+
+    Holds only what the handcrafted features need: the notes as parallel arrays, the tempo map,
+    the time signatures and the end time. It exposes the subset of the pretty_midi.PrettyMIDI
+    interface used by feature_engineering_single_file, with the same semantics.
+    """
+
+    def __init__(self, resolution, start, end, velocity, pitch, program, is_drum, tempo_change_times,
+                 tempi, time_signatures, end_time):
+        self.resolution = resolution
+        self.start = start
+        self.end = end
+        self.velocity = velocity
+        self.pitch = pitch
+        self.program = program
+        self.is_drum = is_drum
+        self.tempo_change_times = tempo_change_times
+        self.tempi = tempi
+        self.time_signatures = time_signatures  # list of (numerator, denominator, time) sorted by time
+        self.end_time = end_time
+
+    def note_table(self) -> tuple:
+        """
+        Output      : Arrays (start, end, velocity, pitch) of all notes, and a mask of the pitched notes
+        Output_type : Tuple of np.ndarray
+        """
+        return self.start, self.end, self.velocity, self.pitch, ~self.is_drum
+
+    def get_end_time(self) -> float:
+        return self.end_time
+
+    def get_tempo_changes(self) -> tuple:
+        return self.tempo_change_times, self.tempi
+
+    def get_onsets(self) -> np.ndarray:
+        return np.sort(self.start)
+
+    def estimate_tempo(self) -> float:
+        tempi = estimate_tempi(self.get_onsets())[0]
+        if tempi.size == 0:
+            raise ValueError("Can't provide a global tempo estimate when there are fewer than two notes.")
+        return tempi[0]
+
+    def get_beats(self, start_time: float = 0.) -> np.ndarray:
+        return beats_from_tempo_map(self.tempo_change_times, self.tempi, self.time_signatures, self.end_time,
+                                    start_time)
+
+    def get_downbeats(self, start_time: float = 0.) -> np.ndarray:
+        return downbeats_from_beats(self.get_beats(start_time), self.time_signatures, start_time)
+
+
+def _read_varlen(data: bytes, pos: int) -> tuple:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def read_midi(file_path) -> MidiArrays:
+    """
+    Decodes a Standard MIDI File straight into arrays, without building per-event Python objects.
+
+    Note pairing, tempo map (tempo and meter events are read from the first track only), tick to
+    time conversion and end time follow pretty_midi, so features computed on the result match the
+    ones computed on pretty_midi.PrettyMIDI(file_path).
+
+    Input       : Path of the MIDI file, or its raw bytes
+    Input_type  : String or bytes
+
+    Output      : Notes, tempo map and time signatures of the file
+    Output_type : MidiArrays
+    """
+    if isinstance(file_path, bytes):
+        data, file_path = file_path, '<bytes>'
+    else:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    try:
+        return _decode(data)
+    except MidiParseError:
+        raise
+    except (IndexError, ValueError, ZeroDivisionError, struct.error) as e:
+        raise MidiParseError(f'{file_path}: {e!r}') from e
+
+
+def _decode(data: bytes) -> MidiArrays:
+    if data[:4] != b'MThd':
+        raise MidiParseError('MThd not found. Probably not a MIDI file')
+    header_size, = struct.unpack_from('>L', data, 4)
+    if header_size < 6:
+        raise MidiParseError('truncated MThd chunk')
+    _, number_tracks, resolution = struct.unpack_from('>hhh', data, 8)
+    pos = 8 + header_size
+
+    # notes, stored as ticks until the tempo map is known
+    note_start, note_end, note_velocity, note_pitch, note_program, note_channel = [], [], [], [], [], []
+    tempo_events = []             # (tick, microseconds per quarter note), first track only
+    time_signature_events = []    # (tick, numerator, denominator), first track only
+    meta_ticks = []               # key signatures of the first track, text and lyrics of all tracks
+    max_tick = -1
+
+    # pretty_midi attaches control changes and pitch bends to an instrument keyed by
+    # (program, channel, track), or to a per (channel, track) straggler that only ends up in the
+    # file once an instrument is created on that channel; both contribute to the end time
+    instruments = set()
+    stragglers = {}
+    control_max_tick = -1
+
+    for track_idx in range(number_tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            raise MidiParseError('no MTrk header at start of track')
+        size, = struct.unpack_from('>L', data, pos + 4)
+        pos += 8
+        track_end = pos + size
+        if track_end > len(data):
+            raise MidiParseError('truncated MTrk chunk')
+        if size == 0:
+            raise MidiParseError('empty track')
+
+        tick = 0
+        last_status = None
+        current_program = [0] * 16
+        open_notes = {}
+        while pos < track_end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            status = data[pos]
+            pos += 1
+            if status < 0x80:
+                if last_status is None:
+                    raise MidiParseError('running status without last_status')
+                status = last_status
+                pos -= 1
+            elif status != 0xFF:
+                last_status = status
+
+            if status == 0xFF:
+                meta_type = data[pos]
+                length, pos = _read_varlen(data, pos + 1)
+                payload = data[pos:pos + length]
+                if len(payload) < length:
+                    raise MidiParseError('truncated meta event')
+                pos += length
+                if meta_type == 0x01 or meta_type == 0x05:
+                    meta_ticks.append(tick)
+                elif track_idx == 0 and meta_type == 0x51:
+                    tempo_events.append((tick, (payload[0] << 16) | (payload[1] << 8) | payload[2]))
+                elif track_idx == 0 and meta_type == 0x58:
+                    if payload[0] == 0:
+                        raise MidiParseError('time signature numerator must be greater than 0')
+                    time_signature_events.append((tick, payload[0], 2 ** payload[1]))
+                elif track_idx == 0 and meta_type == 0x59:
+                    key = payload[0] - 256 if payload[0] > 127 else payload[0]
+                    if not -7 <= key <= 7 or payload[1] not in (0, 1):
+                        raise MidiParseError('invalid key signature')
+                    meta_ticks.append(tick)
+            elif status == 0xF0 or status == 0xF7:
+                length, pos = _read_varlen(data, pos)
+                pos += length
+            elif status >= 0xF0:
+                if status not in _SYSTEM_DATA_LENGTH:
+                    raise MidiParseError(f'undefined status byte 0x{status:02x}')
+                pos += _SYSTEM_DATA_LENGTH[status]
+            else:
+                kind = status >> 4
+                channel = status & 0x0F
+                data_1 = data[pos]
+                if _CHANNEL_DATA_LENGTH[kind] == 2:
+                    data_2 = data[pos + 1]
+                    if data_1 > 127 or data_2 > 127:
+                        raise MidiParseError('data byte must be in range 0..127')
+                    pos += 2
+                else:
+                    if data_1 > 127:
+                        raise MidiParseError('data byte must be in range 0..127')
+                    pos += 1
+
+                if kind == 0xC:
+                    current_program[channel] = data_1
+                elif kind == 0x9 and data_2 > 0:
+                    open_notes.setdefault((channel, data_1), []).append((tick, data_2))
+                elif kind == 0x8 or kind == 0x9:
+                    key = (channel, data_1)
+                    if key in open_notes:
+                        to_close = [note for note in open_notes[key] if note[0] != tick]
+                        to_keep = [note for note in open_notes[key] if note[0] == tick]
+                        if to_close:
+                            program = current_program[channel]
+                            for start_tick, velocity in to_close:
+                                note_start.append(start_tick)
+                                note_end.append(tick)
+                                note_velocity.append(velocity)
+                                note_pitch.append(data_1)
+                                note_program.append(program)
+                                note_channel.append(channel)
+                            if (program, channel, track_idx) not in instruments:
+                                instruments.add((program, channel, track_idx))
+                                if (channel, track_idx) in stragglers:
+                                    stragglers[(channel, track_idx)][1] = True
+                        if to_close and to_keep:
+                            open_notes[key] = to_keep
+                        else:
+                            del open_notes[key]
+                elif kind == 0xB or kind == 0xE:
+                    if (current_program[channel], channel, track_idx) in instruments:
+                        control_max_tick = max(control_max_tick, tick)
+                    else:
+                        straggler = stragglers.setdefault((channel, track_idx), [tick, False])
+                        straggler[0] = max(straggler[0], tick)
+        if pos != track_end:
+            raise MidiParseError('event runs past the end of its track')
+        max_tick = max(max_tick, tick)
+
+    if number_tracks <= 0:
+        raise MidiParseError('file contains no tracks')
+    if max_tick + 1 > MAX_TICK:
+        raise MidiParseError('MIDI file has a largest tick of {}, it is likely corrupt'.format(max_tick + 1))
+
+    # tempo map as (tick, seconds per tick) segments, following pretty_midi._load_tempo_changes
+    tick_scales = [(0, 60.0 / (120.0 * resolution))]
+    for tick, tempo in tempo_events:
+        tick_scale = 60.0 / ((6e7 / tempo) * resolution)
+        if tick == 0:
+            tick_scales = [(0, tick_scale)]
+        elif tick_scale != tick_scales[-1][1]:
+            tick_scales.append((tick, tick_scale))
+    scale_ticks = np.array([tick for tick, _ in tick_scales], dtype=np.int64)
+    scales = np.array([tick_scale for _, tick_scale in tick_scales])
+    scale_times = np.zeros(len(tick_scales))
+    for n in range(1, len(tick_scales)):
+        scale_times[n] = scale_times[n - 1] + scales[n - 1] * (scale_ticks[n] - scale_ticks[n - 1])
+
+    def tick_to_time(ticks):
+        ticks = np.asarray(ticks, dtype=np.int64)
+        segment = np.searchsorted(scale_ticks, ticks, side='right') - 1
+        return scale_times[segment] + scales[segment] * (ticks - scale_ticks[segment])
+
+    start = tick_to_time(note_start)
+    end = tick_to_time(note_end)
+    tempo_change_times = tick_to_time(scale_ticks)
+    time_signatures = sorted(((numerator, denominator, float(tick_to_time(tick)))
+                              for tick, numerator, denominator in time_signature_events), key=lambda ts: ts[2])
+
+    control_ticks = [control_max_tick] + [max_tick for max_tick, adopted in stragglers.values() if adopted]
+    event_ticks = [tick for tick in control_ticks if tick >= 0] + meta_ticks
+    end_times = [tick_to_time(event_ticks)] if event_ticks else []
+    end_times += [end, tempo_change_times, np.array([ts[2] for ts in time_signatures])]
+    end_times = np.concatenate(end_times)
+
+    return MidiArrays(resolution=resolution,
+                      start=start,
+                      end=end,
+                      velocity=np.array(note_velocity, dtype=np.float64),
+                      pitch=np.array(note_pitch, dtype=np.float64),
+                      program=np.array(note_program, dtype=np.int64),
+                      is_drum=np.array(note_channel, dtype=np.int64) == 9,
+                      tempo_change_times=tempo_change_times,
+                      tempi=60.0 / (scales * resolution),
+                      time_signatures=time_signatures,
+                      end_time=float(end_times.max()) if end_times.size else 0.)
+
+
+def _qpm_to_bpm(quarter_note_tempo: float, numerator: int, denominator: int) -> float:
+    # same conversion as pretty_midi.qpm_to_bpm
+    if denominator in [1, 2, 4, 8, 16, 32]:
+        if numerator == 3:
+            return quarter_note_tempo * denominator / 4.0
+        elif numerator % 3 == 0:
+            return quarter_note_tempo / 3.0 * denominator / 4.0
+        else:
+            return quarter_note_tempo * denominator / 4.0
+    else:
+        return quarter_note_tempo
+
+
+def beats_from_tempo_map(tempo_change_times: np.ndarray, tempi: np.ndarray, time_signatures: list,
+                         end_time: float, start_time: float = 0.) -> np.ndarray:
+    """
+    Beat locations from a tempo map and time signatures, as pretty_midi.PrettyMIDI.get_beats computes them.
+
+    Input 1     : Times (seconds) of the tempo changes and the tempo (quarter notes per minute) at each
+    Input 2     : Time signatures as (numerator, denominator, time) tuples sorted by time
+    Input 3     : End time of the file, and location of the first beat, in seconds
+
+    Output      : Beat locations, in seconds
+    Output_type : np.ndarray
+    """
+    beats = [start_time]
+    tempo_idx = 0
+    while tempo_idx < tempo_change_times.shape[0] - 1 and beats[-1] > tempo_change_times[tempo_idx + 1]:
+        tempo_idx += 1
+    ts_idx = 0
+    while ts_idx < len(time_signatures) - 1 and beats[-1] >= time_signatures[ts_idx + 1][2]:
+        ts_idx += 1
+
+    def get_current_bpm():
+        if time_signatures:
+            return _qpm_to_bpm(tempi[tempo_idx], time_signatures[ts_idx][0], time_signatures[ts_idx][1])
+        return tempi[tempo_idx]
+
+    def gt_or_close(a, b):
+        return a > b or np.isclose(a, b)
+
+    while beats[-1] < end_time:
+        bpm = get_current_bpm()
+        next_beat = beats[-1] + 60.0 / bpm
+        if tempo_idx < tempo_change_times.shape[0] - 1 and next_beat > tempo_change_times[tempo_idx + 1]:
+            # the beat straddles a tempo change, walk through the changes it spans
+            next_beat = beats[-1]
+            beat_remaining = 1.0
+            while (tempo_idx < tempo_change_times.shape[0] - 1 and
+                   next_beat + beat_remaining * 60.0 / bpm >= tempo_change_times[tempo_idx + 1]):
+                overshot_ratio = (tempo_change_times[tempo_idx + 1] - next_beat) / (60.0 / bpm)
+                next_beat += overshot_ratio * 60.0 / bpm
+                beat_remaining -= overshot_ratio
+                tempo_idx = tempo_idx + 1
+                bpm = get_current_bpm()
+            next_beat += beat_remaining * 60. / bpm
+        if time_signatures and ts_idx == 0:
+            current_ts_time = time_signatures[ts_idx][2]
+            if current_ts_time > beats[-1] and gt_or_close(next_beat, current_ts_time):
+                next_beat = current_ts_time
+        if ts_idx < len(time_signatures) - 1:
+            next_ts_time = time_signatures[ts_idx + 1][2]
+            if gt_or_close(next_beat, next_ts_time):
+                next_beat = next_ts_time
+                ts_idx += 1
+                bpm = get_current_bpm()
+        beats.append(next_beat)
+    return np.array(beats[:-1])
+
+
+def downbeats_from_beats(beats: np.ndarray, time_signatures: list, start_time: float = 0.) -> np.ndarray:
+    """
+    Downbeat locations, as pretty_midi.PrettyMIDI.get_downbeats computes them from the beats.
+    """
+    time_signatures = list(time_signatures)
+    if not time_signatures or time_signatures[0][2] > start_time:
+        time_signatures.insert(0, (4, 4, start_time))
+
+    def index(array, value, default):
+        idx = np.flatnonzero(np.isclose(array, value))
+        return idx[0] if idx.size > 0 else default
+
+    def step(numerator):
+        return numerator // 3 if numerator % 3 == 0 and numerator != 3 else numerator
+
+    downbeats = []
+    end_beat_idx = 0
+    for start_ts, end_ts in zip(time_signatures[:-1], time_signatures[1:]):
+        start_beat_idx = index(beats, start_ts[2], 0)
+        end_beat_idx = index(beats, end_ts[2], start_beat_idx)
+        downbeats.append(beats[start_beat_idx:end_beat_idx:step(start_ts[0])])
+    final_ts = time_signatures[-1]
+    start_beat_idx = index(beats, final_ts[2], end_beat_idx)
+    downbeats.append(beats[start_beat_idx::step(final_ts[0])])
+    downbeats = np.concatenate(downbeats)
+    return downbeats[downbeats >= start_time]
+
+
+def estimate_tempi(onsets: np.ndarray) -> tuple:
+    """
+    Inter-onset interval clustering of pretty_midi.PrettyMIDI.estimate_tempi (Dixon 2001).
+
+    Input       : Sorted onset times, in seconds
+    Input_type  : np.ndarray
+
+    Output      : Estimated tempos in beats per minute, and the probability of each
+    Output_type : Tuple of np.ndarray
+    """
+    ioi = np.diff(onsets)
+    ioi = ioi[ioi > .05]
+    ioi = ioi[ioi < 2]
+    # normalize all iois into the range 30...300bpm
+    for n in range(ioi.shape[0]):
+        while ioi[n] < .2:
+            ioi[n] *= 2
+    clusters = np.array([])
+    cluster_counts = np.array([])
+    for interval in ioi:
+        if (np.abs(clusters - interval) < .025).any():
+            k = np.argmin(clusters - interval)
+            clusters[k] = (cluster_counts[k] * clusters[k] + interval) / (cluster_counts[k] + 1)
+            cluster_counts[k] += 1
+        else:
+            clusters = np.append(clusters, interval)
+            cluster_counts = np.append(cluster_counts, 1.)
+    cluster_sort = np.argsort(cluster_counts)[::-1]
+    clusters = clusters[cluster_sort]
+    cluster_counts = cluster_counts[cluster_sort]
+    cluster_counts /= cluster_counts.sum()
+    return 60. / clusters, cluster_counts
+
+
+def estimate_tempo_histogram(onsets: np.ndarray, bin_width: float = .005, tolerance: float = .025) -> float:
+    """
+    Fast alternative to the inter-onset interval clustering of estimate_tempi.
+
+    Inter-onset intervals are folded into the same 0.2s..2s range, histogrammed, and the densest
+    window of +/- tolerance seconds (the clustering threshold of estimate_tempi) wins; the tempo is
+    the mean interval inside that window. Cost is O(n log n) for n onsets instead of O(n * clusters),
+    at the price of occasionally picking a neighbouring cluster when two are almost equally dense.
+
+    Input       : Sorted onset times, in seconds
+    Input_type  : np.ndarray
+
+    Output      : Estimated tempo, in beats per minute
+    Output_type : Float
+    """
+    ioi = np.diff(onsets)
+    ioi = ioi[(ioi > .05) & (ioi < 2)]
+    if ioi.size == 0:
+        raise ValueError("Can't provide a global tempo estimate when there are fewer than two notes.")
+    # normalize all iois into the range 30...300bpm, as estimate_tempi does by repeated doubling
+    ioi = ioi * 2. ** np.maximum(np.ceil(np.log2(.2 / ioi)), 0)
+    edges = np.arange(.2, 2. + bin_width, bin_width)
+    counts, _ = np.histogram(ioi, bins=edges)
+    half_window = int(round(tolerance / bin_width))
+    density = np.convolve(counts, np.ones(2 * half_window + 1), mode='same')
+    center = edges[np.argmax(density)] + bin_width / 2
+    in_window = np.abs(ioi - center) <= tolerance + bin_width / 2
+    return 60. / ioi[in_window].mean()
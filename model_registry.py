@@ -0,0 +1,292 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from flat_forest import FlatIsolationForest
+
+# The registry is the models folder of parameters.yaml (artifacts.models), holding every version of
+# every model of every scope:
+#   <scope>/<model name>/v<version>/
+#       model.pkl      the pickled model, or the sklearn Pipeline ending with it
+#       model.forest   flat export of an IsolationForest (flat_forest.py), loaded instead of the pickle
+#       metadata.json  scope, model, version, feature_names and extractor_version of the training
+#                      store, n_rows fitted on, n_rows_scope (training rows of the scope), fit_s,
+#                      trained_at and the training section of parameters.yaml it was fitted with;
+#                      written last, a version without it is incomplete and ignored
+# Scopes are 'corpus' for the models fitted on every training file, and 'composer/<name>' for those
+# fitted on the files of one composer: the first folder of their file id, the training source holding
+# one sub-folder per composer (see data_preparation.py). Both score whole files. 'window' holds the
+# models fitted on the sliding windows of the training files, which score the windows of a live stream
+# (streaming.py). Versions count up from 1 per scope and model.
+CORPUS = 'corpus'
+WINDOW = 'window'
+MODEL_FILE = 'model.pkl'
+FOREST_FILE = 'model.forest'
+METADATA_FILE = 'metadata.json'
+
+
+def composer_of(file_id: str) -> str:
+    """
+    Composer of a training file, the first folder of its id, None for a file at the top of the source.
+    """
+    return file_id.split('/', 1)[0] if '/' in file_id else None
+
+
+def composer_scope(composer: str) -> str:
+    return 'composer/' + composer
+
+
+def song_scopes(scopes) -> list:
+    """
+    Scopes of the models scoring whole files, corpus first: the window models are left out.
+    """
+    return sorted({scope for scope in scopes if scope != WINDOW}, key=lambda scope: (scope != CORPUS, scope))
+
+
+def model_key(scope: str, name: str) -> str:
+    """
+    Name of a model in predictions and summaries: the model name for the corpus models, so that they
+    keep their names, '<scope>/<model name>' for the others.
+    """
+    return name if scope == CORPUS else f'{scope}/{name}'
+
+
+def _model_folder(registry: str, scope: str, name: str) -> str:
+    return os.path.join(registry, *scope.split('/'), name)
+
+
+def versions(registry: str, scope: str, name: str) -> list:
+    """
+    Complete versions of a model, oldest first.
+    """
+    folder = _model_folder(registry, scope, name)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(version[1:]) for version in os.listdir(folder)
+                  if version.startswith('v') and version[1:].isdigit()
+                  and os.path.exists(os.path.join(folder, version, METADATA_FILE)))
+
+
+def list_models(registry: str) -> list:
+    """
+    Scope, name and latest version of every model of the registry, sorted by scope (corpus first) and name.
+    """
+    found = set()
+    if not os.path.isdir(registry):
+        return []
+    for folder, sub_folders, file_names in os.walk(registry):
+        if METADATA_FILE in file_names:
+            parts = os.path.relpath(folder, registry).split(os.sep)
+            found.add(('/'.join(parts[:-2]), parts[-2]))
+            sub_folders.clear()
+    models = [(scope, name, versions(registry, scope, name)[-1]) for scope, name in found]
+    return sorted(models, key=lambda model: (model[0] != CORPUS, model[0], model[1]))
+
+
+def load_metadata(registry: str, scope: str, name: str, version: int = None) -> dict:
+    """
+    Metadata of a version of a model, the latest one if version is None.
+    """
+    version = version or versions(registry, scope, name)[-1]
+    with open(os.path.join(_model_folder(registry, scope, name), f'v{version}', METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def load_model(registry: str, scope: str, name: str, version: int = None):
+    """
+    Deserializes a version of a model, the latest one if version is None. A flat forest export is
+    memory mapped in place of the pickle.
+
+    Input 1     : Folder of the registry
+    Input_type  : String
+
+    Input 2-3   : Scope and name of the model
+    Input_type  : String
+
+    Input 4     : Version, None for the latest one
+    Input_type  : Integer
+
+    Output      : Fitted model
+    Output_type : Object with decision_function and predict
+    """
+    available = versions(registry, scope, name)
+    if not available or (version is not None and version not in available):
+        raise FileNotFoundError(f"No version {version or ''} of model '{name}' of scope '{scope}' in {registry}")
+    folder = os.path.join(_model_folder(registry, scope, name), f'v{version or available[-1]}')
+    if os.path.isdir(os.path.join(folder, FOREST_FILE)):
+        return FlatIsolationForest.load(os.path.join(folder, FOREST_FILE))
+    with open(os.path.join(folder, MODEL_FILE), 'rb') as f:
+        return pickle.load(f)
+
+
+def save_model(registry: str, scope: str, name: str, model, metadata: dict, flat_forest: bool = False,
+               keep_versions: int = 0) -> dict:
+    """
+    Saves a fitted model as the next version of its scope and name, removing the versions older than
+    the last 'keep_versions' ones (0 keeps them all).
+
+    Input 1     : Folder of the registry
+    Input_type  : String
+
+    Input 2-3   : Scope and name of the model
+    Input_type  : String
+
+    Input 4     : Fitted model
+    Input_type  : Object
+
+    Input 5     : Metadata (see the top of this module), completed with scope, model, version and trained_at
+    Input_type  : Dictionary
+
+    Input 6     : Whether to also export the model, an IsolationForest, as a flat forest (skipped if too deep)
+    Input_type  : Boolean
+
+    Input 7     : Number of versions kept
+    Input_type  : Integer
+
+    Output      : Metadata saved
+    Output_type : Dictionary
+    """
+    folder = _model_folder(registry, scope, name)
+    os.makedirs(folder, exist_ok=True)
+    # the highest version folder, complete or not, so an interrupted save is never overwritten
+    existing = [int(version[1:]) for version in os.listdir(folder) if version.startswith('v') and version[1:].isdigit()]
+    version = max(existing, default=0) + 1
+    version_folder = os.path.join(folder, f'v{version}')
+    os.makedirs(version_folder)
+    with open(os.path.join(version_folder, MODEL_FILE), 'wb') as f:
+        pickle.dump(model, f)
+    if flat_forest:
+        try:
+            FlatIsolationForest.from_sklearn(model).save(os.path.join(version_folder, FOREST_FILE))
+        except ValueError as e:
+            # the pickle is loaded instead
+            print(f"ATTENTION: flat forest of model '{model_key(scope, name)}' not exported: {e}")
+    metadata = dict(metadata, scope=scope, model=name, version=version,
+                    trained_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    with open(os.path.join(version_folder, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    if keep_versions:
+        for old in sorted(existing)[:max(0, len(existing) + 1 - keep_versions)]:
+            shutil.rmtree(os.path.join(folder, f'v{old}'))
+    return metadata
+
+
+class ModelCache:
+    """
+    Bounded LRU cache of deserialized registry models, so that a long running scorer routing files to
+    different models reads each of them from disk once rather than on every request.
+
+    The latest version of every model is looked up when the cache is created and on refresh(), which a
+    long running scorer calls periodically to pick up newly trained versions; at most 'max_models'
+    models are held, the least recently used one being dropped beyond that.
+    If 'schema' is given (metadata fields such as feature_names and extractor_version, see the top of
+    this module), a version whose metadata does not match it is refused: the previous version of that
+    model is kept, or the model is left out if there is none.
+    """
+
+    def __init__(self, registry: str, max_models: int = 16, schema: dict = None):
+        self.registry = registry
+        self.max_models = max_models
+        self.schema = schema or {}
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._refused = set()
+        self.counters = {'hits': 0, 'loads': 0, 'evictions': 0, 'refreshes': 0, 'refused': 0}
+        self.latest = {}
+        self.refreshed_at = None
+        self.refresh()
+
+    def _mismatch(self, scope: str, name: str, version: int) -> str:
+        # the metadata fields of a version that differ from the schema, None if it matches; the window
+        # models score the windows of a stream (streaming.py), never rows of this schema
+        if scope == WINDOW:
+            return None
+        metadata = load_metadata(self.registry, scope, name, version)
+        differing = [field for field, value in self.schema.items() if metadata.get(field) != value]
+        if not differing:
+            return None
+        return ', '.join(f"{field} {metadata.get(field)} instead of {self.schema[field]}" for field in differing)
+
+    def refresh(self) -> list:
+        """
+        Looks up the latest version of every model again, e.g. after a new training run, and drops the
+        cached models that are no longer the latest version of their scope and name. Versions not
+        matching the schema are refused, with a message the first time.
+
+        Output      : model_key of the models with a new latest version, or new in the registry
+        Output_type : List
+        """
+        latest = {}
+        for scope, name, version in list_models(self.registry):
+            previous = self.latest.get((scope, name))
+            if version != previous and (scope, name, version) not in self._refused:
+                mismatch = self._mismatch(scope, name, version)
+                if mismatch is not None:
+                    self._refused.add((scope, name, version))
+                    self.counters['refused'] += 1
+                    print(f"ATTENTION: model '{model_key(scope, name)}' version {version} refused, it was "
+                          f"fitted with {mismatch}: train the models again")
+            if (scope, name, version) not in self._refused:
+                latest[(scope, name)] = version
+            elif previous is not None:
+                latest[(scope, name)] = previous
+        with self._lock:
+            updated = [model_key(*model) for model, version in latest.items() if self.latest.get(model) != version]
+            self.latest = latest
+            for key in [key for key in self._models if latest.get(key[:2]) != key[2]]:
+                del self._models[key]
+            self.counters['refreshes'] += 1
+            self.refreshed_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        return sorted(updated)
+
+    def versions(self) -> dict:
+        """
+        Latest version of every model, keyed by model_key, as of the last refresh.
+        """
+        return {model_key(scope, name): version for (scope, name), version in sorted(self.latest.items())}
+
+    def scopes(self) -> list:
+        return song_scopes(scope for scope, _ in self.latest)
+
+    def get(self, scope: str, name: str):
+        """
+        Latest version of a model, deserialized from disk only if it is not cached; a ValueError is raised
+        if its metadata does not match the schema.
+        """
+        key = (scope, name, self.latest[(scope, name)])
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.counters['hits'] += 1
+                return self._models[key]
+        mismatch = self._mismatch(*key)
+        if mismatch is not None:
+            raise ValueError(f"Model '{model_key(scope, name)}' version {key[2]} was fitted with {mismatch}")
+        model = load_model(self.registry, *key)
+        with self._lock:
+            self.counters['loads'] += 1
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+                self.counters['evictions'] += 1
+        return model
+
+    def models(self, scopes: list) -> dict:
+        """
+        Every model of the given scopes, keyed by model_key.
+        """
+        selected = sorted((model for model in self.latest if model[0] in scopes),
+                          key=lambda model: (scopes.index(model[0]), model[1]))
+        return {model_key(scope, name): self.get(scope, name) for scope, name in selected}
+
+    def route(self, composer: str = None) -> list:
+        """
+        Scopes scoring a file: the corpus, plus the composer's own models when the registry has some.
+        """
+        routed = [CORPUS] if any(scope == CORPUS for scope, _ in self.latest) else []
+        if composer is not None and any(scope == composer_scope(composer) for scope, _ in self.latest):
+            routed.append(composer_scope(composer))
+        return routed
@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+from collections import namedtuple
+import yaml
+from feature_cache import file_content_hash
+from metrics import max_rss_bytes
+
+# A stage reruns only when its fingerprint changes. The fingerprint hashes
+#   the parameters.yaml sections the stage reads,
+#   the source code of the modules it runs (the code version),
+#   the content of its input artifacts (the outputs of the stages before it).
+# The data sources themselves are not hashed here: 'ingest' always runs, it only stats the source
+# files and rewrites a manifest when one of them changed, which then reruns the stages after it.
+Stage = namedtuple('Stage', ['name', 'parameter_keys', 'modules', 'inputs', 'outputs', 'always_run'])
+
+
+def _training_manifest(parameters: dict) -> str:
+    # training files are extracted from the manifest of the dedup stage when it is enabled
+    return parameters['dedup']['manifest'] if parameters['dedup']['enabled'] else parameters['manifests']['training']
+
+
+STAGES = [
+    Stage('ingest', ['data', 'manifests'], ['data_preparation.py', 'manifest.py'],
+          inputs=lambda p: [], outputs=lambda p: [p['manifests']['training'], p['manifests']['testing']],
+          always_run=True),
+    Stage('dedup', ['manifests', 'dedup', 'feature_engineering.chunksize'],
+          ['dedup.py', 'midi_parser.py', 'manifest.py', 'model_registry.py'],
+          inputs=lambda p: [p['manifests']['training']] if p['dedup']['enabled'] else [],
+          outputs=lambda p: [p['dedup']['manifest'], p['dedup']['report']] if p['dedup']['enabled'] else [],
+          always_run=False),
+    Stage('extract', ['manifests', 'dedup', 'feature_engineering', 'features', 'cache', 'metrics',
+                      'artifacts.training', 'artifacts.testing'],
+          ['feature_engineering.py', 'midi_parser.py', 'feature_store.py', 'feature_cache.py', 'manifest.py',
+           'metrics.py'],
+          inputs=lambda p: [_training_manifest(p), p['manifests']['testing']],
+          outputs=lambda p: [p['artifacts']['training'], p['artifacts']['testing']], always_run=False),
+    Stage('windows', ['manifests', 'dedup', 'features.groups', 'feature_engineering', 'streaming.window_models',
+                      'streaming.window_s', 'streaming.training_hop_s', 'streaming.relative_accuracy',
+                      'streaming.resolution', 'artifacts.training_windows'],
+          ['streaming.py', 'midi_parser.py', 'feature_store.py', 'manifest.py'],
+          inputs=lambda p: [_training_manifest(p)] if p['streaming']['window_models'] else [],
+          outputs=lambda p: [p['artifacts']['training_windows']] if p['streaming']['window_models'] else [],
+          always_run=False),
+    Stage('train', ['training', 'streaming.window_models', 'artifacts.training', 'artifacts.training_windows',
+                    'artifacts.models'],
+          ['training.py', 'cosine_lof.py', 'flat_forest.py', 'feature_store.py', 'model_registry.py'],
+          inputs=lambda p: [p['artifacts']['training']] + ([p['artifacts']['training_windows']]
+                                                           if p['streaming']['window_models'] else []),
+          outputs=lambda p: [p['artifacts']['models']], always_run=False),
+    Stage('score', ['inference', 'artifacts', 'metrics'],
+          ['inference.py', 'flat_forest.py', 'cosine_lof.py', 'feature_store.py', 'metrics.py', 'model_registry.py'],
+          inputs=lambda p: [p['artifacts']['testing'], p['artifacts']['models']],
+          outputs=lambda p: [p['artifacts']['Results'], p['artifacts']['Results_summary']], always_run=False),
+]
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+_CODE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run_stage(name: str, parameters: dict) -> None:
+    # stage modules are imported on demand, so skipped stages cost nothing to import
+    if name == 'ingest':
+        from data_preparation import prepare_data
+        prepare_data(parameters)
+    elif name == 'dedup':
+        if parameters['dedup']['enabled']:
+            from dedup import deduplicate_training_set
+            deduplicate_training_set(parameters)
+    elif name == 'extract':
+        from feature_engineering import extract_features
+        extract_features(parameters)
+    elif name == 'windows':
+        if parameters['streaming']['window_models']:
+            from streaming import extract_window_features
+            extract_window_features(parameters)
+    elif name == 'train':
+        from training import train_models
+        train_models(parameters)
+    elif name == 'score':
+        from inference import score_test_set
+        score_test_set(parameters)
+
+
+def _parameter(parameters: dict, key: str):
+    # 'artifacts.training' is parameters['artifacts']['training']
+    value = parameters
+    for part in key.split('.'):
+        value = value[part]
+    return value
+
+
+def _path_hashes(path: str) -> list:
+    # content hash of a file, or of every file under a folder, keyed by path
+    if os.path.isfile(path):
+        return [(path, file_content_hash(path))]
+    hashes = []
+    for folder, sub_folders, file_names in os.walk(path):
+        sub_folders.sort()
+        hashes.extend((os.path.join(folder, file_name), file_content_hash(os.path.join(folder, file_name)))
+                      for file_name in sorted(file_names))
+    return hashes
+
+
+def stage_fingerprint(stage: Stage, parameters: dict) -> str:
+    """
+    Hashes the parameters, code and input artifacts of a stage, see the top of this module.
+
+    Input 1     : Stage of the pipeline
+    Input_type  : Stage
+
+    Input 2     : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Output      : Hex digest of the SHA-256 of all of them
+    Output_type : String
+    """
+    fingerprint = {'parameters': {key: _parameter(parameters, key) for key in stage.parameter_keys},
+                   'code': {module: file_content_hash(os.path.join(_CODE_FOLDER, module)) for module in stage.modules},
+                   'inputs': [_path_hashes(path) for path in stage.inputs(parameters)]}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def _load_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def _save_state(state_path: str, state: dict) -> None:
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def run_pipeline(parameters: dict, stages: list = None, force: bool = False) -> dict:
+    """
+    Runs the stages of the pipeline in order, skipping those whose fingerprint and outputs are unchanged
+    since their last successful run. The fingerprint of a stage is computed after the stages before it
+    ran, so a stage reruns as soon as one of its inputs actually changed.
+
+    Input 1     : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Input 2     : Names of the stages to consider (STAGE_NAMES), all of them if None
+    Input_type  : List
+
+    Input 3     : Whether to rerun the stages even when their fingerprint is unchanged
+    Input_type  : Boolean
+
+    Output      : For each stage, whether it ran or was skipped, its wall time in seconds and, if it ran,
+                  the peak RSS of the runner process after it
+    Output_type : Dictionary
+    """
+    state_path = parameters['pipeline']['state']
+    state = _load_state(state_path)
+    report = {}
+    for stage in STAGES:
+        if stages is not None and stage.name not in stages:
+            continue
+        start = time.perf_counter()
+        fingerprint = None if stage.always_run else stage_fingerprint(stage, parameters)
+        outputs_exist = all(os.path.exists(path) for path in stage.outputs(parameters))
+        if not force and fingerprint is not None and outputs_exist \
+                and state.get(stage.name, {}).get('fingerprint') == fingerprint:
+            report[stage.name] = {'status': 'skipped', 'wall_time_s': time.perf_counter() - start}
+            continue
+        _run_stage(stage.name, parameters)
+        wall_time = time.perf_counter() - start
+        # peak RSS of the runner process so far, worker processes are not included
+        report[stage.name] = {'status': 'ran', 'wall_time_s': wall_time, 'max_rss_bytes': max_rss_bytes()}
+        # saved after every stage, so an interrupted run resumes after the last completed stage
+        state[stage.name] = {'fingerprint': fingerprint, 'wall_time_s': wall_time,
+                             'max_rss_bytes': report[stage.name]['max_rss_bytes'],
+                             'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        _save_state(state_path, state)
+    return report
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    parser = argparse.ArgumentParser(description='Runs the stages ingest, dedup, extract, windows, train and score, '
+                                                 'skipping those whose inputs did not change')
+    parser.add_argument('stages', nargs='*', help=f'stages to consider among {STAGE_NAMES}, all of them by default')
+    parser.add_argument('--force', action='store_true', help='rerun the stages even if nothing changed')
+    args = parser.parse_args()
+    unknown = set(args.stages) - set(STAGE_NAMES)
+    if unknown:
+        parser.error(f'unknown stages {sorted(unknown)}, expected some of {STAGE_NAMES}')
+
+    with open('parameters.yaml', 'r') as f:
+        parameters = yaml.safe_load(f)
+
+    report = run_pipeline(parameters, args.stages or None, args.force)
+    for name, result in report.items():
+        print(f"{name:8s} {result['status']:8s} {result['wall_time_s']:8.2f} s")
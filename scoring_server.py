@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import json
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import yaml
+from feature_engineering import feature_engineering_single_file, feature_names, extractor_version
+from inference import predict_with_scores
+from model_registry import ModelCache
+
+# Protocol: one JSON object per line, one JSON reply per line, on a local TCP port or Unix socket.
+#   {"path": "/abs/file.mid"}                 score a file readable by the server
+#   {"midi": "<base64 bytes>", "id": "x.mid"} score raw MIDI bytes
+#   {"stats": true}                           latency / throughput counters, and those of the model cache
+#   {"refresh": true}                         look up newly trained model versions now, replies with them
+# A request line is at most 'max_request_mb' long (a base64 MIDI file takes 4/3 of its size), a longer
+# one is skipped and answered with an error.
+# A file is scored by the corpus models, plus the models of a composer if the request names one
+# ("composer": "Bach"), or by every model of the registry with "models": "all".
+# The registry is also looked up again every 'refresh_s' seconds, so a running server picks up the
+# models of a new training run without a restart.
+# A scoring reply is {"id": ..., "models": {model_name: {"label": 1|-1, "score": float}}} or {"id": ..., "error": ...}
+
+
+class ScoringServer:
+    """
+    Keeps the models deserialized in memory and scores MIDI files sent over a local socket.
+
+    Models come from an LRU cache of the model registry (model_registry.ModelCache), so requests
+    routed to different composers load each model from disk once while it stays in the cache.
+    Features are extracted in a process pool. Rows of concurrent requests are gathered into
+    micro-batches of up to 'max_batch_size' rows, waiting at most 'max_wait_ms' for a batch to fill,
+    and each model scores all the rows of a batch routed to it with one decision_function call.
+    The latest model versions are looked up again every 'refresh_s' seconds (never if 0) and on request;
+    the cache is given the schema of the rows extracted here, so models fitted on others are refused.
+    """
+
+    def __init__(self, models: ModelCache, extraction_options: dict, n_workers: int = 4, max_batch_size: int = 64,
+                 max_wait_ms: float = 5., refresh_s: float = 60., max_request_mb: float = 16.):
+        self.models = models
+        self.refresh_s = refresh_s
+        self.max_request_bytes = int(max_request_mb * 2 ** 20)
+        self.extraction_options = extraction_options
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.executor = ProcessPoolExecutor(max_workers=n_workers)
+        self.queue = None
+        self.started = time.perf_counter()
+        self.latencies = deque(maxlen=10000)  # seconds, of the most recent requests
+        self.counters = {'requests': 0, 'scored': 0, 'errors': 0, 'batches': 0}
+
+    async def _extract(self, request: dict) -> list:
+        loop = asyncio.get_running_loop()
+        if 'midi' in request:
+            # the MIDI parsers read raw bytes directly, nothing is written to disk
+            midi_file = base64.b64decode(request['midi'])
+        else:
+            midi_file = request['path']
+        return await loop.run_in_executor(self.executor, partial(feature_engineering_single_file,
+                                                                 midi_file, **self.extraction_options))
+
+    def _route(self, request: dict) -> tuple:
+        if request.get('models') == 'all':
+            return tuple(self.models.scopes())
+        return tuple(self.models.route(request.get('composer')))
+
+    def _score_batch(self, rows: np.ndarray, routes: list) -> list:
+        results = [{} for _ in range(rows.shape[0])]
+        routed = {}
+        for i, scopes in enumerate(routes):
+            for scope in scopes:
+                routed.setdefault(scope, []).append(i)
+        for scope, indices in routed.items():
+            for name, model in self.models.models([scope]).items():
+                labels, scores = predict_with_scores(model, rows[indices])
+                for i, label, score in zip(indices, labels, scores):
+                    results[i][name] = {'label': int(label), 'score': float(score)}
+        return results
+
+    async def _batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            rows = np.array([row for row, _, _ in batch], dtype=np.float64)
+            try:
+                # scoring runs in a thread so the event loop keeps accepting requests meanwhile
+                results = await loop.run_in_executor(None, self._score_batch, rows, [scopes for _, scopes, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            self.counters['batches'] += 1
+
+    async def refresh(self) -> dict:
+        """
+        Looks up the latest model versions in the registry, see model_registry.ModelCache.refresh.
+        """
+        # listing the registry reads from disk, off the event loop
+        updated = await asyncio.get_running_loop().run_in_executor(None, self.models.refresh)
+        if updated:
+            print(f"Models refreshed, new versions of {updated}")
+        return {'updated': updated, 'versions': self.models.versions()}
+
+    async def _refresher(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_s)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"ATTENTION: {e} error has occurred while refreshing the models")
+
+    async def score(self, request: dict) -> dict:
+        """
+        Scores one request with the models it is routed to, see the protocol at the top of this module.
+        """
+        start = time.perf_counter()
+        self.counters['requests'] += 1
+        reply = {'id': request.get('id', request.get('path'))}
+        try:
+            scopes = self._route(request)
+            row = await self._extract(request)
+            if row is None or np.isnan(np.asarray(row, dtype=np.float64)).any():
+                raise ValueError('features could not be extracted from this file')
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((row, scopes, future))
+            reply['models'] = await future
+            self.counters['scored'] += 1
+        except Exception as e:
+            self.counters['errors'] += 1
+            reply['error'] = str(e)
+        self.latencies.append(time.perf_counter() - start)
+        return reply
+
+    def stats(self) -> dict:
+        """
+        Request counters, throughput since start, latency percentiles in milliseconds, the hits, loads,
+        evictions and refreshes of the model cache, the time of its last refresh and the model versions served.
+        """
+        stats = dict(self.counters)
+        stats['model_cache'] = dict(self.models.counters, refreshed_at=self.models.refreshed_at)
+        stats['model_versions'] = self.models.versions()
+        elapsed = time.perf_counter() - self.started
+        stats['throughput_per_s'] = self.counters['scored'] / elapsed if elapsed else 0.
+        stats['mean_batch_size'] = self.counters['scored'] / self.counters['batches'] if self.counters['batches'] else 0.
+        if self.latencies:
+            for q in (50, 90, 99):
+                stats[f'latency_p{q}_ms'] = float(np.percentile(self.latencies, q) * 1000)
+        return stats
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        # the next request line, b'' at the end of the connection, None if longer than the limit
+        try:
+            return await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError:
+            pass
+        # the rest of the line is dropped, the buffered part at a time
+        while True:
+            try:
+                await reader.readuntil(b'\n')
+                return None
+            except asyncio.IncompleteReadError:
+                return None
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        lock = asyncio.Lock()
+
+        async def answer(line: bytes) -> None:
+            try:
+                request = json.loads(line)
+                if request.get('stats'):
+                    reply = self.stats()
+                elif request.get('refresh'):
+                    reply = await self.refresh()
+                else:
+                    reply = await self.score(request)
+            except json.JSONDecodeError as e:
+                reply = {'error': f'invalid request: {e}'}
+            async with lock:
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+
+        # requests of one connection are scored concurrently, replies carry the request id
+        pending = set()
+        while (line := await self._read_request(reader)) != b'':
+            if line is None:
+                self.counters['errors'] += 1
+                line = json.dumps({'error': f'request longer than {self.max_request_bytes} bytes'}).encode()
+                async with lock:
+                    writer.write(line + b'\n')
+                    await writer.drain()
+                continue
+            task = asyncio.create_task(answer(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+        writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None) -> None:
+        """
+        Serves until cancelled, on the Unix socket if one is given, else on host:port.
+        """
+        self.queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._batcher())]
+        if self.refresh_s:
+            tasks.append(asyncio.create_task(self._refresher()))
+        if unix_socket:
+            server = await asyncio.start_unix_server(self._handle, path=unix_socket, limit=self.max_request_bytes)
+        else:
+            server = await asyncio.start_server(self._handle, host, port, limit=self.max_request_bytes)
+        print(f"Scoring server ready on {unix_socket or f'{host}:{port}'} with the models of {self.models.scopes()}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    with open('parameters.yaml', 'r') as f:
+        parameters = yaml.safe_load(f)
+
+    settings = parameters['server']
+    extraction_options = {'backend': parameters['feature_engineering']['backend'],
+                          'groups': parameters['features']['groups'],
+                          'tempo_estimator': parameters['features']['tempo_estimator']}
+    # models fitted on other features than those extracted here are refused, see model_registry.ModelCache
+    schema = {'feature_names': feature_names(extraction_options['groups']),
+              'extractor_version': extractor_version(extraction_options['groups'],
+                                                     extraction_options['tempo_estimator'])}
+    server = ScoringServer(ModelCache(parameters['artifacts']['models'], parameters['inference']['cache_size'], schema),
+                           extraction_options,
+                           n_workers=settings['n_workers'], max_batch_size=settings['max_batch_size'],
+                           max_wait_ms=settings['max_wait_ms'], refresh_s=settings['refresh_s'],
+                           max_request_mb=settings['max_request_mb'])
+    asyncio.run(server.serve(settings['host'], settings['port'], settings['unix_socket']))
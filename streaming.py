@@ -0,0 +1,621 @@
+import argparse
+import json
+import math
+import os
+import socket
+import sys
+import time
+import warnings
+from multiprocessing import Pool
+import numpy as np
+import yaml
+from feature_engineering import EXTRACTOR_VERSION, FEATURE_NAMES, feature_names
+from feature_store import create_feature_store, append_rows
+from inference import load_models, predict_with_scores
+from manifest import load_manifest, iter_midi_sources, imap_in_windows
+from midi_parser import MidiParseError, read_midi, _qpm_to_bpm
+from model_registry import WINDOW
+
+# Protocol: one JSON note event per line, read from stdin ('-'), a local socket ('tcp://host:port' or
+# 'unix:///path', connections are served one after the other as a single stream) or a file that is
+# tailed while it grows. Times are absolute seconds from the start of the stream; an event without
+# 'time' is stamped with its arrival time.
+#   {"time": 1.5, "type": "note_on", "channel": 0, "pitch": 60, "velocity": 90}   velocity 0 ends the note
+#   {"time": 2.0, "type": "note_off", "channel": 0, "pitch": 60}
+#   {"time": 0.0, "type": "program_change", "channel": 0, "program": 40}
+#   {"time": 0.0, "type": "set_tempo", "tempo": 500000}                          microseconds per quarter note
+#   {"time": 0.0, "type": "time_signature", "numerator": 3, "denominator": 4}
+# Channel 9 is the drum channel. Channels are 0-15, pitches, velocities and programs 0-127; events
+# breaking the protocol are skipped and counted (see check_event). A window record is written per
+# hop, see score_stream.
+#
+# Windows are scored by the 'window' models of the registry, fitted on the windows of the training
+# files replayed through WindowStatistics (extract_window_features), not by the models of whole files:
+# the count and length features of a 30 s window are a fraction of those of a song, and the tempo of a
+# window comes from its inter-onset interval histogram rather than from the tempo estimator of
+# feature_engineering.py, so every window would be out of distribution for the latter.
+
+# Columns of a pane, the statistics of the events of one hop. A window is the sum of its panes.
+_NOTES, _SOLO, _BEATS, _DOWNBEATS, _TEMPO_CHANGES, _DURATION_N, _DURATION_SUM, _DURATION_SUMSQ = range(8)
+_PITCH = slice(8, 136)                  # histogram of the pitches, all notes
+_VELOCITY = slice(136, 264)             # histogram of the velocities
+_PITCH_CLASS = slice(264, 276)          # pitch classes, drums excluded
+_PROGRAMS = slice(276, 404)             # notes per program
+_IOI_BIN_WIDTH = .005                   # inter-onset intervals folded into .2s..2s, as estimate_tempo_histogram
+_IOI_BINS = 360
+_IOI_COUNT = slice(404, 404 + _IOI_BINS)
+_IOI_SUM = slice(404 + _IOI_BINS, 404 + 2 * _IOI_BINS)
+_DURATION = 404 + 2 * _IOI_BINS         # first column of the note duration sketch
+_DRUM_CHANNEL = 9
+_MAX_HELD = 128                         # notes of one key held at once, the oldest is forgotten beyond
+# fields of each event type, with their range and default (None: required)
+_EVENT_FIELDS = {'note_on': {'channel': (0, 15, 0), 'pitch': (0, 127, None), 'velocity': (0, 127, None)},
+                 'note_off': {'channel': (0, 15, 0), 'pitch': (0, 127, None)},
+                 'program_change': {'channel': (0, 15, 0), 'program': (0, 127, None)},
+                 'set_tempo': {'tempo': (1, 0xFFFFFF, None)},
+                 'time_signature': {'numerator': (1, 255, None), 'denominator': (1, 2 ** 16, None)}}
+
+
+class InvalidEvent(ValueError):
+    """Raised for an event that does not follow the protocol at the top of this module."""
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def check_event(event) -> dict:
+    """
+    Checks that an event follows the protocol at the top of this module: a known type, a finite time,
+    and every field of its type present (unless it has a default) as an integer within its range.
+
+    Input       : Decoded JSON event
+    Input_type  : Object
+
+    Output      : The event, with the defaults of its missing optional fields filled in
+    Output_type : Dictionary
+    """
+    if not isinstance(event, dict):
+        raise InvalidEvent(f'an event is a JSON object, not {type(event).__name__}')
+    kind = event.get('type')
+    if kind not in _EVENT_FIELDS:
+        raise InvalidEvent(f"unknown event type {kind!r}, expected one of {list(_EVENT_FIELDS)}")
+    if 'time' in event and not _is_number(event['time']):
+        raise InvalidEvent(f"{kind}: time {event['time']!r} is not a finite number")
+    for field, (low, high, default) in _EVENT_FIELDS[kind].items():
+        value = event.setdefault(field, default)
+        if value is None:
+            raise InvalidEvent(f"{kind}: missing '{field}'")
+        if not _is_number(value) or value != int(value) or not low <= value <= high:
+            raise InvalidEvent(f"{kind}: {field} {value!r} is not an integer in {low}..{high}")
+    if kind == 'time_signature' and event['denominator'] & (event['denominator'] - 1):
+        raise InvalidEvent(f"time_signature: denominator {event['denominator']} is not a power of 2")
+    return event
+
+
+def _histogram_quantiles(counts: np.ndarray, values: np.ndarray, quantiles: list) -> list:
+    """
+    Quantiles of the values held by a histogram, interpolated between ranks as np.percentile does,
+    so they are exact when every bin holds a single value.
+    """
+    cumulative = np.cumsum(counts)
+    results = []
+    for q in quantiles:
+        rank = q * (cumulative[-1] - 1)
+        lower = values[np.searchsorted(cumulative, math.floor(rank), side='right')]
+        upper = values[np.searchsorted(cumulative, math.ceil(rank), side='right')]
+        results.append(lower + (upper - lower) * (rank - math.floor(rank)))
+    return results
+
+
+def _histogram_descriptor(counts: np.ndarray, values: np.ndarray) -> list:
+    # mean, std_dev, min, p25, p50, p75, max of integer values (pitches, velocities), exactly
+    n = counts.sum()
+    mean = (counts * values).sum() / n
+    std = math.sqrt(max((counts * (values - mean) ** 2).sum() / (n - 1), 0.))
+    filled = np.flatnonzero(counts)
+    return [mean, std, values[filled[0]]] + _histogram_quantiles(counts, values, [.25, .5, .75]) + \
+        [values[filled[-1]]]
+
+
+class WindowStatistics:
+    """
+    Running statistics of the note events of a sliding time window, from which the handcrafted
+    features of feature_engineering.py are computed for the window instead of for a whole song.
+
+    The window is a ring of window_s / hop_s panes, each holding the statistics of the events of one
+    hop in a fixed number of columns: note and distinct onset counts, beats, pitch, velocity, pitch
+    class and program histograms, a histogram of the inter-onset intervals (the tempo estimate of
+    estimate_tempo_histogram) and a log-bucketed sketch of the note durations, whose quantiles are
+    within 'relative_accuracy' of the true ones (pitch and velocity quantiles are exact). An event
+    updates a few counters of the current pane, and a pane is cleared as it leaves the window, so the
+    cost of an event and the memory do not depend on how long the stream runs.
+
+    Notes are counted at their onset and their duration once they end; the notes still held are at most
+    16 channels x 128 pitches x _MAX_HELD. The tempo map (set_tempo, time_signature) gives the beats.
+    """
+
+    def __init__(self, window_s: float = 30., hop_s: float = 1., relative_accuracy: float = .01,
+                 max_duration: float = 600., min_duration: float = .001, resolution: int = 480):
+        self.hop_s = hop_s
+        self.n_panes = max(1, int(round(window_s / hop_s)))
+        self.window_s = self.n_panes * hop_s
+        self.resolution = resolution
+        # note duration sketch: bin 0 holds durations up to min_duration, bin k the durations in
+        # (min_duration * gamma ** (k - 1), min_duration * gamma ** k]
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.min_duration = min_duration
+        n_duration_bins = 1 + int(math.ceil(math.log(max_duration / min_duration, self.gamma)))
+        self.duration_values = np.concatenate(
+            [[0.], min_duration * 2 * self.gamma ** np.arange(1, n_duration_bins) / (self.gamma + 1)])
+        self.panes = np.zeros((self.n_panes, _DURATION + n_duration_bins))
+        self.duration_extremes = np.full((self.n_panes, 2), [np.inf, -np.inf])
+        self.origin = None
+        self.pane = 0
+        self.event_pane = 0  # pane of the last event
+        self.time = 0.
+        self.last_onset = None
+        self.qpm = 120.
+        self.time_signature = (4, 4)
+        self.programs = [0] * 16
+        self.held = {}  # (channel, pitch) -> onset times of the notes not ended yet
+
+    def _row(self) -> np.ndarray:
+        return self.panes[self.pane % self.n_panes]
+
+    def _count_beats(self, until: float) -> None:
+        # beats and downbeats elapsed since the last event, at the current tempo and time signature
+        numerator, denominator = self.time_signature
+        beats = (until - self.time) * _qpm_to_bpm(self.qpm, numerator, denominator) / 60.
+        row = self._row()
+        row[_BEATS] += beats
+        row[_DOWNBEATS] += beats / numerator
+        self.time = until
+
+    def advance(self, time_s: float) -> list:
+        """
+        Moves the stream clock to time_s (times going backwards are clamped) and closes the windows
+        that end on the hop boundaries passed on the way. Once no event is left in the window, the
+        windows of the rest of a gap hold no note and are skipped in one step (see _skip_to), so a
+        gap costs at most window_s / hop_s hops however long it is.
+
+        Output      : (start, end) times of each closed window, with its features as a dictionary
+                      keyed by feature name, or None when the window does not hold enough notes
+        Output_type : List of tuples
+        """
+        if self.origin is None:
+            self.origin = self.time = time_s
+        time_s = max(time_s, self.time)
+        closed = []
+        pane = int((time_s - self.origin) // self.hop_s)
+        while self.pane < pane:
+            if self.pane >= self.event_pane + self.n_panes:
+                self._skip_to(pane)
+                break
+            boundary = self.origin + (self.pane + 1) * self.hop_s
+            self._count_beats(boundary)
+            closed.append((max(self.origin, boundary - self.window_s), boundary, self.features(boundary)))
+            self.pane += 1
+            self.panes[self.pane % self.n_panes] = 0.
+            self.duration_extremes[self.pane % self.n_panes] = [np.inf, -np.inf]
+        self._count_beats(time_s)
+        return closed
+
+    def _skip_to(self, pane: int) -> None:
+        # the windows ending before pane would hold no note (their features would be None): only the
+        # beats of the panes still in the window at pane are counted, as hop by hop
+        first = max(self.pane, pane - self.n_panes + 1)
+        if first > self.pane:
+            self.panes[:] = 0.
+            self.duration_extremes[:] = [np.inf, -np.inf]
+            self.pane = first
+            self.time = self.origin + first * self.hop_s
+        while self.pane < pane:
+            self._count_beats(self.origin + (self.pane + 1) * self.hop_s)
+            self.pane += 1
+            self.panes[self.pane % self.n_panes] = 0.
+            self.duration_extremes[self.pane % self.n_panes] = [np.inf, -np.inf]
+
+    def add(self, event: dict) -> list:
+        """
+        Updates the statistics with one event of the protocol at the top of this module, as checked by
+        check_event (read_events checks the events it reads).
+
+        Output      : Windows closed by the event, see advance
+        Output_type : List of tuples
+        """
+        closed = self.advance(float(event['time']))
+        self.event_pane = self.pane
+        kind = event['type']
+        if kind == 'note_on' and event.get('velocity', 0) > 0:
+            self._note_on(int(event.get('channel', 0)), int(event['pitch']), int(event['velocity']))
+        elif kind in ('note_on', 'note_off'):
+            self._note_off(int(event.get('channel', 0)), int(event['pitch']))
+        elif kind == 'program_change':
+            self.programs[int(event.get('channel', 0))] = int(event['program'])
+        elif kind == 'set_tempo':
+            self.qpm = 6e7 / float(event['tempo'])
+            self._row()[_TEMPO_CHANGES] += 1
+        elif kind == 'time_signature':
+            self.time_signature = (int(event['numerator']), int(event['denominator']))
+        return closed
+
+    def _note_on(self, channel: int, pitch: int, velocity: int) -> None:
+        row = self._row()
+        row[_NOTES] += 1
+        row[_PITCH.start + pitch] += 1
+        row[_VELOCITY.start + velocity] += 1
+        row[_PROGRAMS.start + self.programs[channel]] += 1
+        if channel != _DRUM_CHANNEL:
+            row[_PITCH_CLASS.start + pitch % 12] += 1
+        if self.last_onset is None or self.time != self.last_onset:
+            row[_SOLO] += 1
+            if self.last_onset is not None and .05 < self.time - self.last_onset < 2:
+                ioi = self.time - self.last_onset
+                ioi *= 2. ** max(math.ceil(math.log2(.2 / ioi)), 0)
+                k = min(int((ioi - .2) / _IOI_BIN_WIDTH), _IOI_BINS - 1)
+                row[_IOI_COUNT.start + k] += 1
+                row[_IOI_SUM.start + k] += ioi
+            self.last_onset = self.time
+        held = self.held.setdefault((channel, pitch), [])
+        if len(held) == _MAX_HELD:
+            del held[0]
+        held.append(self.time)
+
+    def _note_off(self, channel: int, pitch: int) -> None:
+        # like the MIDI parsers, a note off ends every note of its key, except those starting at the same time
+        held = self.held.pop((channel, pitch), [])
+        if held and held[-1] == self.time:
+            self.held[channel, pitch] = [onset for onset in held if onset == self.time]
+        for onset in held:
+            if onset != self.time:
+                self._note_duration(self.time - onset)
+
+    def _note_duration(self, duration: float) -> None:
+        row = self._row()
+        row[_DURATION_N] += 1
+        row[_DURATION_SUM] += duration
+        row[_DURATION_SUMSQ] += duration * duration
+        k = 0 if duration <= self.min_duration else \
+            min(int(math.ceil(math.log(duration / self.min_duration, self.gamma))), len(self.duration_values) - 1)
+        row[_DURATION + k] += 1
+        extremes = self.duration_extremes[self.pane % self.n_panes]
+        extremes[0] = min(extremes[0], duration)
+        extremes[1] = max(extremes[1], duration)
+
+    def features(self, end: float) -> dict:
+        """
+        Handcrafted features of the window ending at 'end' (the current time), keyed by feature name,
+        or None when the window holds fewer than two notes, two ended notes or one inter-onset
+        interval, the minimum for every feature to be defined.
+
+        The count features (number_notes, number_beats, ...) and 'length' describe the window rather
+        than a whole song; 'resolution' is not part of the events and is the configured one.
+        """
+        window = self.panes.sum(axis=0)
+        number_notes, n_durations = window[_NOTES], window[_DURATION_N]
+        ioi_counts = window[_IOI_COUNT]
+        if number_notes < 2 or n_durations < 2 or ioi_counts.sum() == 0:
+            return None
+        length = end - max(self.origin, end - self.window_s)
+
+        # densest +/- 25ms of folded inter-onset intervals, as estimate_tempo_histogram
+        density = np.convolve(ioi_counts, np.ones(11), mode='same')
+        center = int(np.argmax(density))
+        in_window = slice(max(center - 5, 0), center + 6)
+        tempo = 60. / (window[_IOI_SUM][in_window].sum() / ioi_counts[in_window].sum())
+
+        mean = window[_DURATION_SUM] / n_durations
+        std = math.sqrt(max((window[_DURATION_SUMSQ] - n_durations * mean ** 2) / (n_durations - 1), 0.))
+        duration_counts = window[_DURATION:]
+        duration = [mean, std, self.duration_extremes[:, 0].min()] + \
+            _histogram_quantiles(duration_counts, self.duration_values, [.25, .5, .75]) + \
+            [self.duration_extremes[:, 1].max()]
+        pitch_classes = window[_PITCH_CLASS]
+        values = {'tempo': tempo, 'number_beats': window[_BEATS], 'number_notes': number_notes,
+                  'number_downbeats': window[_DOWNBEATS],
+                  'percentage_downbeats': window[_DOWNBEATS] / window[_BEATS] if window[_BEATS] else 0.,
+                  'length': length, 'number_notes_solo': window[_SOLO],
+                  'number_instruments': np.count_nonzero(window[_PROGRAMS]),
+                  'notes_density': number_notes / length,
+                  'percentage_notes_solo': (number_notes - window[_SOLO]) / number_notes,
+                  # a tempo always applies, as the initial tempo of the tempo map of a file
+                  'tempo_change_frequency': max(window[_TEMPO_CHANGES], 1) / length,
+                  'resolution': self.resolution}
+        for prefix, descriptor in (('note_duration', duration),
+                                   ('note_velocity', _histogram_descriptor(window[_VELOCITY], np.arange(128.))),
+                                   ('note_pitch', _histogram_descriptor(window[_PITCH], np.arange(128.)))):
+            values.update(zip([name for name in FEATURE_NAMES if name.startswith(prefix + '_')], descriptor))
+        values.update(zip(['percentage_pitch_class%d' % i for i in range(1, 13)],
+                          pitch_classes / (pitch_classes.sum() + (pitch_classes.sum() == 0))))
+        return {name: float(value) for name, value in values.items()}
+
+
+def _tail(path: str, poll_interval: float):
+    # lines of a file, waiting for more at its end; a partial last line is kept until it is complete
+    with open(path, 'rb') as f:
+        pending = b''
+        while True:
+            line = f.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            pending += line
+            if pending.endswith(b'\n'):
+                yield pending
+                pending = b''
+
+
+def _socket_lines(source: str):
+    if source.startswith('unix://'):
+        if os.path.exists(source[len('unix://'):]):
+            os.remove(source[len('unix://'):])
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(source[len('unix://'):])
+    else:
+        host, port = source[len('tcp://'):].rsplit(':', 1)
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, int(port)))
+    with server:
+        server.listen(1)
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile('rb') as lines:
+                yield from lines
+
+
+def read_events(source: str, follow: bool = True, poll_interval: float = .1, counters: dict = None):
+    """
+    Yields the events of a stream as dictionaries, see the protocol at the top of this module.
+    Lines that are not valid JSON, and events that do not follow the protocol (see check_event), are
+    reported and skipped.
+
+    Input 1     : '-' for stdin (a pipe), 'tcp://host:port' or 'unix:///path' to listen on a local
+                  socket, or the path of a file of events
+    Input_type  : String
+
+    Input 2     : Whether to keep reading a file as it grows (tail -f), else stop at its end
+    Input_type  : Boolean
+
+    Input 3     : Seconds between two reads of a followed file that has no new line
+    Input_type  : Float
+
+    Input 4     : If given, its 'events' and 'invalid' counts are updated as lines are read
+    Input_type  : Dictionary
+
+    Output      : Events in stream order
+    Output_type : Generator of dictionaries
+    """
+    if source == '-':
+        lines = sys.stdin.buffer
+    elif source.startswith(('tcp://', 'unix://')):
+        lines = _socket_lines(source)
+    elif follow:
+        lines = _tail(source, poll_interval)
+    else:
+        lines = open(source, 'rb')
+    counters = {} if counters is None else counters
+    counters.setdefault('events', 0)
+    counters.setdefault('invalid', 0)
+    started = time.monotonic()
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            # invalid UTF-8 raises a UnicodeDecodeError, a ValueError as well
+            event = check_event(json.loads(line))
+        except ValueError as e:
+            counters['invalid'] += 1
+            print(f"ATTENTION: invalid event skipped ({counters['invalid']} so far): {e}", file=sys.stderr)
+            continue
+        counters['events'] += 1
+        event.setdefault('time', time.monotonic() - started)
+        yield event
+
+
+def midi_file_events(file_path) -> list:
+    """
+    Events of a MIDI file in the protocol of this module, sorted by time, to replay a file as a
+    stream. Pitched programs are spread over the channels other than the drums channel 9, and a
+    program change precedes each note whose channel is not already on its program.
+
+    Input       : Path of the MIDI file, or its raw bytes
+    Input_type  : String or bytes
+
+    Output      : Events
+    Output_type : List of dictionaries
+    """
+    midi = read_midi(file_path)
+    events = [{'time': float(t), 'type': 'set_tempo', 'tempo': int(round(6e7 / qpm))}
+              for t, qpm in zip(*midi.get_tempo_changes())]
+    events += [{'time': t, 'type': 'time_signature', 'numerator': numerator, 'denominator': denominator}
+               for numerator, denominator, t in midi.time_signatures]
+    pitched_channels = [channel for channel in range(16) if channel != _DRUM_CHANNEL]
+    programs = sorted(set(midi.program[~midi.is_drum].tolist()))
+    channels = {program: pitched_channels[i % len(pitched_channels)] for i, program in enumerate(programs)}
+    for start, end, velocity, pitch, program, is_drum in zip(midi.start.tolist(), midi.end.tolist(),
+                                                             midi.velocity.tolist(), midi.pitch.tolist(),
+                                                             midi.program.tolist(), midi.is_drum.tolist()):
+        channel = _DRUM_CHANNEL if is_drum else channels[program]
+        events.append({'time': start, 'type': 'note_on', 'channel': channel, 'pitch': int(pitch),
+                       'velocity': int(velocity), 'program': program})
+        events.append({'time': end, 'type': 'note_off', 'channel': channel, 'pitch': int(pitch)})
+    # meta events first, and at equal times note offs before note ons
+    order = {'set_tempo': 0, 'time_signature': 0, 'note_off': 1, 'note_on': 2}
+    current = {}
+    replay = []
+    for event in sorted(events, key=lambda event: (event['time'], order[event['type']])):
+        program = event.pop('program', None)
+        if program is not None and current.get(event['channel']) != program:
+            current[event['channel']] = program
+            replay.append({'time': event['time'], 'type': 'program_change', 'channel': event['channel'],
+                           'program': program})
+        replay.append(event)
+    return replay
+
+
+def stream_windows(events, statistics: WindowStatistics):
+    """
+    Features of every window of a stream of events, as soon as it closes. Only windows covering a full
+    window_s are given: the windows of the first seconds of a stream hold a fraction of the notes of a
+    full one, so their count features would be out of distribution. Windows without enough notes for
+    the features to be defined (see WindowStatistics.features) are left out too. When the events run
+    out, the window ending at the last event is given as well.
+
+    Input 1     : Events, see read_events
+    Input_type  : Iterable of dictionaries
+
+    Input 2     : Sliding window statistics
+    Input_type  : WindowStatistics
+
+    Output      : (start, end, features keyed by feature name) of each window
+    Output_type : Generator of tuples
+    """
+    def full(start, end):
+        return end - start >= statistics.window_s - 1e-9
+
+    for event in events:
+        for start, end, values in statistics.add(event):
+            if values is not None and full(start, end):
+                yield start, end, values
+    if statistics.origin is not None and statistics.time > statistics.origin + statistics.pane * statistics.hop_s:
+        start = max(statistics.origin, statistics.time - statistics.window_s)
+        values = statistics.features(statistics.time) if full(start, statistics.time) else None
+        if values is not None:
+            yield start, statistics.time, values
+
+
+def _file_windows(args: tuple) -> tuple:
+    # (feature rows of the windows of one file or None, error or None), the file given by path or as bytes
+    source, columns, window_s, hop_s, relative_accuracy, resolution = args
+    try:
+        events = midi_file_events(source)
+    except MidiParseError as e:
+        return None, str(e)
+    statistics = WindowStatistics(window_s, hop_s, relative_accuracy, resolution=resolution)
+    rows = [[values[name] for name in columns] for _, _, values in stream_windows(events, statistics)]
+    return np.array(rows, dtype=np.float64).reshape(-1, len(columns)), None
+
+
+def extract_window_features(parameters: dict) -> dict:
+    """
+    Replays every training file as a stream through WindowStatistics and writes the features of its
+    windows, one row per window, into the feature store 'artifacts.training_windows', which the 'window'
+    models are fitted on (see training.py). Windows are 'streaming.window_s' long as when scoring, one
+    every 'streaming.training_hop_s' seconds of each file. The training files are those of the
+    deduplicated manifest when the dedup section is enabled, as in feature_engineering.extract_features.
+
+    Input       : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Output      : Number of files and windows written, and the files that could not be replayed with their error
+    Output_type : Dictionary
+    """
+    settings = parameters['streaming']
+    extraction = parameters['feature_engineering']
+    columns = feature_names(parameters['features']['groups'])
+    manifest_path = parameters['dedup']['manifest'] if parameters['dedup']['enabled'] \
+        else parameters['manifests']['training']
+    entries = load_manifest(manifest_path)['entries']
+    store_path = parameters['artifacts']['training_windows']
+    version = 'window:%s:%s:%s:%s:%s' % (EXTRACTOR_VERSION, settings['window_s'], settings['training_hop_s'],
+                                          settings['relative_accuracy'], settings['resolution'])
+    create_feature_store(store_path, columns, version, extraction['dtype'])
+
+    tasks = ((source, columns, settings['window_s'], settings['training_hop_s'], settings['relative_accuracy'],
+              settings['resolution']) for source in iter_midi_sources(entries))
+    pool = Pool(processes=extraction['n_workers']) if extraction['n_workers'] > 1 and len(entries) > 1 else None
+    report = {'files': 0, 'windows': 0, 'unparsed': {}}
+    try:
+        results = imap_in_windows(pool, _file_windows, tasks, extraction['chunksize'], 256) if pool is not None \
+            else map(_file_windows, tasks)
+        for entry, (rows, error) in zip(entries, results):
+            if error is not None:
+                report['unparsed'][entry['id']] = error
+                continue
+            # windows with missing values are dropped, as files are by feature_engineering_all_files
+            rows = rows[~np.isnan(rows).any(axis=1)]
+            append_rows(store_path, [entry['id']] * rows.shape[0], rows)
+            report['files'] += 1
+            report['windows'] += rows.shape[0]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return report
+
+
+def score_stream(events, models: dict, columns: list, statistics: WindowStatistics):
+    """
+    Scores every window of a stream of events against the window models, as soon as it closes (see
+    stream_windows).
+
+    Input 1     : Events, see read_events
+    Input_type  : Iterable of dictionaries
+
+    Input 2     : Fitted window models keyed by name, see extract_window_features
+    Input_type  : Dictionary
+
+    Input 3     : Feature names of the rows the models were trained on, see feature_engineering.feature_names
+    Input_type  : List
+
+    Input 4     : Sliding window statistics
+    Input_type  : WindowStatistics
+
+    Output      : One record per window: start and end times, the features, and the label and decision
+                  score of every model, as in the replies of scoring_server.py
+    Output_type : Generator of dictionaries
+    """
+    for start, end, values in stream_windows(events, statistics):
+        row = np.array([[values[name] for name in columns]])
+        record = {'window_start': start, 'window_end': end, 'features': values, 'models': {}}
+        for name, model in models.items():
+            labels, scores = predict_with_scores(model, row)
+            record['models'][name] = {'label': int(labels[0]), 'score': float(scores[0])}
+        yield record
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    parser = argparse.ArgumentParser(description='Scores sliding windows of a live stream of MIDI note events')
+    parser.add_argument('--source', help="'-' (stdin), 'tcp://host:port', 'unix:///path' or a file of events, "
+                                         "the one of parameters.yaml by default")
+    parser.add_argument('--no-follow', action='store_true', help='stop at the end of a file instead of tailing it')
+    parser.add_argument('--replay', metavar='MIDI_FILE', help='write the events of a MIDI file to stdout instead')
+    parser.add_argument('--realtime', action='store_true', help='with --replay, pace the events at their times')
+    args = parser.parse_args()
+
+    if args.replay:
+        started = time.monotonic()
+        for event in midi_file_events(args.replay):
+            if args.realtime:
+                time.sleep(max(0., event['time'] - (time.monotonic() - started)))
+            sys.stdout.write(json.dumps(event) + '\n')
+            sys.stdout.flush()
+    else:
+        with open('parameters.yaml', 'r') as f:
+            parameters = yaml.safe_load(f)
+        settings = parameters['streaming']
+        statistics = WindowStatistics(settings['window_s'], settings['hop_s'], settings['relative_accuracy'],
+                                      resolution=settings['resolution'])
+        counters = {}
+        events = read_events(args.source or settings['source'], follow=not args.no_follow,
+                             poll_interval=settings['poll_interval'], counters=counters)
+        columns = feature_names(parameters['features']['groups'])
+        models = load_models(parameters['artifacts']['models'], [WINDOW], columns)
+        if not models:
+            sys.exit(f"No window models in {parameters['artifacts']['models']}: enable streaming.window_models "
+                     f"and run 'python main.py train'")
+        output = open(settings['output'], 'a') if settings['output'] else None
+        try:
+            for record in score_stream(events, models, columns, statistics):
+                labels = ' '.join(f"{name}={result['label']:+d} ({result['score']:+.3f})"
+                                  for name, result in record['models'].items())
+                print(f"{record['window_start']:9.2f}s - {record['window_end']:9.2f}s  {labels}", flush=True)
+                if output:
+                    output.write(json.dumps(record) + '\n')
+                    output.flush()
+        finally:
+            print(f"{counters.get('events', 0)} events read, {counters.get('invalid', 0)} invalid events skipped",
+                  file=sys.stderr)
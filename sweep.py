@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import yaml
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import NearestNeighbors
+from feature_cache import file_content_hash
+from feature_store import open_feature_store, FEATURES_FILE
+from training import SCALERS
+
+# A sweep evaluates every configuration of the grids of the sweep section of parameters.yaml on the
+# training and testing feature stores. The costly work is shared between configurations:
+#   LOF             : one k-nearest-neighbour graph (training rows, and test rows against them) per
+#                     scaling and metric, at the largest n_neighbors; LOF for any smaller k only reads
+#                     the first k columns of it, so every n_neighbors costs a few array operations
+#   IsolationForest : one forest per n_estimators and max_samples; contamination only moves the
+#                     offset, a percentile of the training scores
+# Each configuration is cached as '<key>.json' (score distribution, outlier share) plus '<key>.npy'
+# (test labels) under the sweep folder, the key hashing the configuration and the content of both
+# stores, so an interrupted or extended sweep only computes what is missing.
+_LOF_OFFSET = -1.5      # offset_ of LocalOutlierFactor with contamination='auto'
+_FOREST_OFFSET = -.5    # offset_ of IsolationForest with contamination='auto'
+
+
+def _grid(settings: dict, keys: list) -> list:
+    return [dict(zip(keys, values)) for values in itertools.product(*(settings[key] for key in keys))]
+
+
+def _config_key(data_key: str, config: dict) -> str:
+    return hashlib.sha256(json.dumps([data_key, config], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _load_rows(parameters: dict) -> tuple:
+    # memory mapped again in each worker process rather than sent over
+    return (open_feature_store(parameters['artifacts']['training']).features,
+            open_feature_store(parameters['artifacts']['testing']).features)
+
+
+def _scaled(X_train: np.ndarray, X_test: np.ndarray, scaling: str) -> tuple:
+    if SCALERS[scaling] is None:
+        return X_train, X_test
+    scaler = SCALERS[scaling]().fit(X_train)
+    return scaler.transform(X_train), scaler.transform(X_test)
+
+
+def lof_from_graph(train_distances: np.ndarray, train_indices: np.ndarray, test_distances: np.ndarray,
+                   test_indices: np.ndarray, n_neighbors: int) -> np.ndarray:
+    """
+    Decision scores of the test rows under a novelty LocalOutlierFactor of n_neighbors neighbours,
+    from k-nearest-neighbour graphs computed for any k >= n_neighbors. The graph of the training rows
+    excludes each row from its own neighbours, as LocalOutlierFactor.fit does.
+
+    Input 1-2   : Distances and indices of the neighbours of each training row, closest first
+    Input_type  : np.ndarray
+
+    Input 3-4   : Distances and indices of the training neighbours of each test row, closest first
+    Input_type  : np.ndarray
+
+    Input 5     : Number of neighbours of the LOF
+    Input_type  : Integer
+
+    Output      : Decision scores (negative for outliers) of the test rows
+    Output_type : np.ndarray
+    """
+    k = min(n_neighbors, train_distances.shape[1])
+    k_distance = train_distances[:, k - 1]
+    train_indices, test_indices = train_indices[:, :k], test_indices[:, :k]
+    lrd = 1. / (np.mean(np.maximum(train_distances[:, :k], k_distance[train_indices]), axis=1) + 1e-10)
+    test_lrd = 1. / (np.mean(np.maximum(test_distances[:, :k], k_distance[test_indices]), axis=1) + 1e-10)
+    return -np.mean(lrd[test_indices] / test_lrd[:, None], axis=1) - _LOF_OFFSET
+
+
+def _lof_unit(parameters: dict, scaling: str, metric: str, all_n_neighbors: list) -> list:
+    start = time.perf_counter()
+    X_train, X_test = _scaled(*_load_rows(parameters), scaling)
+    k_max = min(max(all_n_neighbors), X_train.shape[0] - 1)
+    neighbors = NearestNeighbors(n_neighbors=k_max, metric=metric).fit(X_train)
+    train_distances, train_indices = neighbors.kneighbors()
+    test_distances, test_indices = neighbors.kneighbors(X_test)
+    shared_s = time.perf_counter() - start
+    results = []
+    for n_neighbors in all_n_neighbors:
+        start = time.perf_counter()
+        scores = lof_from_graph(train_distances, train_indices, test_distances, test_indices, n_neighbors)
+        results.append(({'model': 'model_LOF', 'lof_n_neighbors': n_neighbors, 'lof_metric': metric,
+                         'lof_scaling': scaling}, scores, {'shared_s': shared_s, 'config_s': time.perf_counter() - start}))
+    return results
+
+
+def _forest_unit(parameters: dict, n_estimators: int, max_samples, contaminations: list) -> list:
+    start = time.perf_counter()
+    X_train, X_test = _load_rows(parameters)
+    forest = IsolationForest(n_estimators=n_estimators, max_samples=max_samples, random_state=0).fit(X_train)
+    train_scores = forest.score_samples(X_train)
+    test_scores = forest.score_samples(X_test)
+    shared_s = time.perf_counter() - start
+    results = []
+    for contamination in contaminations:
+        start = time.perf_counter()
+        # same offset as IsolationForest(contamination=...) fitted on the same rows
+        offset = _FOREST_OFFSET if contamination == 'auto' else np.percentile(train_scores, 100. * contamination)
+        results.append(({'model': 'model_Isolation_Forest', 'if_n_estimators': n_estimators,
+                         'if_max_samples': max_samples, 'if_contamination': contamination},
+                        test_scores - offset, {'shared_s': shared_s, 'config_s': time.perf_counter() - start}))
+    return results
+
+
+def _score_distribution(scores: np.ndarray) -> dict:
+    percentiles = [1, 5, 25, 50, 75, 95, 99]
+    distribution = dict(zip([f'p{q}' for q in percentiles], np.percentile(scores, percentiles).tolist()))
+    distribution.update(mean=float(scores.mean()), std=float(scores.std()))
+    return distribution
+
+
+def _save_result(folder: str, key: str, config: dict, scores: np.ndarray, timings: dict) -> dict:
+    labels = np.where(scores < 0, -1, 1).astype(np.int8)
+    record = {'key': key, 'config': config, 'outlier_share': float((labels == -1).mean()),
+              'scores': _score_distribution(scores), **timings}
+    # labels first: the JSON record marks a complete result
+    np.save(os.path.join(folder, key + '.npy'), labels)
+    tmp_path = os.path.join(folder, key + '.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, os.path.join(folder, key + '.json'))
+    return record
+
+
+def _load_result(folder: str, key: str) -> dict:
+    path = os.path.join(folder, key + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    # of the inlier sets, as the summary of inference.score_in_chunks
+    either = int(((a == 1) | (b == 1)).sum())
+    return int(((a == 1) & (b == 1)).sum()) / either if either else 1.
+
+
+def run_sweep(parameters: dict, force: bool = False) -> dict:
+    """
+    Evaluates the LOF and IsolationForest grids of the sweep section of parameters.yaml, in
+    'sweep.n_workers' processes, reusing the cached results of configurations already evaluated on
+    the same training and testing rows (see the top of this module).
+
+    Input 1     : Content of parameters.yaml
+    Input_type  : Dictionary
+
+    Input 2     : Whether to recompute the configurations already in the cache
+    Input_type  : Boolean
+
+    Output      : Every configuration with its outlier share, test score distribution, time and mean
+                  Jaccard similarity to the configurations of the other model, and the Jaccard similarity
+                  of the test predictions of every pair of configurations
+    Output_type : Dictionary
+    """
+    settings = parameters['sweep']
+    folder = settings['folder']
+    os.makedirs(folder, exist_ok=True)
+    data_key = '/'.join(file_content_hash(os.path.join(parameters['artifacts'][data_set], FEATURES_FILE))
+                        for data_set in ('training', 'testing'))
+
+    units = []
+    for unit in _grid(settings, ['lof_scaling', 'lof_metric']):
+        configs = [{'model': 'model_LOF', 'lof_n_neighbors': k, 'lof_metric': unit['lof_metric'],
+                    'lof_scaling': unit['lof_scaling']} for k in settings['lof_n_neighbors']]
+        units.append((configs, _lof_unit, (unit['lof_scaling'], unit['lof_metric'], settings['lof_n_neighbors'])))
+    for unit in _grid(settings, ['if_n_estimators', 'if_max_samples']):
+        configs = [{'model': 'model_Isolation_Forest', 'if_n_estimators': unit['if_n_estimators'],
+                    'if_max_samples': unit['if_max_samples'], 'if_contamination': contamination}
+                   for contamination in settings['if_contamination']]
+        units.append((configs, _forest_unit, (unit['if_n_estimators'], unit['if_max_samples'],
+                                              settings['if_contamination'])))
+
+    records = {}
+    pending = []
+    for configs, function, args in units:
+        cached = [None if force else _load_result(folder, _config_key(data_key, config)) for config in configs]
+        if all(cached):
+            records.update((record['key'], record) for record in cached)
+        else:
+            pending.append((function, args))
+    print(f'{len(records)} configurations cached, {len(pending)} of {len(units)} work units to run')
+
+    with ProcessPoolExecutor(max_workers=settings['n_workers']) as executor:
+        futures = [executor.submit(function, parameters, *args) for function, args in pending]
+        for future in as_completed(futures):
+            # saved as soon as a unit finishes, so an interrupted sweep keeps them
+            for config, scores, timings in future.result():
+                key = _config_key(data_key, config)
+                records[key] = _save_result(folder, key, config, scores, timings)
+
+    keys = [_config_key(data_key, config) for configs, _, _ in units for config in configs]
+    labels = {key: np.load(os.path.join(folder, key + '.npy')) for key in keys}
+    jaccard = {f'{a}/{b}': _jaccard(labels[a], labels[b]) for a, b in itertools.combinations(keys, 2)}
+    configs = []
+    for key in keys:
+        others = [other for other in keys if records[other]['config']['model'] != records[key]['config']['model']]
+        similarities = [jaccard.get(f'{key}/{other}', jaccard.get(f'{other}/{key}')) for other in others]
+        configs.append(dict(records[key], mean_cross_model_jaccard=float(np.mean(similarities)) if others else None))
+    summary = {'data': data_key, 'configs': configs, 'jaccard_similarity': jaccard}
+    with open(os.path.join(folder, 'sweep.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore')
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep of the LOF and IsolationForest models')
+    parser.add_argument('--force', action='store_true', help='recompute the configurations already cached')
+    args = parser.parse_args()
+
+    with open('parameters.yaml', 'r') as f:
+        parameters = yaml.safe_load(f)
+
+    summary = run_sweep(parameters, args.force)
+    # configurations whose outliers the other model agrees with most come first
+    for record in sorted(summary['configs'], key=lambda record: -(record['mean_cross_model_jaccard'] or 0)):
+        settings = ' '.join(f'{name}={value}' for name, value in record['config'].items() if name != 'model')
+        print(f"{record['config']['model']:24s} {settings:60s} outliers {record['outlier_share'] * 100:5.1f} %  "
+              f"agreement {(record['mean_cross_model_jaccard'] or 0) * 100:5.1f} %")
+    print(f"Sweep results are saved in {os.path.join(parameters['sweep']['folder'], 'sweep.json')}, "
+          f"set the chosen values in the training section of parameters.yaml")
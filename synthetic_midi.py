@@ -0,0 +1,135 @@
+import json
+import os
+import struct
+import numpy as np
+
+# Synthetic Standard MIDI Files for benchmarks: a format 1 file with a tempo track (time signature and
+# evenly spaced tempo changes) followed by one track per instrument. Note events are encoded with
+# numpy, so files of a million notes take well under a second to write.
+RESOLUTION = 480
+# ticks per second at the nominal 120 bpm the note positions are drawn at
+_TICKS_PER_SECOND = 2 * RESOLUTION
+
+
+def _track_chunk(prefix: bytes, ticks: np.ndarray, events: np.ndarray) -> bytes:
+    """
+    Encodes sorted absolute ticks and their event bytes (rows of 3 bytes) as an MTrk chunk, after
+    'prefix', already encoded events at tick 0.
+    """
+    deltas = np.diff(ticks, prepend=0).astype(np.int64)
+    # variable length quantities of up to 4 bytes, 7 bits per byte, most significant first
+    n_bytes = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    starts = np.concatenate([[0], np.cumsum(n_bytes + events.shape[1])[:-1]])
+    data = np.empty(int((n_bytes + events.shape[1]).sum()), dtype=np.uint8)
+    for k in range(4):
+        has_byte = n_bytes > k
+        shift = 7 * (n_bytes[has_byte] - 1 - k)
+        continuation = np.where(k < n_bytes[has_byte] - 1, 0x80, 0)
+        data[starts[has_byte] + k] = ((deltas[has_byte] >> shift) & 0x7F) | continuation
+    for k in range(events.shape[1]):
+        data[starts + n_bytes + k] = events[:, k]
+    # end of track one tick after the last event
+    payload = prefix + data.tobytes() + b'\x01\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>I', len(payload)) + payload
+
+
+def _tempo_track(end_tick: int, n_tempo_changes: int, rng: np.random.Generator) -> bytes:
+    chunks = [b'\x00\xff\x58\x04\x04\x02\x18\x08']  # 4/4
+    change_ticks = np.linspace(0, end_tick, n_tempo_changes + 1, endpoint=False).astype(np.int64)
+    previous = 0
+    for tick, bpm in zip(change_ticks, rng.uniform(60, 180, size=change_ticks.shape[0])):
+        microseconds = int(60e6 / bpm)
+        chunks.append(_variable_length(int(tick) - previous) + b'\xff\x51\x03' + microseconds.to_bytes(3, 'big'))
+        previous = int(tick)
+    payload = b''.join(chunks) + b'\x00\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>I', len(payload)) + payload
+
+
+def _variable_length(value: int) -> bytes:
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def synthetic_midi(n_notes: int, n_instruments: int = 4, duration: float = 120., n_tempo_changes: int = 0,
+                   seed: int = 0) -> bytes:
+    """
+    Generates the bytes of a random Standard MIDI File.
+
+    Input 1     : Number of notes, spread over the instruments
+    Input_type  : Integer
+
+    Input 2     : Number of instruments (tracks with their own program and channel, the drum channel excluded)
+    Input_type  : Integer
+
+    Input 3     : Length in seconds at the nominal 120 bpm, so that the note density is n_notes / duration
+    Input_type  : Float
+
+    Input 4     : Number of tempo changes after the initial tempo
+    Input_type  : Integer
+
+    Input 5     : Seed of the random generator, the same seed gives the same bytes
+    Input_type  : Integer
+
+    Output      : Content of the MIDI file
+    Output_type : bytes
+    """
+    rng = np.random.default_rng(seed)
+    end_tick = max(1, int(duration * _TICKS_PER_SECOND))
+    tracks = [_tempo_track(end_tick, n_tempo_changes, rng)]
+    programs = rng.integers(0, 128, size=n_instruments)
+    for instrument, n in enumerate(rng.multinomial(n_notes, np.ones(n_instruments) / n_instruments)):
+        channel = instrument % 15 + (instrument % 15 >= 9)  # channel 9 is reserved for drums
+        starts = np.sort(rng.integers(0, end_tick, size=n))
+        ends = starts + 1 + rng.exponential(RESOLUTION / 2, size=n).astype(np.int64)
+        pitches = np.clip(rng.normal(60, 12, size=n), 0, 127).astype(np.int64)
+        velocities = rng.integers(30, 128, size=n)
+        ticks = np.concatenate([starts, ends])
+        events = np.concatenate([np.stack([np.full(n, 0x90 | channel), pitches, velocities], axis=1),
+                                 np.stack([np.full(n, 0x80 | channel), pitches, np.zeros(n, np.int64)], axis=1)])
+        # at equal ticks note offs come first, so repeated pitches pair with the right note on
+        order = np.lexsort((np.concatenate([np.ones(n), np.zeros(n)]), ticks))
+        program_change = bytes([0, 0xC0 | channel, programs[instrument]])
+        tracks.append(_track_chunk(program_change, ticks[order], events[order].astype(np.uint8)))
+    header = b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), RESOLUTION)
+    return header + b''.join(tracks)
+
+
+def write_corpus(folder: str, n_files: int, notes_per_file: int, n_instruments: int = 4, duration: float = 120.,
+                 n_tempo_changes: int = 0, seed: int = 0) -> list:
+    """
+    Writes a corpus of synthetic MIDI files (see synthetic_midi) into a folder, described by a JSON
+    file next to it ('<folder>.json'). A folder holding a corpus of the same description is reused.
+
+    Input 1     : Folder of the corpus
+    Input_type  : String
+
+    Input 2-7   : Number of files, then the arguments of synthetic_midi shared by all files; each file
+                  gets its own seed derived from 'seed' and its index
+    Input_type  : Integer / Float
+
+    Output      : Paths of the files, in sorted order
+    Output_type : List
+    """
+    spec = {'n_files': n_files, 'notes_per_file': notes_per_file, 'n_instruments': n_instruments,
+            'duration': duration, 'n_tempo_changes': n_tempo_changes, 'seed': seed}
+    spec_path = os.path.normpath(folder) + '.json'
+    paths = [os.path.join(folder, f'synthetic_{i:07d}.mid') for i in range(n_files)]
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            if json.load(f) == spec:
+                return paths
+    os.makedirs(folder, exist_ok=True)
+    for stale in os.listdir(folder):
+        os.remove(os.path.join(folder, stale))
+    for i, path in enumerate(paths):
+        file_seed = int(np.random.SeedSequence([seed, i]).generate_state(1)[0])
+        with open(path, 'wb') as f:
+            f.write(synthetic_midi(notes_per_file, n_instruments, duration, n_tempo_changes, file_seed))
+    # written last, so an interrupted generation is redone
+    with open(spec_path, 'w') as f:
+        json.dump(spec, f)
+    return paths
@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+
+# the modules of the project are flat at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_small_midi(path: str, transpose: int = 0) -> str:
+    """
+    Writes a short MIDI file with pretty_midi: a piano line, sustained strings and a drum track, at 96 bpm,
+    the pitched notes transposed by 'transpose' semitones.
+    """
+    import pretty_midi
+    midi = pretty_midi.PrettyMIDI(initial_tempo=96)
+    piano = pretty_midi.Instrument(program=0)
+    strings = pretty_midi.Instrument(program=40)
+    drums = pretty_midi.Instrument(program=0, is_drum=True)
+    for i in range(48):
+        start = i * 0.3125
+        piano.notes.append(pretty_midi.Note(velocity=60 + (i * 7) % 50, pitch=48 + (i * 5) % 24 + transpose,
+                                            start=start, end=start + 0.25 + (i % 3) * 0.1))
+    for i in range(12):
+        start = i * 1.25
+        strings.notes.append(pretty_midi.Note(velocity=70, pitch=64 + (i % 4) * 3 + transpose, start=start,
+                                              end=start + 1.2))
+        drums.notes.append(pretty_midi.Note(velocity=100, pitch=36, start=start, end=start + 0.1))
+    midi.instruments.extend([piano, strings, drums])
+    midi.write(path)
+    return path
+
+
+@pytest.fixture
+def small_midi(tmp_path) -> str:
+    return build_small_midi(str(tmp_path / 'small.mid'))
@@ -0,0 +1,23 @@
+import os
+import pytest
+from benchmark import measure
+
+
+def _fails():
+    raise KeyError('missing')
+
+
+def _dies():
+    os._exit(3)
+
+
+def test_measure_reports_the_result():
+    measured = measure(sum, [1, 2, 3])
+    assert measured['result'] == 6 and measured['seconds'] >= 0
+
+
+def test_measure_raises_when_the_case_fails():
+    with pytest.raises(RuntimeError, match="KeyError: 'missing'"):
+        measure(_fails)
+    with pytest.raises(RuntimeError, match='exit code 3'):
+        measure(_dies)
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('sklearn', 'pandas', 'matplotlib')
+
+# runs 'python main.py <arguments>' and prints the top level modules imported by then
+_PROBE = """
+import json, runpy, sys
+sys.argv = ['main.py'] + sys.argv[1:]
+try:
+    runpy.run_path('main.py', run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))
+"""
+
+
+def _imported_modules(*arguments) -> set:
+    result = subprocess.run([sys.executable, '-c', _PROBE, *arguments], cwd=REPO, capture_output=True, text=True,
+                            check=True)
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+@pytest.mark.parametrize('arguments', [('score', '--help'), ('--help',), ('train', '--help')])
+def test_help_does_not_import_heavy_modules(arguments):
+    imported = _imported_modules(*arguments)
+    assert 'pipeline' in imported
+    assert not imported & set(HEAVY_MODULES), sorted(imported & set(HEAVY_MODULES))
+
+
+def test_runs_from_another_folder(tmp_path):
+    # only parameters.yaml is read from the working directory, the modules come from the checkout
+    result = subprocess.run([sys.executable, os.path.join(REPO, 'main.py'), 'score', '--help'], cwd=tmp_path,
+                            capture_output=True, text=True, check=True)
+    assert '--force' in result.stdout
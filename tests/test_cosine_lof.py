@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import LocalOutlierFactor
+from cosine_lof import CosineLOF, compare_with_sklearn
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    # training rows around a few directions, test rows half from them and half anywhere
+    centers = rng.normal(size=(4, 8))
+    train = centers[rng.integers(4, size=300)] + 0.3 * rng.normal(size=(300, 8))
+    test = np.vstack([centers[rng.integers(4, size=40)] + 0.3 * rng.normal(size=(40, 8)), rng.normal(size=(40, 8))])
+    return train, test
+
+
+@pytest.mark.parametrize('options', [{}, {'block_size': 7},
+                                     # every cell probed: the ivf index finds the exact neighbours
+                                     {'index': 'ivf', 'n_lists': 6, 'n_probe': 6}])
+def test_same_scores_as_sklearn(rows, options):
+    train, test = rows
+    reference = LocalOutlierFactor(n_neighbors=10, novelty=True, metric='cosine').fit(train)
+    model = CosineLOF(n_neighbors=10, **options).fit(train)
+    np.testing.assert_allclose(model.negative_outlier_factor_, reference.negative_outlier_factor_, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(model.score_samples(test), reference.score_samples(test), rtol=0, atol=1e-12)
+    np.testing.assert_allclose(model.decision_function(test), reference.decision_function(test), rtol=0, atol=1e-12)
+    assert (model.predict(test) == reference.predict(test)).all()
+    assert -1 in model.predict(test) and 1 in model.predict(test)
+
+
+def test_ivf_with_few_probes_stays_close(rows):
+    train, test = rows
+    report = compare_with_sklearn(train, test, 10, index='ivf', n_lists=16, n_probe=4)
+    assert report['neighbor_recall'] > 0.8 and report['prediction_agreement'] > 0.9
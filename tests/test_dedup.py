@@ -0,0 +1,46 @@
+import json
+import os
+from conftest import build_small_midi
+from dedup import deduplicate
+from manifest import build_manifest, save_manifest
+
+
+def _corpus(root) -> str:
+    # a piece, its transposition by the same composer and by another one, and an unrelated file
+    for composer, name, transpose in (('Bach', 'piece.mid', 0), ('Bach', 'piece_up.mid', 3),
+                                      ('Handel', 'piece_down.mid', -2)):
+        os.makedirs(root / composer, exist_ok=True)
+        build_small_midi(str(root / composer / name), transpose)
+    with open(root / 'Handel' / 'other.mid', 'wb') as f:
+        f.write(b'not a midi file')
+    manifest_path = str(root / 'manifest.json')
+    save_manifest(manifest_path, build_manifest(str(root)))
+    return manifest_path
+
+
+def _dedup(root, manifest_path: str, **options) -> tuple:
+    report = deduplicate(manifest_path, str(root / 'kept.json'), str(root / 'report.json'), **options)
+    with open(root / 'kept.json') as f:
+        return report, [entry['id'] for entry in json.load(f)['entries']]
+
+
+def test_near_duplicates_are_merged_within_a_composer_only(tmp_path):
+    manifest_path = _corpus(tmp_path)
+    report, kept = _dedup(tmp_path, manifest_path)
+    assert kept == ['Bach/piece.mid', 'Handel/other.mid', 'Handel/piece_down.mid']
+    assert [sorted(member['id'] for member in cluster['members']) for cluster in report['clusters']] == \
+           [['Bach/piece.mid', 'Bach/piece_up.mid']]
+    assert list(report['unparsed']) == ['Handel/other.mid']
+
+    report, kept = _dedup(tmp_path, manifest_path, within_composer=False)
+    assert kept == ['Bach/piece.mid', 'Handel/other.mid']
+    assert report['settings']['within_composer'] is False
+
+
+def test_vanished_file_is_skipped(tmp_path):
+    manifest_path = _corpus(tmp_path)
+    os.remove(tmp_path / 'Bach' / 'piece_up.mid')
+    report, kept = _dedup(tmp_path, manifest_path)
+    assert report['unparsed']['Bach/piece_up.mid'].startswith('unreadable')
+    # kept as a cluster of its own, extraction then drops it like any unreadable file
+    assert kept == ['Bach/piece.mid', 'Bach/piece_up.mid', 'Handel/other.mid', 'Handel/piece_down.mid']
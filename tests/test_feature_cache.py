@@ -0,0 +1,97 @@
+import hashlib
+import os
+import numpy as np
+from feature_cache import FeatureCache
+from feature_store import FEATURES_FILE, FILE_IDS_FILE, store_shape
+
+NAMES = ['a', 'b', 'c']
+
+
+def _hash(i: int) -> str:
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+def _rows(n: int, offset: int = 0) -> np.ndarray:
+    return np.arange(offset, offset + n * 3, dtype=np.float64).reshape(n, 3)
+
+
+def _fill(path: str, n: int, batch_size: int = 4) -> None:
+    cache = FeatureCache(path, 'v1', NAMES, batch_size)
+    for i, row in enumerate(_rows(n)):
+        cache.add(_hash(i), row)
+    cache.compact()
+
+
+def test_rows_are_found_after_reopening(tmp_path):
+    path = str(tmp_path / 'cache')
+    _fill(path, 10)
+    cache = FeatureCache(path, 'v1', NAMES)
+    assert cache.n_rows == 10
+    for i, row in enumerate(_rows(10)):
+        assert _hash(i) in cache
+        np.testing.assert_array_equal(cache.get(_hash(i)), row)
+    assert _hash(10) not in cache and cache.get(_hash(10)) is None
+
+
+def test_rows_are_written_in_batches(tmp_path):
+    path = str(tmp_path / 'cache')
+    cache = FeatureCache(path, 'v1', NAMES, batch_size=4)
+    for i, row in enumerate(_rows(6)):
+        cache.add(_hash(i), row)
+    # one batch written, two rows pending
+    assert store_shape(path)[0] == 4
+    cache.flush()
+    assert store_shape(path)[0] == 6
+
+
+def test_other_extractor_version_starts_afresh(tmp_path):
+    path = str(tmp_path / 'cache')
+    _fill(path, 5)
+    assert FeatureCache(path, 'v2', NAMES).n_rows == 0
+    assert FeatureCache(path, 'v2', NAMES + ['d']).n_rows == 0
+
+
+def test_pickled_cache_of_earlier_versions_is_replaced(tmp_path):
+    path = str(tmp_path / 'cache.pkl')
+    with open(path, 'wb') as f:
+        f.write(b'old pickle')
+    assert FeatureCache(path, 'v1', NAMES).n_rows == 0
+    assert os.path.isdir(path)
+
+
+def test_unused_entries_are_compacted_once_they_are_the_majority(tmp_path):
+    path = str(tmp_path / 'cache')
+    _fill(path, 10)
+    cache = FeatureCache(path, 'v1', NAMES)
+    for i in range(6):
+        cache.get(_hash(i))
+    # 4 unused entries against 6 used ones: kept
+    assert not cache.compact()
+    cache = FeatureCache(path, 'v1', NAMES)
+    for i in range(3):
+        cache.get(_hash(i))
+    cache.add(_hash(20), _rows(1, 100)[0])
+    # 7 unused entries against 3 used and 1 added ones
+    assert cache.compact()
+    cache = FeatureCache(path, 'v1', NAMES)
+    assert cache.n_rows == 4
+    assert [_hash(i) in cache for i in (0, 1, 2, 3, 20)] == [True, True, True, False, True]
+    np.testing.assert_array_equal(cache.get(_hash(2)), _rows(10)[2])
+    np.testing.assert_array_equal(cache.get(_hash(20)), _rows(1, 100)[0])
+
+
+def test_interrupted_append_is_cut_off(tmp_path):
+    path = str(tmp_path / 'cache')
+    _fill(path, 3)
+    # half a row written without its hash, and a partial hash
+    with open(os.path.join(path, FEATURES_FILE), 'ab') as f:
+        f.write(b'\0' * 12)
+    with open(os.path.join(path, FILE_IDS_FILE), 'a') as f:
+        f.write(_hash(3)[:20])
+    cache = FeatureCache(path, 'v1', NAMES)
+    assert cache.n_rows == 3
+    cache.add(_hash(4), [7., 8., 9.])
+    cache.flush()
+    cache = FeatureCache(path, 'v1', NAMES)
+    np.testing.assert_array_equal(cache.get(_hash(4)), [7., 8., 9.])
+    np.testing.assert_array_equal(cache.get(_hash(2)), _rows(3)[2])
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import feature_engineering
+from feature_engineering import FEATURE_GROUPS, FEATURE_NAMES, feature_names, feature_engineering_single_file
+
+# columns of the DataFrame built by feature_engineering_all_files before feature groups existed
+BASELINE_COLUMNS = ['tempo', 'number_beats', 'number_notes', 'number_downbeats', 'percentage_downbeats', 'length',
+                    'number_notes_solo', 'number_instruments', 'notes_density', 'percentage_notes_solo',
+                    'tempo_change_frequency', 'resolution',
+                    'note_duration_mean', 'note_duration_std_dev', 'note_duration_min', 'note_duration_25p',
+                    'note_duration_50p', 'note_duration_75p', 'note_duration_max',
+                    'note_velocity_mean', 'note_velocity_std_dev', 'note_velocity_min', 'note_velocity_25p',
+                    'note_velocity_50p', 'note_velocity_75p', 'note_velocity_max',
+                    'note_pitch_mean', 'note_pitch_std_dev', 'note_pitch_min', 'note_pitch_25p', 'note_pitch_50p',
+                    'note_pitch_75p', 'note_pitch_max', 'percentage_pitch_class1', 'percentage_pitch_class2',
+                    'percentage_pitch_class3', 'percentage_pitch_class4', 'percentage_pitch_class5',
+                    'percentage_pitch_class6', 'percentage_pitch_class7', 'percentage_pitch_class8',
+                    'percentage_pitch_class9', 'percentage_pitch_class10', 'percentage_pitch_class11',
+                    'percentage_pitch_class12']
+
+# row of conftest.build_small_midi returned by the baseline extractor (pretty_midi and a pandas DataFrame)
+GOLDEN_ROW = [192.0, 25, 72, 7, 0.28, 15.136363636363637, 48, 2, 4.756756756756757, 0.3333333333333333,
+              0.06606606606606606, 220,
+              0.4493371212121214, 0.3561561202721825, 0.09943181818181812, 0.25, 0.34943181818181834,
+              0.4488636363636367, 1.1988636363636367,
+              84.25, 14.698615437334492, 60.0, 70.0, 83.5, 100.0, 109.0,
+              57.083333333333336, 11.636211086548071, 36.0, 50.75, 59.5, 67.0, 73.0,
+              0.06666666666666667, 0.11666666666666667, 0.06666666666666667, 0.06666666666666667,
+              0.11666666666666667, 0.06666666666666667, 0.06666666666666667, 0.11666666666666667,
+              0.06666666666666667, 0.06666666666666667, 0.11666666666666667, 0.06666666666666667]
+
+
+def test_column_order_matches_baseline():
+    assert FEATURE_NAMES == BASELINE_COLUMNS
+    assert feature_names() == BASELINE_COLUMNS
+    assert feature_names(list(FEATURE_GROUPS)) == BASELINE_COLUMNS
+
+
+@pytest.mark.parametrize('backend', ['pretty_midi', 'native'])
+def test_feature_vector_matches_baseline(small_midi, backend):
+    row = feature_engineering_single_file(small_midi, backend=backend)
+    assert len(row) == len(GOLDEN_ROW) == 45
+    np.testing.assert_allclose(row, GOLDEN_ROW, rtol=1e-12, atol=0)
+
+
+def test_feature_vector_from_bytes(small_midi):
+    with open(small_midi, 'rb') as f:
+        row = feature_engineering_single_file(f.read(), backend='native')
+    np.testing.assert_allclose(row, GOLDEN_ROW, rtol=1e-12, atol=0)
+
+
+def test_feature_groups_select_columns(small_midi):
+    groups = ['tempo', 'pitch_classes']
+    row = feature_engineering_single_file(small_midi, groups=groups)
+    columns = feature_names(groups)
+    assert len(row) == len(columns) == 13
+    np.testing.assert_allclose(row, [GOLDEN_ROW[BASELINE_COLUMNS.index(name)] for name in columns], rtol=1e-12)
+
+
+def test_unreadable_file_returns_none(tmp_path):
+    path = tmp_path / 'broken.mid'
+    path.write_bytes(b'not a midi file')
+    assert feature_engineering.feature_engineering_single_file(str(path)) is None
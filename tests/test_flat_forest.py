@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from flat_forest import FlatIsolationForest
+from model_registry import CORPUS, load_model, save_model
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(500, 6)), np.vstack([rng.normal(size=(100, 6)), 4 * rng.normal(size=(20, 6))])
+
+
+@pytest.mark.parametrize('options', [{'max_samples': 128}, {'max_samples': 0.5},
+                                     {'max_samples': 200, 'max_features': 0.5},
+                                     {'max_samples': 'auto', 'contamination': 0.1}])
+def test_same_scores_as_the_source_forest(tmp_path, rows, options):
+    train, test = rows
+    model = IsolationForest(n_estimators=25, random_state=0, **options).fit(train)
+    FlatIsolationForest.from_sklearn(model).save(str(tmp_path / 'model.forest'))
+    flat = FlatIsolationForest.load(str(tmp_path / 'model.forest'))
+    np.testing.assert_array_equal(flat.score_samples(test), model.score_samples(test))
+    np.testing.assert_array_equal(flat.decision_function(test), model.decision_function(test))
+    np.testing.assert_array_equal(flat.predict(test), model.predict(test))
+    assert flat.n_features_in_ == 6
+
+
+def test_deep_forests_are_not_exported(tmp_path, rows, capsys):
+    model = IsolationForest(n_estimators=5, max_samples=500, random_state=0).fit(rows[0])
+    with pytest.raises(ValueError, match='depth 9'):
+        FlatIsolationForest.from_sklearn(model, max_depth=8)
+    assert FlatIsolationForest.from_sklearn(model, max_depth=9).depth == 9
+
+    # the registry keeps the pickle alone and loads it instead
+    deep = IsolationForest(n_estimators=2, max_samples=2 ** 17, random_state=0)
+    deep.fit(np.random.default_rng(0).normal(size=(2 ** 17, 2)))
+    save_model(str(tmp_path), CORPUS, 'model_Isolation_Forest', deep, {}, flat_forest=True)
+    assert 'not exported: Trees of depth 17' in capsys.readouterr().out
+    assert isinstance(load_model(str(tmp_path), CORPUS, 'model_Isolation_Forest'), IsolationForest)
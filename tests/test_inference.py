@@ -0,0 +1,84 @@
+import json
+import pickle
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import LocalOutlierFactor
+from feature_store import append_rows, create_feature_store, open_feature_store
+from flat_forest import FlatIsolationForest
+from inference import load_models, predict_with_scores, score_in_chunks
+
+FEATURE_NAMES = ['a', 'b', 'c']
+
+
+def _save_legacy(folder, rows) -> None:
+    # a model pickled directly in the models folder, as training.py did before the model registry
+    folder.mkdir(exist_ok=True)
+    with open(folder / 'model_Isolation_Forest.pkl', 'wb') as f:
+        pickle.dump(IsolationForest(n_estimators=5, random_state=0).fit(rows), f)
+
+
+def test_legacy_model_without_feature_names_is_checked_by_feature_count(tmp_path, capsys):
+    _save_legacy(tmp_path / 'models', np.zeros((20, 3)))
+    assert list(load_models(str(tmp_path / 'models'))) == ['model_Isolation_Forest']
+    assert list(load_models(str(tmp_path / 'models'), feature_names=FEATURE_NAMES)) == ['model_Isolation_Forest']
+    assert 'fitted on 3 unnamed features' in capsys.readouterr().out
+    with pytest.raises(ValueError, match='fitted on 3 features'):
+        load_models(str(tmp_path / 'models'), feature_names=FEATURE_NAMES + ['d'])
+
+
+def test_legacy_flat_forest_takes_its_feature_count_from_the_pickle(tmp_path):
+    _save_legacy(tmp_path / 'models', np.zeros((20, 3)))
+    forest_path = tmp_path / 'models' / 'model_Isolation_Forest.forest'
+    with open(tmp_path / 'models' / 'model_Isolation_Forest.pkl', 'rb') as f:
+        FlatIsolationForest.from_sklearn(pickle.load(f)).save(str(forest_path))
+    header_path = forest_path / 'forest.json'
+    header = json.loads(header_path.read_text())
+    assert header.pop('n_features_in') == 3
+    # as exported before the number of features was recorded
+    header_path.write_text(json.dumps(header))
+    models = load_models(str(tmp_path / 'models'), feature_names=FEATURE_NAMES)
+    assert isinstance(models['model_Isolation_Forest'], FlatIsolationForest)
+    with pytest.raises(ValueError, match='fitted on 3 features'):
+        load_models(str(tmp_path / 'models'), feature_names=['a', 'b'])
+
+
+def test_legacy_model_is_checked_against_its_feature_names(tmp_path):
+    pd = pytest.importorskip('pandas')
+    _save_legacy(tmp_path / 'models', pd.DataFrame(np.zeros((20, 3)), columns=FEATURE_NAMES))
+    assert list(load_models(str(tmp_path / 'models'), feature_names=FEATURE_NAMES)) == ['model_Isolation_Forest']
+    with pytest.raises(ValueError, match='train the models again'):
+        load_models(str(tmp_path / 'models'), feature_names=['a', 'c', 'b'])
+
+
+def test_chunked_scoring_matches_in_memory_scoring(tmp_path):
+    rng = np.random.default_rng(0)
+    train, rows = rng.normal(size=(200, 4)), np.vstack([rng.normal(size=(40, 4)), 4 * rng.normal(size=(10, 4))])
+    create_feature_store(str(tmp_path / 'testing'), ['a', 'b', 'c', 'd'], '1')
+    file_ids = [f'file_{i}.mid' for i in range(len(rows))]
+    append_rows(str(tmp_path / 'testing'), file_ids, rows)
+    store = open_feature_store(str(tmp_path / 'testing'))
+    models = {'model_LOF': LocalOutlierFactor(n_neighbors=10, novelty=True).fit(train),
+              'model_Isolation_Forest': IsolationForest(n_estimators=20, random_state=0).fit(train)}
+
+    outputs = {}
+    for chunk_size, n_workers in ((len(rows), 1), (7, 1), (7, 2)):
+        path = tmp_path / f'predictions_{chunk_size}_{n_workers}.jsonl'
+        summary = score_in_chunks(store.features, store.file_ids, models, str(path), chunk_size, n_workers)
+        with open(path) as f:
+            outputs[chunk_size, n_workers] = [json.loads(line) for line in f]
+        assert summary['files'] == len(rows)
+        assert summary['outliers'] == {name: int((model.predict(rows) == -1).sum()) for name, model in models.items()}
+    assert outputs[len(rows), 1] == outputs[7, 1] == outputs[7, 2]
+
+    records = outputs[7, 2]
+    assert [record['file_id'] for record in records] == file_ids
+    for name, model in models.items():
+        labels, scores = predict_with_scores(model, rows)
+        assert [record[name]['label'] for record in records] == labels.tolist()
+        assert [record[name]['score'] for record in records] == scores.tolist()
+    assert [record['models_agree'] for record in records] == \
+           [record['model_LOF']['label'] == record['model_Isolation_Forest']['label'] for record in records]
+    inliers = [{i for i, record in enumerate(records) if record[name]['label'] == 1} for name in models]
+    assert summary['jaccard_similarity'] == \
+           {'model_LOF/model_Isolation_Forest': len(inliers[0] & inliers[1]) / len(inliers[0] | inliers[1])}
@@ -0,0 +1,54 @@
+import os
+import tarfile
+import zipfile
+import numpy as np
+import pytest
+from feature_engineering import feature_engineering_all_files
+from manifest import build_manifest, save_manifest
+from synthetic_midi import synthetic_midi
+
+FILES = ['Bach/fugue.mid', 'Bach/prelude_in C.mid', 'Chopin/etude.midi', 'Chopin/nocturne.mid']
+
+
+@pytest.fixture(scope='module')
+def sources(tmp_path_factory):
+    # the same MIDI files as a folder, a zip and a gzipped tar, with a file that is not MIDI in each
+    root = tmp_path_factory.mktemp('sources')
+    folder = root / 'folder'
+    for seed, name in enumerate(FILES + ['Chopin/notes.txt']):
+        os.makedirs(folder / os.path.dirname(name), exist_ok=True)
+        with open(folder / name, 'wb') as f:
+            f.write(synthetic_midi(200, duration=20., seed=seed) if name in FILES else b'not a midi file')
+    with zipfile.ZipFile(root / 'corpus.zip', 'w') as archive:
+        for name in FILES + ['Chopin/notes.txt']:
+            archive.write(folder / name, name)
+    with tarfile.open(root / 'corpus.tar.gz', 'w:gz') as archive:
+        for name in FILES + ['Chopin/notes.txt']:
+            archive.add(folder / name, name)
+    return {kind: str(path) for kind, path in (('folder', folder), ('zip', root / 'corpus.zip'),
+                                              ('tar', root / 'corpus.tar.gz'))}
+
+
+def _listing(manifest: dict) -> list:
+    return [(entry['id'], entry['size'], entry['sha256']) for entry in manifest['entries']]
+
+
+def test_archives_give_the_manifest_of_the_folder(sources):
+    manifests = {kind: build_manifest(source) for kind, source in sources.items()}
+    assert [entry['id'] for entry in manifests['folder']['entries']] == \
+           ['Bach/fugue.mid', 'Bach/prelude_in_C.mid', 'Chopin/etude.midi', 'Chopin/nocturne.mid']
+    assert _listing(manifests['zip']) == _listing(manifests['folder']) == _listing(manifests['tar'])
+    assert all(entry['member'] is None for entry in manifests['folder']['entries'])
+    assert [entry['member'] for entry in manifests['tar']['entries']] == FILES
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_archives_give_the_features_of_the_folder(sources, tmp_path, n_workers):
+    rows = {}
+    for kind, source in sources.items():
+        manifest_path = str(tmp_path / f'{kind}.json')
+        save_manifest(manifest_path, build_manifest(source))
+        rows[kind] = feature_engineering_all_files(manifest_path=manifest_path, n_workers=n_workers)
+    assert rows['folder'].shape[0] == len(FILES) and not np.isnan(rows['folder']).any()
+    np.testing.assert_array_equal(rows['zip'], rows['folder'])
+    np.testing.assert_array_equal(rows['tar'], rows['folder'])
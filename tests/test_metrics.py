@@ -0,0 +1,70 @@
+import json
+import tracemalloc
+import numpy as np
+import pytest
+from feature_engineering import FEATURE_GROUPS, feature_engineering_all_files
+from metrics import percentiles, summarize_chunk_metrics, summary_path
+from synthetic_midi import synthetic_midi
+
+GOOD = ['a.mid', 'b.mid', 'c.mid']
+
+
+@pytest.fixture
+def folder(tmp_path):
+    (tmp_path / 'source').mkdir()
+    for seed, name in enumerate(GOOD):
+        with open(tmp_path / 'source' / name, 'wb') as f:
+            f.write(synthetic_midi(100 * (seed + 1), duration=20., seed=seed))
+    with open(tmp_path / 'source' / 'broken.mid', 'wb') as f:
+        f.write(b'MThd not really')
+    return tmp_path / 'source'
+
+
+def _extract(folder, metrics_path, **options) -> tuple:
+    feature_engineering_all_files(str(folder), metrics_path=str(metrics_path), top_n=2, **options)
+    with open(metrics_path) as f:
+        records = [json.loads(line) for line in f]
+    with open(summary_path(str(metrics_path))) as f:
+        return records, json.load(f)
+
+
+def test_extraction_records_and_summary(folder, tmp_path):
+    records, summary = _extract(folder, tmp_path / 'extraction.jsonl', cache_path=str(tmp_path / 'cache'))
+    assert [record['file_id'] for record in records] == ['a.mid', 'b.mid', 'broken.mid', 'c.mid']
+    by_id = {record['file_id']: record for record in records}
+    assert by_id['broken.mid']['status'] == 'failed' and by_id['broken.mid']['error_category'].startswith('parse:')
+    for name in GOOD:
+        record = by_id[name]
+        assert record['status'] == 'ok' and set(record['groups']) == set(FEATURE_GROUPS)
+        assert 0 < record['parse_s'] <= record['total_s'] and record['max_rss_bytes'] > 0
+    assert [by_id[name]['notes'] for name in GOOD] == [100, 200, 300]
+
+    assert summary['files'] == 4 and summary['status'] == {'ok': 3, 'failed': 1}
+    assert summary['error_categories'] == {by_id['broken.mid']['error_category']: 1}
+    assert summary['total_s'] == percentiles([record['total_s'] for record in records])
+    assert summary['notes'] == percentiles([100, 200, 300])
+    assert summary['groups_s'] == {group: percentiles([by_id[name]['groups'][group] for name in GOOD])
+                                   for group in sorted(FEATURE_GROUPS)}
+    slowest = sorted(records, key=lambda record: -record['total_s'])[:2]
+    assert [entry['file_id'] for entry in summary['slowest_files']] == [record['file_id'] for record in slowest]
+    assert 'peak_traced_bytes' not in summary
+
+    # cached files are counted, but not in the timings
+    records, summary = _extract(folder, tmp_path / 'extraction.jsonl', cache_path=str(tmp_path / 'cache'),
+                                profile='tracemalloc')
+    assert [record['status'] for record in records] == ['cached', 'cached', 'failed', 'cached']
+    assert summary['status'] == {'cached': 3, 'failed': 1} and summary['notes'] == {}
+    assert summary['peak_traced_bytes']['max'] == records[2]['peak_traced_bytes'] > 0
+    # extracted in this process, which does not keep tracing afterwards
+    assert not tracemalloc.is_tracing()
+
+
+def test_chunk_summary():
+    records = [{'chunk': 0, 'rows': 10, 'models_s': {'model_LOF': .2, 'model_Isolation_Forest': .1}},
+               {'chunk': 1, 'rows': 5, 'models_s': {'model_LOF': .1, 'model_Isolation_Forest': .1}}]
+    summary = summarize_chunk_metrics(records)
+    assert summary['chunks'] == 2 and summary['rows'] == 15
+    assert summary['models']['model_LOF']['total_s'] == pytest.approx(.3)
+    assert summary['models']['model_LOF']['rows_per_s'] == pytest.approx(50.)
+    assert summary['models']['model_Isolation_Forest']['chunk_s'] == percentiles([.1, .1])
+    assert np.isclose(summary['models']['model_LOF']['chunk_s']['max'], .2)
@@ -0,0 +1,162 @@
+import io
+import struct
+import numpy as np
+import pytest
+import pretty_midi
+import feature_engineering
+from feature_engineering import feature_engineering_single_file
+from midi_parser import MidiParseError, read_midi
+
+
+def _varlen(value: int) -> bytes:
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _track(events: list, end_of_track: bool = True) -> bytes:
+    # events are (delta ticks, raw event bytes), written as given so running status can be used
+    body = b''.join(_varlen(delta) + event for delta, event in events)
+    if end_of_track:
+        body += b'\x00\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>L', len(body)) + body
+
+
+def _smf(tracks: list, resolution: int = 480) -> bytes:
+    return b'MThd' + struct.pack('>LHHH', 6, 1, len(tracks), resolution) + b''.join(tracks)
+
+
+def _tempo(bpm: float) -> bytes:
+    return b'\xff\x51\x03' + int(round(6e7 / bpm)).to_bytes(3, 'big')
+
+
+def _time_signature(numerator: int, denominator: int) -> bytes:
+    return b'\xff\x58\x04' + bytes([numerator, denominator.bit_length() - 1, 24, 8])
+
+
+def _scale(channel: int = 0, program: int = 0, n: int = 16, step: int = 240, first_pitch: int = 60) -> list:
+    events = [(0, bytes([0xC0 | channel, program]))]
+    for i in range(n):
+        pitch = first_pitch + (i * 5) % 12
+        events += [(0 if i == 0 else step // 2, bytes([0x90 | channel, pitch, 40 + (i * 3) % 80])),
+                   (step // 2, bytes([0x80 | channel, pitch, 0]))]
+    return events
+
+
+TEMPO_MAP = _track([(0, _tempo(120)), (0, _time_signature(4, 4)), (960, _tempo(90)),
+                    (960, _time_signature(3, 4)), (1440, _tempo(150)), (1440, _time_signature(6, 8))])
+
+RUNNING_STATUS = _track([(0, b'\xc1\x18'), (0, b'\x91\x40\x50'), (240, b'\x43\x50'), (240, b'\x40\x00'),
+                         (0, b'\x47\x60'), (240, b'\x43\x00'), (240, b'\x47\x00'), (0, b'\xb1\x07\x64'),
+                         (120, b'\x0a\x40'), (0, b'\x91\x48\x30'), (480, b'\x48\x00')])
+
+DRUMS = _track([(0, b'\xc9\x00')] + [event for i in range(8) for event in
+                                     ((0 if i == 0 else 120, bytes([0x99, 36 + (i % 3) * 2, 100])),
+                                      (120, bytes([0x89, 36 + (i % 3) * 2, 0])))])
+
+# note 60 struck again before it was released, then released twice
+OVERLAPPING = _track([(0, b'\xc2\x28'), (0, b'\x92\x3c\x40'), (100, b'\x92\x3c\x50'), (100, b'\x82\x3c\x00'),
+                      (100, b'\x82\x3c\x00'), (0, b'\x92\x3c\x60'), (50, b'\x92\x3c\x00'), (0, b'\x92\x3e\x45'),
+                      (200, b'\x92\x3c\x70'), (10, b'\x82\x3e\x00'), (300, b'\x82\x3c\x00')])
+
+FILES = {
+    'tempo_and_meter_changes': _smf([TEMPO_MAP, _track(_scale(n=40))]),
+    'running_status': _smf([_track([(0, _tempo(100))]), _track(_scale(n=8)), RUNNING_STATUS]),
+    'drum_channel': _smf([_track([(0, _tempo(110))]), _track(_scale(program=33, n=12)), DRUMS]),
+    'overlapping_notes': _smf([_track([(0, _tempo(80))]), _track(_scale(n=6)), OVERLAPPING]),
+    'resolution_96': _smf([TEMPO_MAP, _track(_scale(n=20, step=48))], resolution=96),
+}
+
+
+def _pretty_midi_notes(midi: pretty_midi.PrettyMIDI) -> np.ndarray:
+    return np.array(sorted((note.start, note.end, note.pitch, note.velocity, instrument.program, instrument.is_drum)
+                           for instrument in midi.instruments for note in instrument.notes))
+
+
+def _native_notes(arrays) -> np.ndarray:
+    return np.array(sorted(zip(arrays.start, arrays.end, arrays.pitch, arrays.velocity, arrays.program,
+                               arrays.is_drum)))
+
+
+@pytest.mark.parametrize('name', sorted(FILES))
+def test_parity_with_pretty_midi(name):
+    data = FILES[name]
+    native = read_midi(data)
+    reference = pretty_midi.PrettyMIDI(io.BytesIO(data))
+
+    assert native.resolution == reference.resolution
+    np.testing.assert_allclose(_native_notes(native), _pretty_midi_notes(reference), rtol=1e-12)
+    for native_values, reference_values in zip(native.get_tempo_changes(), reference.get_tempo_changes()):
+        np.testing.assert_allclose(native_values, reference_values, rtol=1e-12)
+    assert native.get_end_time() == pytest.approx(reference.get_end_time(), rel=1e-12)
+    np.testing.assert_allclose(native.get_beats(), reference.get_beats(), rtol=1e-12)
+    np.testing.assert_allclose(native.get_downbeats(), reference.get_downbeats(), rtol=1e-12)
+    np.testing.assert_allclose(native.get_onsets(), reference.get_onsets(), rtol=1e-12)
+    assert native.estimate_tempo() == pytest.approx(reference.estimate_tempo(), rel=1e-12)
+
+
+@pytest.mark.parametrize('name', sorted(FILES))
+def test_feature_parity_with_pretty_midi(name):
+    native = feature_engineering_single_file(FILES[name], backend='native')
+    reference = feature_engineering_single_file(FILES[name], backend='pretty_midi')
+    assert native is not None and reference is not None
+    np.testing.assert_allclose(native, reference, rtol=1e-12)
+
+
+def test_drum_notes_are_flagged():
+    arrays = read_midi(FILES['drum_channel'])
+    assert arrays.is_drum.sum() == 8
+    assert set(arrays.pitch[arrays.is_drum]) == {36, 38, 40}
+
+
+def test_time_signatures_follow_the_first_track():
+    arrays = read_midi(FILES['tempo_and_meter_changes'])
+    assert [(numerator, denominator) for numerator, denominator, _ in arrays.time_signatures] == \
+           [(4, 4), (3, 4), (6, 8)]
+    # tempi are stored as whole microseconds per quarter note
+    np.testing.assert_allclose(arrays.tempi, [120, 90, 150], rtol=1e-6)
+
+
+CORRUPT = {
+    'not_midi': b'RIFF' + bytes(40),
+    'truncated_header': b'MThd\x00\x00\x00\x02\x00\x01',
+    'truncated_track': FILES['running_status'][:-7],
+    'missing_end_of_track': _smf([_track([(0, b'\x90\x3c\x40'), (480, b'\x80\x3c')], end_of_track=False)]),
+    'missing_track': FILES['drum_channel'].replace(b'MTrk', b'XTrk', 1),
+    'data_byte_out_of_range': _smf([_track([(0, b'\x90\x3c\xc0'), (480, b'\x80\x3c\x00')])]),
+}
+
+
+@pytest.mark.parametrize('name', sorted(CORRUPT))
+def test_corrupt_files_raise_parse_error(name):
+    with pytest.raises(MidiParseError):
+        read_midi(CORRUPT[name])
+
+
+@pytest.mark.parametrize('name', sorted(CORRUPT))
+def test_corrupt_files_fall_back_to_pretty_midi(name, monkeypatch):
+    calls = []
+    original = pretty_midi.PrettyMIDI
+
+    def spy(midi_file=None, *args, **kwargs):
+        calls.append(midi_file)
+        return original(midi_file, *args, **kwargs)
+
+    monkeypatch.setattr(pretty_midi, 'PrettyMIDI', spy)
+    # pretty_midi rejects them as well, so the file is dropped rather than the extraction failing
+    assert feature_engineering_single_file(CORRUPT[name], backend='native') is None
+    assert len(calls) == 1
+
+
+def test_fallback_result_is_used(monkeypatch):
+    def reject(file_path):
+        raise MidiParseError('rejected')
+
+    monkeypatch.setattr(feature_engineering, 'read_midi', reject)
+    data = FILES['tempo_and_meter_changes']
+    assert isinstance(feature_engineering._load_track(data, 'native'), pretty_midi.PrettyMIDI)
+    np.testing.assert_allclose(feature_engineering_single_file(data, backend='native'),
+                               feature_engineering_single_file(data, backend='pretty_midi'), rtol=1e-12)
@@ -0,0 +1,64 @@
+import os
+import yaml
+import pytest
+from pipeline import STAGE_NAMES, run_pipeline
+from synthetic_midi import synthetic_midi
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _rebase(section: dict, root) -> None:
+    for key, value in section.items():
+        if isinstance(value, str) and value.startswith('Artifacts/'):
+            section[key] = str(root / value)
+        elif isinstance(value, dict):
+            _rebase(value, root)
+
+
+@pytest.fixture
+def parameters(tmp_path):
+    # parameters.yaml with its artifacts under tmp_path and a small corpus of two composers
+    for folder, seeds in (('train/Bach', range(6)), ('train/Chopin', range(100, 106)), ('test', range(500, 503))):
+        os.makedirs(tmp_path / folder)
+        for seed in seeds:
+            with open(tmp_path / folder / f'{seed}.mid', 'wb') as f:
+                f.write(synthetic_midi(150, duration=20., seed=seed))
+    with open(os.path.join(REPO, 'parameters.yaml')) as f:
+        parameters = yaml.safe_load(f)
+    _rebase(parameters, tmp_path)
+    parameters['data'] = {'training': str(tmp_path / 'train'), 'testing': str(tmp_path / 'test')}
+    for section in ('feature_engineering', 'dedup', 'training'):
+        parameters[section]['n_workers'] = 1
+    return parameters
+
+
+def _statuses(parameters: dict) -> list:
+    report = run_pipeline(parameters)
+    return [name for name in STAGE_NAMES if report[name]['status'] == 'ran']
+
+
+def test_stages_rerun_only_after_a_change(parameters, tmp_path):
+    assert _statuses(parameters) == STAGE_NAMES
+    # ingest always runs, to notice changes of the sources
+    assert _statuses(parameters) == ['ingest']
+
+    # a touched file is listed again with its new mtime, from which the feature stores come out identical
+    path = tmp_path / 'train' / 'Bach' / '0.mid'
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert _statuses(parameters) == ['ingest', 'dedup', 'extract', 'windows']
+
+    with open(tmp_path / 'train' / 'Chopin' / 'new.mid', 'wb') as f:
+        f.write(synthetic_midi(150, duration=20., seed=999))
+    assert _statuses(parameters) == STAGE_NAMES
+    assert _statuses(parameters) == ['ingest']
+
+
+def test_parameters_and_missing_outputs_rerun_their_stages(parameters):
+    run_pipeline(parameters)
+    parameters['training']['if_n_estimators'] = 50
+    assert _statuses(parameters) == ['ingest', 'train', 'score']
+
+    os.remove(parameters['artifacts']['Results_summary'])
+    assert _statuses(parameters) == ['ingest', 'score']
+    assert run_pipeline(parameters, ['score'], force=True)['score']['status'] == 'ran'
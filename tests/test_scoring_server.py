@@ -0,0 +1,115 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from model_registry import CORPUS, ModelCache, save_model
+from scoring_server import ScoringServer
+
+NAME = 'model_Isolation_Forest'
+
+
+def _save_version(registry: str, feature_names: list = ('a', 'b', 'c')) -> dict:
+    model = IsolationForest(n_estimators=5, random_state=0).fit(np.random.default_rng(0).normal(size=(50, 3)))
+    return save_model(registry, CORPUS, NAME, model, {'feature_names': list(feature_names)})
+
+
+async def _ask(socket_path: str, request: dict) -> dict:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(json.dumps(request).encode() + b'\n')
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    return reply
+
+
+def test_model_cache_refresh_drops_stale_versions(tmp_path):
+    registry = str(tmp_path / 'models')
+    _save_version(registry)
+    cache = ModelCache(registry)
+    first = cache.get(CORPUS, NAME)
+    assert cache.refresh() == []
+
+    _save_version(registry)
+    assert cache.get(CORPUS, NAME) is first
+    assert cache.refresh() == [NAME]
+    assert cache.versions() == {NAME: 2}
+    assert cache.get(CORPUS, NAME) is not first
+    assert cache.counters['refreshes'] == 3 and cache.counters['loads'] == 2
+
+
+def test_model_cache_refuses_versions_of_another_schema(tmp_path, capsys):
+    registry = str(tmp_path / 'models')
+    _save_version(registry, ['a', 'c', 'b'])
+    assert ModelCache(registry, schema={'feature_names': ['a', 'b', 'c']}).versions() == {}
+
+    _save_version(registry)
+    cache = ModelCache(registry, schema={'feature_names': ['a', 'b', 'c']})
+    assert cache.versions() == {NAME: 2}
+    _save_version(registry, ['a', 'b'])
+    capsys.readouterr()
+    # the previous version keeps being served, and the refusal is reported once
+    assert cache.refresh() == [] and cache.refresh() == []
+    assert cache.versions() == {NAME: 2} and cache.counters['refused'] == 1
+    assert capsys.readouterr().out.count('version 3 refused') == 1
+    assert cache.get(CORPUS, NAME) is not None
+
+    # checked again when loaded
+    cache = ModelCache(registry)
+    cache.schema = {'feature_names': ['a', 'b', 'c']}
+    with pytest.raises(ValueError, match='fitted with feature_names'):
+        cache.get(CORPUS, NAME)
+
+
+def test_running_server_picks_up_new_versions(tmp_path):
+    registry = str(tmp_path / 'models')
+    socket_path = str(tmp_path / 'server.sock')
+    _save_version(registry)
+    server = ScoringServer(ModelCache(registry), {}, n_workers=1, refresh_s=0.05)
+
+    async def run() -> tuple:
+        serving = asyncio.create_task(server.serve(unix_socket=socket_path))
+        await asyncio.sleep(0.1)
+        before = await _ask(socket_path, {'stats': True})
+        _save_version(registry)
+        await asyncio.sleep(0.2)
+        after = await _ask(socket_path, {'stats': True})
+        _save_version(registry)
+        refreshed = await _ask(socket_path, {'refresh': True})
+        serving.cancel()
+        return before, after, refreshed
+
+    before, after, refreshed = asyncio.run(run())
+    assert before['model_versions'] == {NAME: 1}
+    # picked up by the periodic refresh, without any request asking for it
+    assert after['model_versions'] == {NAME: 2}
+    assert after['model_cache']['refreshes'] > before['model_cache']['refreshes']
+    assert after['model_cache']['refreshed_at'] is not None
+    # the periodic refresh may have got there first
+    assert refreshed['versions'] == {NAME: 3} and refreshed['updated'] in ([NAME], [])
+
+
+def test_long_requests_are_read_or_answered_with_an_error(tmp_path):
+    registry = str(tmp_path / 'models')
+    socket_path = str(tmp_path / 'server.sock')
+    _save_version(registry)
+    server = ScoringServer(ModelCache(registry), {}, n_workers=1, refresh_s=0, max_request_mb=0.5)
+
+    async def run() -> list:
+        serving = asyncio.create_task(server.serve(unix_socket=socket_path))
+        await asyncio.sleep(0.1)
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        replies = []
+        # over the 64 KiB default of asyncio streams, then over the limit, then a short one on the same connection
+        for padding in (200_000, 1_000_000, 0):
+            writer.write(json.dumps({'stats': True, 'padding': 'x' * padding}).encode() + b'\n')
+            await writer.drain()
+            replies.append(json.loads(await reader.readline()))
+        writer.close()
+        serving.cancel()
+        return replies
+
+    long, too_long, short = asyncio.run(run())
+    assert long['model_versions'] == {NAME: 1}
+    assert too_long == {'error': f'request longer than {2 ** 19} bytes'}
+    assert short['errors'] == 1
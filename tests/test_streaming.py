@@ -0,0 +1,127 @@
+import os
+import yaml
+import numpy as np
+import pytest
+from feature_engineering import feature_names
+from feature_store import open_feature_store
+from inference import load_models
+from manifest import build_manifest, save_manifest
+from model_registry import WINDOW
+from streaming import (WindowStatistics, extract_window_features, midi_file_events, read_events, score_stream,
+                       stream_windows)
+from synthetic_midi import synthetic_midi
+from training import MODEL_NAMES, fit_model
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def window_models(tmp_path_factory):
+    # window models of parameters.yaml fitted on a small synthetic corpus of two minute files
+    root = tmp_path_factory.mktemp('streaming')
+    os.makedirs(root / 'source' / 'Composer')
+    for seed in range(12):
+        with open(root / 'source' / 'Composer' / f'piece_{seed}.mid', 'wb') as f:
+            f.write(synthetic_midi(1200, n_instruments=3, duration=120., n_tempo_changes=2, seed=seed))
+    with open(os.path.join(REPO, 'parameters.yaml')) as f:
+        parameters = yaml.safe_load(f)
+    parameters['dedup']['enabled'] = False
+    parameters['manifests']['training'] = str(root / 'training.json')
+    parameters['artifacts'].update(training_windows=str(root / 'windows'), models=str(root / 'models'))
+    parameters['feature_engineering']['n_workers'] = 1
+    save_manifest(parameters['manifests']['training'], build_manifest(str(root / 'source')))
+
+    report = extract_window_features(parameters)
+    assert report['files'] == 12 and not report['unparsed']
+    for name in MODEL_NAMES:
+        fit_model(name, parameters, WINDOW)
+    return parameters, root
+
+
+def _statistics(parameters: dict) -> WindowStatistics:
+    settings = parameters['streaming']
+    return WindowStatistics(settings['window_s'], settings['hop_s'], settings['relative_accuracy'],
+                            resolution=settings['resolution'])
+
+
+def test_window_store_holds_the_windows_of_every_file(window_models):
+    parameters, _ = window_models
+    store = open_feature_store(parameters['artifacts']['training_windows'])
+    assert store.feature_names == feature_names(parameters['features']['groups'])
+    assert len(set(store.file_ids)) == 12
+    # a full window every training_hop_s seconds of a two minute file, and the one ending at its last event
+    settings = parameters['streaming']
+    per_file = (120 - settings['window_s']) / settings['training_hop_s'] + 2
+    assert store.features.shape[0] == pytest.approx(12 * per_file, rel=.15)
+    assert not np.isnan(store.features).any()
+
+
+def test_replayed_training_file_is_mostly_inliers(window_models):
+    parameters, root = window_models
+    columns = feature_names(parameters['features']['groups'])
+    models = load_models(parameters['artifacts']['models'], [WINDOW], columns)
+    assert sorted(models) == sorted(f'{WINDOW}/{name}' for name in MODEL_NAMES)
+
+    events = midi_file_events(str(root / 'source' / 'Composer' / 'piece_3.mid'))
+    records = list(score_stream(events, models, columns, _statistics(parameters)))
+    assert len(records) >= 85
+    for name in models:
+        inliers = np.mean([record['models'][name]['label'] == 1 for record in records])
+        assert inliers >= .8, f'{name}: {inliers:.0%} of the windows of a training file are inliers'
+
+
+def test_window_models_are_not_whole_file_models(window_models):
+    parameters, _ = window_models
+    # a registry without corpus models gives no window models to the scorers of whole files
+    assert load_models(parameters['artifacts']['models'], 'all') == {}
+
+
+def test_invalid_events_are_skipped_and_counted(tmp_path):
+    lines = ['{"time": 0.0, "type": "set_tempo", "tempo": 500000}',
+             '{"time": 0.5, "type": "note_on", "channel": 0, "pitch": 60, "velocity": 90}',
+             'not json',
+             '[1, 2]',
+             '{"time": 0.6, "type": "note_on", "velocity": 90}',
+             '{"time": 0.7, "type": "note_on", "pitch": 300, "velocity": 90}',
+             '{"time": 0.8, "type": "note_on", "pitch": 61, "velocity": 200}',
+             '{"time": 0.9, "type": "note_on", "channel": 16, "pitch": 61, "velocity": 20}',
+             '{"time": "soon", "type": "note_off", "pitch": 60}',
+             '{"time": 1.0, "type": "program_change", "channel": 0}',
+             '{"time": 1.0, "type": "set_tempo", "tempo": 0}',
+             '{"time": 1.0, "type": "time_signature", "numerator": 3, "denominator": 3}',
+             '{"time": 1.0, "type": "pitch_bend", "value": 3}',
+             '{"time": 1.2, "type": "note_on", "pitch": 61.0, "velocity": 0}',
+             '{"time": 1.5, "type": "note_off", "channel": 0, "pitch": 60}']
+    path = tmp_path / 'events.jsonl'
+    path.write_text('\n'.join(lines) + '\n')
+    counters = {}
+    events = list(read_events(str(path), follow=False, counters=counters))
+    assert counters == {'events': 4, 'invalid': 11}
+    assert [event['type'] for event in events] == ['set_tempo', 'note_on', 'note_on', 'note_off']
+    # optional fields are filled in
+    assert events[2]['channel'] == 0
+    statistics = WindowStatistics(window_s=1., hop_s=.5)
+    list(stream_windows(events, statistics))
+    assert statistics.time == 1.5 and statistics.held == {}
+
+
+def test_long_gap_costs_at_most_one_window_of_hops():
+    events = list(midi_file_events(synthetic_midi(300, duration=60., seed=1)))
+    end = max(event['time'] for event in events)
+
+    def windows(gap: float) -> list:
+        statistics = WindowStatistics(30., 1.)
+        closed = []
+        for event in events:
+            closed += statistics.add(event)
+        resumed = [dict(event, time=event['time'] + end + gap) for event in events]
+        # the hops of the gap that still have events of the first part in their window, no more
+        assert len(statistics.add(resumed[0])) <= statistics.n_panes + 1
+        return [(start - (end + gap), stop - (end + gap), values) for start, stop, values in
+                stream_windows(resumed, statistics) if start >= end + gap]
+
+    after_short_gap, after_long_gap = windows(100.), windows(1e6)
+    assert len(after_short_gap) == len(after_long_gap) > 10
+    for (start, stop, values), (long_start, long_stop, long_values) in zip(after_short_gap, after_long_gap):
+        assert (start, stop) == pytest.approx((long_start, long_stop), abs=1e-6)
+        assert list(values.values()) == pytest.approx(list(long_values.values()), rel=1e-6)
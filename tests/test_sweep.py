@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import LocalOutlierFactor
+from feature_store import create_feature_store, append_rows
+from sweep import _forest_unit, _load_rows, _lof_unit, _scaled
+
+
+@pytest.fixture
+def parameters(tmp_path):
+    rng = np.random.default_rng(0)
+    artifacts = {}
+    for name, rows in (('training', rng.normal(size=(300, 5))),
+                       ('testing', np.vstack([rng.normal(size=(60, 5)), 3 * rng.normal(size=(20, 5))]))):
+        artifacts[name] = str(tmp_path / name)
+        create_feature_store(artifacts[name], [f'f{i}' for i in range(5)], '1')
+        append_rows(artifacts[name], [f'{name}/{i}.mid' for i in range(len(rows))], rows)
+    return {'artifacts': artifacts}
+
+
+@pytest.mark.parametrize('scaling, metric', [('none', 'cosine'), ('standard', 'euclidean')])
+def test_lof_from_the_shared_graph_matches_a_fit_per_config(parameters, scaling, metric):
+    X_train, X_test = _scaled(*_load_rows(parameters), scaling)
+    for config, scores, _ in _lof_unit(parameters, scaling, metric, [5, 20]):
+        lof = LocalOutlierFactor(n_neighbors=config['lof_n_neighbors'], novelty=True, metric=metric).fit(X_train)
+        np.testing.assert_array_equal(scores, lof.decision_function(X_test))
+        assert ((scores < 0) == (lof.predict(X_test) == -1)).all()
+
+
+def test_forest_offsets_match_a_fit_per_contamination(parameters):
+    X_train, X_test = _load_rows(parameters)
+    for config, scores, _ in _forest_unit(parameters, 20, 64, ['auto', 0.05, 0.2]):
+        forest = IsolationForest(n_estimators=20, max_samples=64, contamination=config['if_contamination'],
+                                 random_state=0).fit(X_train)
+        np.testing.assert_array_equal(scores, forest.decision_function(X_test))
@@ -0,0 +1,67 @@
+import json
+import numpy as np
+from feature_store import open_feature_store
+
+
+def _pyplot():
+    # imported on first use and without a display, plots are only written to files
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_feature_histograms(store_path: str, output_path: str) -> None:
+    """
+    Histogram of every feature of a feature store, one panel per column.
+
+    Input 1     : Path of the feature store (see feature_store.py)
+    Input_type  : String
+
+    Input 2     : Path of the image written
+    Input_type  : String
+    """
+    plt = _pyplot()
+    store = open_feature_store(store_path)
+    n_columns = len(store.feature_names)
+    n_rows = -(-n_columns // 5)
+    figure = plt.figure(figsize=(15, 2 * n_rows))
+    for i, name in enumerate(store.feature_names):
+        ax = figure.add_subplot(n_rows, 5, i + 1)
+        ax.hist(np.asarray(store.features[:, i]))
+        ax.set_title(name)
+    figure.subplots_adjust(left=0.1, bottom=0.1, right=0.9, top=0.9, wspace=0.4, hspace=0.4)
+    figure.savefig(output_path)
+    plt.close(figure)
+
+
+def plot_decision_scores(results_path: str, output_path: str) -> None:
+    """
+    Sorted decision scores of the test files under each model, from the predictions written by
+    inference.score_in_chunks; files below the red line are the outliers.
+
+    Input 1     : Path of the JSON lines predictions
+    Input_type  : String
+
+    Input 2     : Path of the image written
+    Input_type  : String
+    """
+    plt = _pyplot()
+    scores = {}
+    with open(results_path) as f:
+        for line in f:
+            record = json.loads(line)
+            for name, value in record.items():
+                if isinstance(value, dict):
+                    scores.setdefault(name, []).append(value['score'])
+    figure = plt.figure(figsize=(6 * max(1, len(scores)), 4))
+    for i, (name, model_scores) in enumerate(scores.items()):
+        ax = figure.add_subplot(1, len(scores), i + 1)
+        ax.scatter(np.arange(len(model_scores)), sorted(model_scores))
+        ax.axhline(y=0, color='r', linestyle='-')
+        ax.set_title(name, fontsize=16)
+        ax.set_xlabel('Individual Datapoint instance', fontsize=16)
+        ax.set_ylabel('Decision Score', fontsize=16)
+    figure.subplots_adjust(left=0.1, bottom=0.15, right=0.9, top=0.9, wspace=0.4, hspace=0.4)
+    figure.savefig(output_path)
+    plt.close(figure)